@@ -14,6 +14,6 @@ Usage:
 """
 from .main import main
 from .utilities.command_line_options import parse_arguments
-from .services.directory_processor import get_ignore_list, should_ignore, process_directory
+from .services.directory_processor import get_ignore_list, should_ignore, process_directory, catalog_directory
 from .services.tar_service import create_tar
 from .services.zip_service import create_zip
@@ -8,15 +8,35 @@ This module handles the core logic of the BakZIP CLI application, including:
 - Creating the backup archive (ZIP or TAR) based on user preferences.
 - Providing feedback to the user on the backup process.
 """
+import argparse
+import contextlib
 import os
+import stat
+import sys
 import time
-import traceback
 import getpass
-import pyfiglet
-from bakzip.utilities.command_line_options import parse_arguments
-from bakzip.services.directory_processor import process_directory
+from bakzip.utilities import progress
+from bakzip.utilities.command_line_options import parse_arguments, parse_job_options
+from bakzip.utilities.metrics import Metrics, run_profiled
+from bakzip.services.directory_processor import ScanStats, catalog_directory, iter_directory
+from bakzip.services.file_catalog import FileCatalog
+from bakzip.services.auto_tune import AUTO, DEFAULT_TARGET, AutoTuner, parse_target, sample_data
+from bakzip.services.zip_dictionary import sample_files, train_dictionary
+from bakzip.services.ignore_report import IgnoreReport
+from bakzip.services.dedup import Deduplicator
+from bakzip.services.pipeline import bounded_prefetch
+from bakzip.services.manifest import ManifestBuilder, archive_name, load_manifest, write_manifest
+from bakzip.services.restore_service import restore_chain
+from bakzip.services.chunk_store import backup_to_repository
+from bakzip.services.codecs import resolve_compression
 from bakzip.services.zip_service import create_zip
 from bakzip.services.tar_service import create_tar
+from bakzip.services.watch_service import TreeWatcher, apply_journal
+from bakzip.services.job_scheduler import Job, load_job_file, run_jobs
+from bakzip.services.checkpoint import Checkpoint
+
+# The --output value that writes the archive to stdout.
+STDOUT = '-'
 
 def main():
     """
@@ -28,6 +48,11 @@ def main():
     - Creating the backup archive (ZIP or TAR) based on user preferences.
     - Providing feedback to the user on the backup process.
 
+    The banner and progress bars are skipped with --quiet or when the output
+    is not a terminal, so scripted runs stay fast and their logs clean. With
+    `--output -` the archive is written to stdout and everything printed goes
+    to stderr.
+
     Raises:
         ValueError: If an unsupported format is specified.
         Exception: If any other error occurs during the backup process.
@@ -35,65 +60,367 @@ def main():
     # Set restrictive umask (0o077) to ensure all created files (archives and logs)
     # have restrictive permissions (0o600 for files, 0o700 for directories).
     os.umask(0o077)
-    result = pyfiglet.figlet_format("BakZIP", font = "slant")
-    print(result)
-    print('by @smx27 Github: @smx27')
     args = parse_arguments()
+    if args.output == STDOUT:
+        stream = sys.stdout.buffer
+        with contextlib.redirect_stdout(sys.stderr):
+            _main(args, stream)
+    else:
+        _main(args)
+
+def _main(args, stream=None):
+    progress.set_quiet(args.quiet)
+    if not args.quiet and sys.stdout.isatty():
+        print_banner()
     password = None
     if args.password:
         password = os.environ.get('BAKZIP_PASSWORD')
         if not password:
             password = getpass.getpass("Enter password to protect the backup file: ")
     directory = args.directory
-    output = args.output or f'backup_{os.path.basename(directory)}'
+    if args.command == 'restore':
+        try:
+            restore_chain(args.archives, directory, password)
+            print(f'Restored {len(args.archives)} archive(s) into: {directory}')
+        except Exception as ex:
+            print(f'An error occurred: {ex}')
+        return
+    if stream is not None and (args.command == 'watch' or args.job_file):
+        print('An error occurred: --output - is only supported for a single backup')
+        return
+    if args.command == 'watch':
+        run_watch(args, password)
+        return
+    if args.job_file:
+        run_job_file(args, password)
+        return
+    metrics = Metrics() if args.metrics_file or args.verbose else None
+    with contextlib.ExitStack() as stack:
+        if stream is None and is_pipe(args.output):
+            stream = stack.enter_context(open(args.output, 'wb'))
+        if args.profile:
+            run_profiled(run_backup, args.profile, args, password, metrics, stream)
+            print(f'Profile written to: {args.profile}')
+        else:
+            run_backup(args, password, metrics, stream)
+    if metrics and args.metrics_file:
+        try:
+            metrics.write(args.metrics_file, args.metrics_format)
+            print(f'Metrics written to: {args.metrics_file}')
+        except OSError as ex:
+            print(f'Failed to write metrics to {args.metrics_file}: {ex}')
+
+def print_banner():
+    """Prints the BakZIP banner. pyfiglet is slow to import, so it is only loaded here."""
+    import pyfiglet
+    result = pyfiglet.figlet_format("BakZIP", font = "slant")
+    print(result)
+    print('by @smx27 Github: @smx27')
+
+def archive_path(args, output, password=None):
+    """
+    Returns the path of a ZIP or TAR archive, adding the extension of the format and codec.
+
+    Encrypted TAR archives get an extra `.enc` extension, as other tools cannot read them.
+
+    Raises:
+        ValueError: If the TAR codec is unknown or unavailable, or the encryption is invalid.
+    """
+    if args.encryption == 'rsa':
+        raise ValueError("RSA encryption is not supported; use --encryption aes with --password")
+    if args.encryption == 'aes' and not password:
+        raise ValueError("--encryption aes needs --password")
     if args.format == 'zip':
-        output += '.zip'
-    elif args.format == 'tar':
-        output += '.tar'
-        if args.compression == 'gz':
-            output += '.gz'
+        if password and args.compression == 'zstd':
+            raise ValueError("Password-protected ZIP archives cannot use the zstd codec; use --format tar")
+        return output + '.zip'
+    codec, _ = resolve_compression(args.compression, 'tar', args.level)
+    return output + '.tar' + codec.tar_suffix + ('.enc' if password else '')
+
+def is_pipe(path):
+    """Returns whether a path is a named pipe or character device, which archives are streamed into."""
+    if not path or path == STDOUT:
+        return False
+    try:
+        mode = os.stat(path).st_mode
+    except OSError:
+        return False
+    return stat.S_ISFIFO(mode) or stat.S_ISCHR(mode)
+
+def check_stream_options(args):
+    """
+    Checks that the options of a backup allow writing it to a stream.
+
+    Raises:
+        ValueError: If an option needs an archive file.
+    """
+    if args.manifest or args.incremental:
+        raise ValueError("--manifest and --incremental write a manifest next to the archive and need an archive file")
+    if args.resume:
+        raise ValueError("--resume needs an archive file")
+    if args.dedup and args.format == 'zip':
+        raise ValueError("--dedup reads ZIP payloads back from the archive and needs an archive file")
+
+def open_checkpoint(args, output, password):
+    """
+    Starts the checkpoint journal of a ZIP or TAR backup, or loads it with --resume.
+
+    Returns:
+        Checkpoint: The journal, or None if checkpoints are disabled.
+
+    Raises:
+        ValueError: If the backup cannot be resumed.
+    """
+    if args.checkpoint_interval <= 0 or (args.format == 'tar' and password):
+        if args.resume:
+            raise ValueError("--resume needs --checkpoint-interval and is not supported for encrypted TAR archives")
+        return None
+    # A journal only resumes the backup it was written for.
+    settings = {
+        'directory': os.path.abspath(args.directory),
+        'format': args.format,
+        'compression': args.compression,
+        'level': args.level,
+        'encrypted': bool(password),
+        'incremental': args.incremental,
+        'dictionary': args.dictionary,
+    }
+    if args.resume:
+        return Checkpoint.resume(output, settings, args.checkpoint_interval)
+    return Checkpoint.start(output, settings, args.checkpoint_interval)
+
+def tune_compression(args, catalog):
+    """
+    Resolves `--compression auto` by trial-compressing a sample of the scanned files.
+
+    Args:
+        args (argparse.Namespace): The parsed command-line arguments.
+        catalog (FileCatalog): The files to back up.
+
+    Returns:
+        A tuple of the arguments with the chosen codec and level, and the `AutoTuner`
+        that keeps re-checking them while the archive is written.
+
+    Raises:
+        ValueError: If --target is invalid.
+    """
+    target = parse_target(args.target or DEFAULT_TARGET)
+    tuner = AutoTuner(args.format, target, args.jobs, catalog.total_size())
+    choice = tuner.calibrate(sample_data(catalog))
+    return argparse.Namespace(**{**vars(args), 'compression': choice.codec.name, 'level': choice.level}), tuner
+
+def check_dictionary_options(args, password):
+    """
+    Checks that the options of a backup allow a trained dictionary.
+
+    Raises:
+        ValueError: If --dictionary is combined with another format, codec or a password.
+    """
+    if args.format != 'zip' or args.compression != 'zstd' or password:
+        raise ValueError("--dictionary needs --format zip and --compression zstd, without a password")
+
+def write_archive(args, files, output, password, metrics=None, checkpoint=None, dedup=None, tuner=None,
+                  dictionary=None):
+    """
+    Writes files into a ZIP or TAR archive with the codec options of the parsed arguments.
+
+    With a password, ZIP members are encrypted with WinZip AES and TAR archives
+    are encrypted as a whole in AES-256-GCM chunks. With a `Deduplicator`,
+    duplicate files are not compressed again. With an `AutoTuner`, the codec
+    and level are adjusted while the archive is written. A trained zstd
+    dictionary is stored in a ZIP archive and used for every member.
+
+    Returns:
+        CodecStats: The bytes and time spent in the codec.
+    """
+    if args.format == 'zip':
+        return create_zip(files, output, password, args.compression, base_dir=args.directory,
+                          jobs=args.jobs, adaptive=args.adaptive, level=args.level,
+                          metrics=metrics, read_ahead=args.read_ahead * 1024 * 1024,
+                          read_order=args.read_order, checkpoint=checkpoint, dedup=dedup, tuner=tuner,
+                          dictionary=dictionary)
+    return create_tar(files, output, args.compression, base_dir=args.directory,
+                      jobs=args.jobs, adaptive=args.adaptive, level=args.level,
+                      metrics=metrics, read_ahead=args.read_ahead * 1024 * 1024,
+                      read_order=args.read_order, password=password, checkpoint=checkpoint, dedup=dedup,
+                      tuner=tuner)
+
+def run_backup(args, password, metrics=None, stream=None):
+    """
+    Backs up `args.directory` as described by the parsed arguments.
+
+    With `--compression auto` the tree is scanned into a `FileCatalog` first,
+    so a sample of it can be trial-compressed and a time budget knows the
+    bytes to archive; `--dictionary` scans it first to train the dictionary
+    on a sample of its small files. Otherwise the scan streams into the
+    archive writer.
+
+    Args:
+        args (argparse.Namespace): The parsed command-line arguments.
+        password (str): The archive password, or None.
+        metrics (Metrics, optional): Receives the phase timings and file statistics of the run.
+        stream (file object, optional): A binary stream (stdout, a pipe) receiving the archive
+            instead of a file. Streamed backups are not checkpointed.
+
+    Returns:
+        The path of the archive, or None if the backup failed.
+
+    Raises:
+        ValueError: If an unsupported format is specified.
+    """
+    directory = args.directory
+    output = args.output or f'backup_{os.path.basename(directory)}'
+    verbose = args.verbose
+    log_file_path = os.path.join(os.path.dirname(output), 'bakzip.log')
+    start_time = time.perf_counter()
+    checkpoint = tuner = catalog = dictionary = None
+    samples = 0
+    stats = ScanStats()
+    report = IgnoreReport(du=args.ignore_report == 'du') if args.ignore_report else None
+    if args.format in ('zip', 'tar'):
+        try:
+            # A resumed backup must be started with the same options, so its journal records 'auto'.
+            checkpoint_args = args
+            if args.dictionary:
+                check_dictionary_options(args, password)
+            if args.compression == AUTO or args.dictionary:
+                catalog = FileCatalog(directory)
+                for _ in iter_directory(directory, log_file_path, verbose=verbose, stats=stats, metrics=metrics,
+                                        entries=True, report=report, catalog=catalog):
+                    pass
+            if args.compression == AUTO:
+                args, tuner = tune_compression(args, catalog)
+            if args.dictionary:
+                training = sample_files(catalog)
+                samples = len(training)
+                dictionary = train_dictionary(training, jobs=args.jobs)
+            if stream is None:
+                output = archive_path(args, output, password)
+                checkpoint = open_checkpoint(checkpoint_args, output, password)
+            else:
+                archive_path(args, output, password)  # Checks the codec and encryption options.
+                check_stream_options(args)
+        except (OSError, ValueError) as ex:
+            print(f'An error occurred: {ex}')
+            if report:
+                report.cancel()
+            return None
+    elif args.format == 'repo':
+        # The output is a repository directory that is reused across backups.
+        try:
+            if stream is not None:
+                raise ValueError("Only ZIP and TAR archives can be written to a stream")
+            if password:
+                raise ValueError("Password protection is not supported for the repo format")
+        except ValueError as ex:
+            print(f'An error occurred: {ex}')
+            if report:
+                report.cancel()
+            return None
     else:
         raise ValueError("Unsupported format")
     compression = args.compression
-    verbose = args.verbose
-    log_file_path = os.path.join(os.path.dirname(output), 'bakzip.log')
-    start_time = time.time()
+    manifest = None
+    dedup = Deduplicator() if args.dedup and args.format in ('zip', 'tar') else None
     if verbose:
         print(f'Processing directory: {directory}')
         print(f'Output file: {output}')
         print(f'Password: {"***" if password else "None"}')
         print(f'Compression: {compression}')
+        if tuner:
+            for trial in tuner.trials:
+                print(f'Trial: {trial.codec.name} level {trial.level}: ratio {trial.ratio:.3f}, '
+                      f'{trial.throughput / 1e6:.1f} MB/s per thread')
+        print(f'Level: {args.level if args.level is not None else "default"}')
         print(f'Encryption: {args.encryption}')
         print(f'Format: {args.format}')
+        print(f'Jobs: {args.jobs}')
         print(f'Verbose: {verbose}')
         print(f'Log file: {log_file_path}')
     try:
-        files_to_include, skipped_files, total_skipped_size = process_directory(directory, log_file_path, verbose=verbose)
-        if args.format == 'zip':
-            create_zip(files_to_include, output, password, compression, base_dir=directory)
-        elif args.format == 'tar':
-            create_tar(files_to_include, output, compression, base_dir=directory)
+        # Scanning runs in a background thread and feeds the writer through a
+        # bounded queue, so compression starts before the walk finishes.
+        if catalog is not None:
+            files_to_include = catalog
         else:
-            raise ValueError("Unsupported format")
-        end_time = time.time()
-        total_time = end_time - start_time
-        total_files = len(files_to_include)
-        total_skipped_files = len(skipped_files)
+            files_to_include = iter_directory(directory, log_file_path, verbose=verbose, stats=stats,
+                                              metrics=metrics, entries=True, report=report)
+        if args.incremental or args.manifest:
+            previous = load_manifest(args.incremental)[1] if args.incremental else None
+            base = archive_name(args.incremental) if args.incremental else None
+            manifest = ManifestBuilder(directory, output, previous, base, use_hash=args.hash)
+            files_to_include = manifest.filter(files_to_include)
+        with bounded_prefetch(files_to_include) as files_to_include:
+            if args.format in ('zip', 'tar'):
+                codec_stats = write_archive(args, files_to_include, output if stream is None else stream, password,
+                                            metrics, checkpoint, dedup, tuner, dictionary)
+            elif args.format == 'repo':
+                repo_stats = backup_to_repository(files_to_include, output, directory)
+            else:
+                raise ValueError("Unsupported format")
+        if manifest:
+            manifest.close()
+        if checkpoint:
+            checkpoint.finish()
+        total_time = time.perf_counter() - start_time
+        if metrics:
+            metrics.finish()
+        total_files = stats.included
+        total_skipped_files = stats.skipped
+        total_skipped_size = stats.skipped_size
         print('Backup completed successfully.')
         print(f'Output file: {output}')
         print(f'Total files: {total_files}')
+        if tuner:
+            print(f'Compression: {tuner.summary()}')
+        if args.dictionary:
+            if dictionary is not None:
+                print(f'Dictionary: {len(dictionary)} bytes trained from {samples} files')
+            else:
+                print(f'Dictionary: not trained ({samples} small files sampled), members compressed without one')
+        if dedup:
+            print(f'Duplicate files: {dedup.duplicates} ({dedup.duplicate_bytes} bytes not compressed again)')
+        if args.format == 'repo':
+            print(f'Snapshot: {repo_stats["snapshot"]}')
+            print(f'New chunks: {repo_stats["new_chunks"]} of {repo_stats["chunks"]} '
+                  f'({repo_stats["new_bytes"]} of {repo_stats["bytes"]} bytes written)')
+            print(f'Unchanged files: {repo_stats["unchanged"]} (not read again)')
+        if manifest and args.incremental:
+            print(f'Changed files: {manifest.changed}')
+            print(f'Deleted files: {len(manifest.deleted)}')
         if verbose:
             print(f'Skipped files: {total_skipped_files}')
             print(f'Total skipped size: {total_skipped_size} bytes')
             print(f'Total skipped files: {total_skipped_files}')
+            print(f'Pruned directories: {stats.pruned}')
             print(f'Backup format: {args.format}')
             print(f'Backup encryption: {args.encryption}')
+            if args.format in ('zip', 'tar'):
+                print(f'Codec: {codec_stats.summary()}')
+            if metrics is not None:
+                for line in metrics.summary_lines():
+                    print(line)
 
         print(f'Total time taken: {total_time:.2f} seconds')
+        if report:
+            # Waits for the background sizing of pruned directories, which is not part of the backup time.
+            report.close()
+            print('Ignore rules:')
+            for line in report.lines():
+                print(line)
+        return output
     except Exception as ex:
         print(f'An error occurred: {ex}')
+        if report:
+            report.cancel()
+        if manifest:
+            manifest.discard()
+        if checkpoint:
+            checkpoint.close()
+            print(f'Run the same command with --resume to continue from the last checkpoint in {checkpoint.path}')
         if verbose:
             # Log the traceback to the log file instead of printing it to stdout
+            import traceback
             try:
                 with open(log_file_path, 'a', encoding='utf-8') as log_file:
                     log_file.write(f"\nAn error occurred during the backup process: {ex}\n")
@@ -102,5 +429,164 @@ def main():
             except Exception as log_err:
                 print(f'Failed to log traceback to {log_file_path}: {log_err}')
 
+def _snapshot_args(args, output, sequence, **overrides):
+    # Each archive of a watch session gets its own name; the sequence keeps them unique and ordered.
+    name = f"{output}-{time.strftime('%Y%m%dT%H%M%S')}-{sequence:04d}"
+    return argparse.Namespace(**{**vars(args), 'output': name, 'manifest': True, **overrides})
+
+def _write_delta(args, password, delta_args, base, files, journal):
+    """
+    Archives the changes of a journal as an incremental backup of `base`.
+
+    Returns:
+        The path of the delta archive, or None if nothing changed or it failed.
+    """
+    to_archive, deleted = apply_journal(args.directory, journal, files, use_hash=args.hash)
+    journal.clear()
+    if not to_archive and not deleted:
+        return None
+    start_time = time.perf_counter()
+    try:
+        delta = archive_path(delta_args, delta_args.output, password)
+        write_archive(delta_args, to_archive, delta, password, dedup=Deduplicator() if args.dedup else None)
+        write_manifest(delta, files, deleted, base=archive_name(base))
+    except Exception as ex:
+        print(f'An error occurred: {ex}')
+        # The recorded state may now be ahead of the archives; a scan catches up.
+        journal.request_rescan()
+        return None
+    print(f'Delta archive: {delta} ({len(to_archive)} changed, {len(deleted)} deleted, '
+          f'{time.perf_counter() - start_time:.2f} seconds)')
+    return delta
+
+def run_watch(args, password):
+    """
+    Watches `args.directory` and writes delta archives as it changes.
+
+    A full backup (or an incremental one against --incremental) with a
+    manifest is written first. From then on, inotify reports the changes,
+    and once the first pending change is --interval seconds old or
+    --delta-size MiB of files changed, only the changed files are archived,
+    with a manifest recording the deletions, so `bakzip restore` replays the
+    chain. If events were lost, a regular incremental backup scans the tree.
+    Ctrl+C writes the pending changes and stops.
+
+    Args:
+        args (argparse.Namespace): The parsed command-line arguments.
+        password (str): The archive password, or None.
+    """
+    if args.format not in ('zip', 'tar'):
+        print('An error occurred: Watch mode supports the zip and tar formats')
+        return
+    output = args.output or f'backup_{os.path.basename(args.directory)}'
+    if args.compression == AUTO:
+        # Delta archives are named after their codec, so it is picked once for the whole session.
+        try:
+            args, _ = tune_compression(args, catalog_directory(args.directory, None)[0])
+        except (OSError, ValueError) as ex:
+            print(f'An error occurred: {ex}')
+            return
+        print(f'Compression: {args.compression} level {args.level}')
+    try:
+        watcher = TreeWatcher(args.directory)
+    except OSError as ex:
+        print(f'An error occurred: Cannot watch {args.directory}: {ex}')
+        return
+    sequence = 0
+    try:
+        base = run_backup(_snapshot_args(args, output, sequence), password, Metrics() if args.verbose else None)
+        if base is None:
+            return
+        files = load_manifest(base)[1]
+        print(f'Watching {args.directory} for changes (Ctrl+C to stop)')
+        delta_bytes = args.delta_size * 1024 * 1024
+        try:
+            while True:
+                watcher.poll(timeout=1.0)
+                journal = watcher.journal
+                if not journal or (journal.age() < args.interval and journal.bytes < delta_bytes):
+                    continue
+                sequence += 1
+                if journal.rescan:
+                    # Watch the tree again first, so changes made during the scan are not lost.
+                    watcher.close()
+                    watcher = TreeWatcher(args.directory)
+                    delta = run_backup(_snapshot_args(args, output, sequence, incremental=base), password,
+                                       Metrics() if args.verbose else None)
+                    if delta is not None:
+                        files = load_manifest(delta)[1]
+                else:
+                    delta = _write_delta(args, password, _snapshot_args(args, output, sequence), base, files,
+                                         journal)
+                base = delta or base
+        except KeyboardInterrupt:
+            if watcher.journal.rescan:
+                print(f'Some changes were not archived; run an incremental backup against {base}.')
+            elif watcher.journal:
+                _write_delta(args, password, _snapshot_args(args, output, sequence + 1), base, files,
+                             watcher.journal)
+            print('Watch stopped.')
+    finally:
+        watcher.close()
+
+def _run_job(job, password):
+    metrics = Metrics()
+    output = run_backup(job.args, password, metrics)
+    if output is None:
+        raise RuntimeError('the backup failed')
+    return output, metrics.report()
+
+def _print_job(job):
+    print(f'--- {job.name} ' + '-' * max(0, 60 - len(job.name)))
+    print(job.log, end='')
+    if job.error is not None:
+        print(f'An error occurred: {job.error}')
+
+def run_job_file(args, password):
+    """
+    Runs the backup jobs of `args.job_file` concurrently and prints one combined summary.
+
+    Each job's output is printed as a block when it finishes. Progress bars
+    are skipped, as concurrent bars would garble the terminal.
+
+    Args:
+        args (argparse.Namespace): The parsed command-line arguments.
+        password (str): The archive password, applied to every ZIP job, or None.
+    """
+    try:
+        entries, cpu_limit, io_limit = load_job_file(args.job_file)
+        jobs = []
+        for name, options in entries:
+            try:
+                jobs.append(Job(name, parse_job_options(options)))
+            except ValueError as ex:
+                raise ValueError(f'Job {name}: {ex}') from None
+    except (OSError, ValueError) as ex:
+        print(f'An error occurred: {ex}')
+        return
+    progress.set_quiet(True)
+    start_time = time.perf_counter()
+    finished = run_jobs(jobs, lambda job: _run_job(job, password), cpu_limit, io_limit, on_finish=_print_job)
+    total_time = time.perf_counter() - start_time
+
+    print('Job summary:')
+    print(f'{"Job":<20} {"Status":<7} {"Files":>8} {"Bytes in":>14} {"Bytes out":>14} {"Seconds":>8}  Output')
+    totals = [0, 0, 0]
+    for job in sorted(finished, key=lambda job: job.name):
+        if job.error is not None:
+            print(f'{job.name:<20} {"failed":<7} {"":>8} {"":>14} {"":>14} {job.seconds:>8.2f}')
+            continue
+        output, report = job.result
+        totals[0] += report['files']
+        totals[1] += report['bytes_in']
+        totals[2] += report['bytes_out']
+        print(f'{job.name:<20} {"ok":<7} {report["files"]:>8} {report["bytes_in"]:>14} {report["bytes_out"]:>14} '
+              f'{job.seconds:>8.2f}  {output}')
+    failed = sum(1 for job in finished if job.error is not None)
+    print(f'{"Total":<20} {f"{len(finished) - failed}/{len(finished)}":<7} {totals[0]:>8} {totals[1]:>14} '
+          f'{totals[2]:>14} {total_time:>8.2f}')
+    if failed:
+        print(f'Failed jobs: {failed}')
+
 if __name__ == '__main__':
     main()
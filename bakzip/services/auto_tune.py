@@ -0,0 +1,261 @@
+#! /usr/env/bin python
+"""
+This module picks the compression codec and level of `--compression auto`.
+
+An `AutoTuner` trial-compresses a sample of the scanned files with every
+available codec and level of the archive format and measures the speed
+and ratio on this machine. It then picks the best ratio that still meets
+the target: a throughput (`200MB/s`), or a time budget for the whole backup
+(`30m`), which is turned into the throughput needed for the bytes left.
+
+While the archive is written, the writers report the bytes and codec time
+of each member (ZIP) or segment (TAR). Every `CHECK_BYTES` the measured
+throughput is compared with the estimate and the tuner moves to a faster
+or a stronger setting if it drifted. ZIP members each have their own
+method, so any codec can be picked; a TAR archive keeps its codec and only
+changes the level, starting a new codec stream (a gzip member, zstd frame,
+...) that decompresses as part of the same archive.
+"""
+import io
+import os
+import re
+import stat
+import time
+from collections import namedtuple
+from bakzip.services.codecs import CODECS
+
+AUTO = 'auto'
+DEFAULT_TARGET = '100MB/s'
+
+# The sample is the start of up to SAMPLE_FILES files spread over the scan.
+SAMPLE_FILES = 16
+SAMPLE_SIZE = 64 * 1024
+# The measured throughput is compared with the target after this many input bytes.
+CHECK_BYTES = 64 * 1024 * 1024
+# How far the measured throughput may drift from the target before the settings change.
+TOLERANCE = 0.15
+
+# The settings tried for each format, from the codec registry's names and levels. ZIP only
+# uses the methods common unzip tools read; pick zstd or xz members explicitly.
+CANDIDATES = {
+    'zip': [('store', None), ('deflate', 1), ('deflate', 6), ('deflate', 9), ('bzip2', 9)],
+    'tar': [('store', None), ('lz4', 0), ('zstd', 1), ('zstd', 3), ('zstd', 9), ('zstd', 19), ('gz', 1),
+            ('gz', 6), ('gz', 9), ('bzip2', 9), ('xz', 1), ('xz', 6), ('xz', 9)],
+}
+
+# Codecs using all `jobs` threads in a TAR archive; ZIP compresses every member in the worker pool.
+_PARALLEL_TAR_CODECS = ('gz', 'deflate', 'zstd')
+
+_UNITS = {'': 1, 'k': 1e3, 'm': 1e6, 'g': 1e9, 'ki': 1 << 10, 'mi': 1 << 20, 'gi': 1 << 30}
+_THROUGHPUT = re.compile(r'^([\d.]+)\s*([kmg]i?)?b/s$')
+_DURATION = re.compile(r'^([\d.]+)\s*(s|m|min|h)?$')
+_SECONDS = {None: 1, 's': 1, 'm': 60, 'min': 60, 'h': 3600}
+
+Target = namedtuple('Target', ['throughput', 'seconds'])
+Target.__doc__ = """A throughput to sustain in bytes/s, or a time budget in seconds for the whole backup (the other is None)."""
+
+Trial = namedtuple('Trial', ['codec', 'level', 'throughput', 'ratio'])
+Trial.__doc__ = """A codec and level with its measured single-thread throughput (bytes/s) and compressed size ratio."""
+
+
+def parse_target(text):
+    """
+    Parses a --target value.
+
+    Args:
+        text (str): A throughput such as '200MB/s' or '1.5GiB/s', or a duration such as '30m',
+            '2h' or '90s' (plain numbers are seconds).
+
+    Returns:
+        Target: The parsed target.
+
+    Raises:
+        ValueError: If the value is neither.
+    """
+    value = text.strip().lower()
+    match = _THROUGHPUT.match(value)
+    if match:
+        throughput = float(match.group(1)) * _UNITS[match.group(2) or '']
+        if throughput > 0:
+            return Target(throughput, None)
+    match = _DURATION.match(value)
+    if match and float(match.group(1)) > 0:
+        return Target(None, float(match.group(1)) * _SECONDS[match.group(2)])
+    raise ValueError(f"Invalid compression target: {text} (expected e.g. 200MB/s or 30m)")
+
+
+def sample_data(catalog, files=SAMPLE_FILES, size=SAMPLE_SIZE):
+    """
+    Reads the start of a few regular files spread evenly over a `FileCatalog`.
+
+    Returns:
+        A list of bytes, one per file that could be read.
+    """
+    indexes = [index for index in range(len(catalog)) if _is_sampled(catalog.stat(index))]
+    step = max(1, len(indexes) // files)
+    samples = []
+    for index in indexes[::step][:files]:
+        try:
+            with open(catalog.path(index), 'rb') as f:
+                samples.append(f.read(size))
+        except OSError:
+            continue
+    return samples
+
+
+def _is_sampled(st):
+    return st is not None and stat.S_ISREG(st.st_mode) and st.st_size > 0
+
+
+def _trial_compress(codec, level, archive_format, samples):
+    # ZIP compresses each member on its own; TAR compresses one stream.
+    started = time.perf_counter()
+    if archive_format == 'zip':
+        size = 0
+        for sample in samples:
+            compressor = codec.compressobj(level)
+            size += len(compressor.compress(sample)) + len(compressor.flush())
+    else:
+        buffer = io.BytesIO()
+        stream = codec.tar_stream(buffer, level, 1)
+        for sample in samples:
+            stream.write(sample)
+        if stream is not buffer:
+            stream.close()
+        size = len(buffer.getvalue())
+    return time.perf_counter() - started, size
+
+
+class AutoTuner:
+    """
+    Picks and re-checks the codec and level of an archive against a target.
+
+    Call `calibrate` with sample data first; `choice` is then the current
+    setting. Writers call `record` with the input bytes and codec seconds of
+    what they compressed, which may change `choice` for later members.
+
+    Args:
+        archive_format (str): 'zip' or 'tar'.
+        target (Target): The throughput or time budget to meet.
+        jobs (int, optional): The compression threads of the run (0 for one per CPU core).
+        total_bytes (int, optional): The bytes to archive, which a time budget needs.
+
+    Attributes:
+        choice (Trial): The current codec and level.
+        trials (list): The `Trial` of every candidate, from `calibrate`.
+        changes (int): How often the setting changed during the run.
+    """
+
+    def __init__(self, archive_format, target, jobs=1, total_bytes=None):
+        self.archive_format = archive_format
+        self.target = target
+        self.jobs = jobs or os.cpu_count() or 1
+        self.total_bytes = total_bytes or 0
+        self.trials = []
+        self.choice = None
+        self.changes = 0
+        self.done_bytes = 0
+        # How much faster (or slower) the codecs run in the backup than in the trials.
+        # A time budget counts from here, so it includes the calibration.
+        self.correction = 1.0
+        self._bytes = 0
+        self._seconds = 0.0
+        self._started = time.perf_counter()
+
+    def calibrate(self, samples):
+        """
+        Trial-compresses the samples with every available candidate and picks the first setting.
+
+        Args:
+            samples (list): The sample data, e.g. from `sample_data`.
+
+        Returns:
+            Trial: The chosen codec and level.
+        """
+        data_size = sum(len(sample) for sample in samples)
+        self.trials = []
+        for name, level in CANDIDATES[self.archive_format]:
+            codec = CODECS.get(name)
+            if codec is None or not codec.available:
+                continue
+            level = codec.check_level(level)
+            seconds, size = _trial_compress(codec, level, self.archive_format, samples)
+            throughput = data_size / seconds if seconds > 0 and data_size else float('inf')
+            self.trials.append(Trial(codec, level, throughput, size / data_size if data_size else 1.0))
+        self.choice = self._pick(self.required_throughput())
+        return self.choice
+
+    def restrict(self, codec_name):
+        """Keeps only the levels of one codec, for archives that cannot change codec midway."""
+        self.trials = [trial for trial in self.trials if trial.codec.name == codec_name] or self.trials
+        if self.choice not in self.trials:
+            self.choice = self._pick(self.required_throughput())
+
+    def parallelism(self, trial):
+        """Returns the number of threads compressing with a setting."""
+        if self.archive_format == 'zip' or trial.codec.name in _PARALLEL_TAR_CODECS:
+            return self.jobs
+        return 1
+
+    def estimate(self, trial):
+        """Returns the expected throughput of a setting in this run, in bytes/s."""
+        return trial.throughput * self.parallelism(trial) * self.correction
+
+    def required_throughput(self):
+        """Returns the throughput the target needs now, in bytes/s."""
+        if self.target.throughput is not None:
+            return self.target.throughput
+        remaining = self.target.seconds - (time.perf_counter() - self._started)
+        return max(self.total_bytes - self.done_bytes, 0) / max(remaining, 1.0)
+
+    def _pick(self, required, margin=1.0):
+        fast_enough = [trial for trial in self.trials if self.estimate(trial) >= required * margin]
+        if fast_enough:
+            return min(fast_enough, key=lambda trial: (trial.ratio, -trial.throughput))
+        return max(self.trials, key=self.estimate)
+
+    def record(self, bytes_in, seconds, elapsed=False):
+        """
+        Adds the input bytes and codec time of compressed data.
+
+        Every `CHECK_BYTES` the measured throughput is compared with the target,
+        which may change `choice`.
+
+        Args:
+            bytes_in (int): The uncompressed bytes.
+            seconds (float): The time spent in the codec, summed over its threads.
+            elapsed (bool, optional): Whether `seconds` is the elapsed time of all threads
+                instead, as measured around a multi-threaded stream.
+        """
+        self.done_bytes += bytes_in
+        self._bytes += bytes_in
+        self._seconds += seconds / self.parallelism(self.choice) if not elapsed else seconds
+        if self._bytes >= CHECK_BYTES:
+            self._check()
+
+    def _check(self):
+        expected = self.estimate(self.choice) / self.correction
+        if self._seconds > 0 and 0 < expected < float('inf'):
+            self.correction = self._bytes / self._seconds / expected
+        self._bytes, self._seconds = 0, 0.0
+        required = self.required_throughput()
+        if self.estimate(self.choice) < required * (1 - TOLERANCE):
+            choice = self._pick(required)
+        else:
+            # Only move to a stronger setting that leaves some headroom.
+            choice = self._pick(required, 1 + TOLERANCE)
+            if choice.ratio >= self.choice.ratio:
+                choice = self.choice
+        if choice is not self.choice:
+            self.choice = choice
+            self.changes += 1
+
+    def summary(self):
+        """Returns the current setting, the target and the number of changes as one line."""
+        if self.target.throughput is not None:
+            target = f'{self.target.throughput / 1e6:.0f} MB/s'
+        else:
+            target = f'{self.target.seconds:.0f} s'
+        return (f'auto ({target}): {self.choice.codec.name} level {self.choice.level}, '
+                f'trial ratio {self.choice.ratio:.3f} at {self.choice.throughput / 1e6:.1f} MB/s per thread, '
+                f'{self.changes} change(s)')
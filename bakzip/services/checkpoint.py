@@ -0,0 +1,175 @@
+#! /usr/env/bin python
+"""
+This module provides the checkpoint journals of resumable backups.
+
+While a ZIP or TAR archive is written, a `Checkpoint` appends the members
+written since the last checkpoint to `<archive>.journal` every `interval`
+seconds, followed by a commit line with the archive offset they end at.
+The archive is fsync'ed before each commit, so everything up to a committed
+offset is on disk. After a crash, `--resume` truncates the archive to the
+last committed offset, skips the committed files and appends the rest.
+
+The journal is JSON lines: a header with the settings of the backup, then
+member lines (`{"m": ...}`) and commit lines (`{"commit": ...}`). Member
+lines after the last commit belong to a part of the archive that is
+discarded on resume.
+"""
+import json
+import os
+import time
+
+CHECKPOINT_INTERVAL = 60
+JOURNAL_SUFFIX = '.journal'
+
+
+def journal_path(output):
+    """Returns the checkpoint journal path of an archive."""
+    return output + JOURNAL_SUFFIX
+
+
+class Checkpoint:
+    """
+    The checkpoint journal of an archive being written.
+
+    Use `start` for a new archive and `resume` to continue a partial one.
+
+    Attributes:
+        output (str): The archive path.
+        settings (dict): The settings the archive is written with.
+        resumed (bool): Whether the archive continues a partial one.
+        offset (int): The archive offset of the last commit.
+        state (dict): The writer state saved with the last commit.
+        members (list): The records of the committed members.
+        committed (set): The names of the committed members, which a resumed backup skips.
+    """
+
+    def __init__(self, output, settings, interval=CHECKPOINT_INTERVAL):
+        self.output = output
+        self.path = journal_path(output)
+        self.settings = settings
+        self.interval = interval
+        self.resumed = False
+        self.offset = 0
+        self.state = {}
+        self.members = []
+        self.committed = set()
+        self._pending = []
+        self._journal = None
+        self._last_commit = time.monotonic()
+
+    @classmethod
+    def start(cls, output, settings, interval=CHECKPOINT_INTERVAL):
+        """Starts the journal of a new archive, replacing any previous journal."""
+        checkpoint = cls(output, settings, interval)
+        checkpoint._journal = open(checkpoint.path, 'w', encoding='utf-8')
+        checkpoint._append({'bakzip_journal': 1, 'settings': settings})
+        checkpoint._sync()
+        return checkpoint
+
+    @classmethod
+    def resume(cls, output, settings, interval=CHECKPOINT_INTERVAL):
+        """
+        Loads the journal of a partial archive to continue it.
+
+        Raises:
+            ValueError: If there is no journal, it was written with other settings or the
+                archive is shorter than the last commit.
+        """
+        checkpoint = cls(output, settings, interval)
+        try:
+            with open(checkpoint.path, 'r', encoding='utf-8') as f:
+                lines = f.readlines()
+        except FileNotFoundError:
+            raise ValueError(f"No checkpoint journal for {output}; run the backup without --resume") from None
+        try:
+            header = json.loads(lines[0])
+        except (IndexError, json.JSONDecodeError):
+            raise ValueError(f"The checkpoint journal {checkpoint.path} is corrupt") from None
+        if header.get('settings') != settings:
+            raise ValueError(f"{output} was started with other settings; run the backup without --resume")
+        committed = []
+        pending = []
+        for line in lines[1:]:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                break  # A line torn by the crash; nothing after it was committed.
+            if 'm' in record:
+                pending.append(record)
+            elif 'commit' in record:
+                committed.extend(pending)
+                pending = []
+                checkpoint.offset = record['commit']
+                checkpoint.state = record.get('state', {})
+        try:
+            size = os.path.getsize(output)
+        except OSError:
+            size = -1
+        if size < checkpoint.offset:
+            raise ValueError(f"{output} is shorter than its last checkpoint; run the backup without --resume")
+        checkpoint.resumed = True
+        checkpoint.members = [record['m'] for record in committed]
+        checkpoint.committed = {record['name'] for record in committed}
+        # Rewrite the journal without the uncommitted tail, which is truncated from the archive.
+        checkpoint._journal = open(checkpoint.path + '.tmp', 'w', encoding='utf-8')
+        checkpoint._append({'bakzip_journal': 1, 'settings': settings})
+        checkpoint._pending = committed
+        checkpoint._flush_commit(checkpoint.offset, checkpoint.state)
+        checkpoint.close()
+        os.replace(checkpoint.path + '.tmp', checkpoint.path)
+        checkpoint._journal = open(checkpoint.path, 'a', encoding='utf-8')
+        return checkpoint
+
+    def _append(self, record):
+        self._journal.write(json.dumps(record, separators=(',', ':')) + '\n')
+
+    def _sync(self):
+        self._journal.flush()
+        os.fsync(self._journal.fileno())
+
+    def _flush_commit(self, offset, state):
+        for record in self._pending:
+            self._append(record)
+        self._pending = []
+        self._append({'commit': offset, 'state': state})
+        self._sync()
+
+    def add(self, name, member=None):
+        """Records a member written completely; it is committed by the next `commit`."""
+        self._pending.append({'m': member, 'name': name})
+
+    def due(self):
+        """Returns whether `interval` seconds passed since the last commit."""
+        return time.monotonic() - self._last_commit >= self.interval
+
+    def commit(self, archive, offset, state=None):
+        """
+        Commits the members added so far.
+
+        Args:
+            archive: The archive's file object, which is flushed and fsync'ed first.
+            offset (int): The archive offset the added members end at.
+            state (dict, optional): Writer state needed to continue at `offset`.
+        """
+        archive.flush()
+        os.fsync(archive.fileno())
+        self.members.extend(record['m'] for record in self._pending)
+        self.committed.update(record['name'] for record in self._pending)
+        self.offset = offset
+        self.state = state or {}
+        self._flush_commit(offset, self.state)
+        self._last_commit = time.monotonic()
+
+    def close(self):
+        """Closes the journal, keeping it for `--resume`."""
+        if self._journal:
+            self._journal.close()
+            self._journal = None
+
+    def finish(self):
+        """Removes the journal once the archive is complete."""
+        self.close()
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,362 @@
+#! /usr/env/bin python
+"""
+This module provides a deduplicating chunk repository backup format.
+
+Files are split into content-defined chunks with a gear rolling hash
+(FastCDC-style normalised chunking), so an edit only changes the chunks
+around it. Each unique chunk is stored once under `<repository>/chunks`,
+and each backup is recorded as a compact snapshot index of chunk references
+under `<repository>/snapshots`. Storage and write I/O therefore scale with
+the changed data rather than the total data, and files whose size, mtime and
+inode match the previous snapshot of the same directory reuse its chunk list
+without being read at all.
+
+The cut search hashes blocks of bytes at once with numpy when it is
+installed, and falls back to a byte-by-byte loop otherwise.
+"""
+import functools
+import hashlib
+import json
+import os
+import stat
+import tempfile
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from bakzip.services.tree_walker import entry_arcname, split_entry
+from bakzip.utilities.progress import tqdm
+
+REPOSITORY_VERSION = 1
+MIN_CHUNK_SIZE = 256 * 1024
+AVG_CHUNK_SIZE = 1024 * 1024
+MAX_CHUNK_SIZE = 4 * 1024 * 1024
+
+_MASK64 = (1 << 64) - 1
+# The gear hash only depends on the last 64 bytes, so blocks can be hashed independently.
+_WINDOW = 64
+_HASH_BLOCK = 256 * 1024
+# A fixed table keeps chunk boundaries stable across runs and machines.
+_GEAR = [int.from_bytes(hashlib.sha256(bytes([i])).digest()[:8], 'little') for i in range(256)]
+
+_STORED = b'\x00'
+_DEFLATED = b'\x01'
+
+
+def _mask(bits):
+    # The gear hash shifts left, so the high bits depend on the most bytes.
+    return ((1 << bits) - 1) << (64 - bits)
+
+
+@functools.lru_cache(maxsize=None)
+def _numpy_gear():
+    try:
+        import numpy
+    except ImportError:
+        return None
+    return numpy, numpy.array(_GEAR, dtype=numpy.uint64)
+
+
+def _first_match(numpy, gear, data, origin, start, end, mask):
+    # The hash of position i is the sum of gear[data[i - k]] << k for k < 64, wrapping at 64 bits,
+    # starting at `origin` like the byte loop. Doubling the window six times builds it for a block.
+    mask = numpy.uint64(mask)
+    for block in range(start, end, _HASH_BLOCK):
+        block_end = min(block + _HASH_BLOCK, end)
+        context = max(origin, block - (_WINDOW - 1))
+        values = gear[numpy.frombuffer(data, dtype=numpy.uint8, count=block_end - context, offset=context)]
+        width = 1
+        while width < _WINDOW:
+            values[width:] += values[:-width] << numpy.uint64(width)
+            width *= 2
+        hits = numpy.flatnonzero((values[block - context:] & mask) == 0)
+        if hits.size:
+            return block + int(hits[0])
+    return None
+
+
+def _find_cut(data, min_size, avg_size, max_size):
+    size = len(data)
+    if size <= min_size:
+        return size
+    size = min(size, max_size)
+    bits = avg_size.bit_length() - 1
+    mask_s, mask_l = _mask(bits + 2), _mask(bits - 2)
+    normal = min(avg_size, size)
+    accelerated = _numpy_gear()
+    if accelerated is not None:
+        for start, end, mask in ((min_size, normal, mask_s), (normal, size, mask_l)):
+            cut = _first_match(*accelerated, data, min_size, start, end, mask)
+            if cut is not None:
+                return cut + 1
+        return size
+    gear = _GEAR
+    h = 0
+    for i in range(min_size, normal):
+        h = ((h << 1) + gear[data[i]]) & _MASK64
+        if not h & mask_s:
+            return i + 1
+    for i in range(normal, size):
+        h = ((h << 1) + gear[data[i]]) & _MASK64
+        if not h & mask_l:
+            return i + 1
+    return size
+
+
+def iter_chunks(fileobj, min_size=MIN_CHUNK_SIZE, avg_size=AVG_CHUNK_SIZE, max_size=MAX_CHUNK_SIZE):
+    """
+    Splits a binary stream into content-defined chunks.
+
+    Args:
+        fileobj: The binary file object to read.
+        min_size (int, optional): The minimum chunk size. Defaults to 256 KiB.
+        avg_size (int, optional): The target average chunk size, a power of two. Defaults to 1 MiB.
+        max_size (int, optional): The maximum chunk size. Defaults to 4 MiB.
+
+    Yields:
+        bytes: The chunks, in stream order.
+    """
+    buffer = bytearray()
+    eof = False
+    while True:
+        while not eof and len(buffer) < max_size:
+            data = fileobj.read(max_size)
+            if not data:
+                eof = True
+            buffer += data
+        if not buffer:
+            return
+        cut = _find_cut(buffer, min_size, avg_size, max_size)
+        yield bytes(buffer[:cut])
+        del buffer[:cut]
+
+
+class ChunkRepository:
+    """
+    A directory of content-addressed chunks and snapshot indexes.
+
+    Args:
+        path (str): The repository directory. It is created if missing.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.chunks_dir = os.path.join(path, 'chunks')
+        self.snapshots_dir = os.path.join(path, 'snapshots')
+        os.makedirs(self.chunks_dir, exist_ok=True)
+        os.makedirs(self.snapshots_dir, exist_ok=True)
+        config_path = os.path.join(path, 'config.json')
+        if os.path.exists(config_path):
+            with open(config_path, 'r', encoding='utf-8') as f:
+                config = json.load(f)
+            if config.get('version') != REPOSITORY_VERSION:
+                raise ValueError(f"Unsupported repository version in {path}")
+        else:
+            config = {
+                'version': REPOSITORY_VERSION,
+                'min_size': MIN_CHUNK_SIZE,
+                'avg_size': AVG_CHUNK_SIZE,
+                'max_size': MAX_CHUNK_SIZE,
+            }
+            _write_atomic(config_path, json.dumps(config).encode())
+        self.min_size = config['min_size']
+        self.avg_size = config['avg_size']
+        self.max_size = config['max_size']
+        self._known = set()
+
+    def _chunk_path(self, chunk_id):
+        return os.path.join(self.chunks_dir, chunk_id[:2], chunk_id)
+
+    def put(self, data):
+        """
+        Stores a chunk unless it already exists.
+
+        Returns:
+            A tuple of the chunk id and whether the chunk was newly written.
+        """
+        chunk_id = hashlib.sha256(data).hexdigest()
+        if chunk_id in self._known:
+            return chunk_id, False
+        path = self._chunk_path(chunk_id)
+        self._known.add(chunk_id)
+        if os.path.exists(path):
+            return chunk_id, False
+        compressed = zlib.compress(data)
+        payload = _DEFLATED + compressed if len(compressed) < len(data) else _STORED + data
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        _write_atomic(path, payload)
+        return chunk_id, True
+
+    def get(self, chunk_id):
+        """Returns the content of a stored chunk."""
+        with open(self._chunk_path(chunk_id), 'rb') as f:
+            payload = f.read()
+        data = zlib.decompress(payload[1:]) if payload[:1] == _DEFLATED else payload[1:]
+        if hashlib.sha256(data).hexdigest() != chunk_id:
+            raise ValueError(f"Corrupted chunk {chunk_id}")
+        return data
+
+
+def _write_atomic(path, data, overwrite=True):
+    # A unique temporary file per call, so threads and processes writing the same path do not share one.
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=os.path.basename(path) + '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        if overwrite:
+            os.replace(tmp_path, path)
+        else:
+            # Linking fails with FileExistsError instead of replacing a file that exists.
+            os.link(tmp_path, path)
+            os.unlink(tmp_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+
+def _write_snapshot(repo, index, snapshot):
+    # Snapshots are never replaced: a default name that is taken gets a sequence suffix.
+    data = json.dumps(index, separators=(',', ':')).encode()
+    name = snapshot or index['created']
+    sequence = 0
+    while True:
+        path = os.path.join(repo.snapshots_dir, f'{name}-{sequence}.json' if sequence else f'{name}.json')
+        try:
+            _write_atomic(path, data, overwrite=False)
+            return path
+        except FileExistsError:
+            if snapshot:
+                raise ValueError(f"Snapshot {snapshot} already exists in {repo.path}") from None
+            sequence += 1
+
+
+def _previous_files(repo, source):
+    # The files of the newest snapshot of the same directory, by path.
+    paths = [os.path.join(repo.snapshots_dir, name) for name in os.listdir(repo.snapshots_dir)
+             if name.endswith('.json')]
+    for path in sorted(paths, key=os.path.getmtime, reverse=True):
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            continue
+        if index.get('source') == source:
+            return {entry[0]: entry for entry in index['files']}
+    return {}
+
+
+def _is_unchanged(entry, st):
+    # Entries of older snapshots have no inode, so their files are chunked again.
+    return (entry is not None and len(entry) > 5 and entry[1] == st.st_size and entry[3] == st.st_mtime_ns
+            and entry[5] == st.st_ino)
+
+
+def _store_file(repo, file, stats):
+    chunk_ids = []
+    with open(file, 'rb') as f:
+        for chunk in iter_chunks(f, repo.min_size, repo.avg_size, repo.max_size):
+            chunk_id, is_new = repo.put(chunk)
+            chunk_ids.append(chunk_id)
+            stats['chunks'] += 1
+            stats['bytes'] += len(chunk)
+            if is_new:
+                stats['new_chunks'] += 1
+                stats['new_bytes'] += len(chunk)
+    return chunk_ids
+
+
+def backup_to_repository(files, repository, base_dir, snapshot=None):
+    """
+    Backs up files into a chunk repository and records a snapshot index.
+
+    Files whose size, mtime and inode match the newest snapshot of `base_dir`
+    keep that snapshot's chunk list and are not read again.
+
+    Args:
+        files (iterable): The file paths or `FileEntry` records to back up.
+        repository (str): The repository directory.
+        base_dir (str): The base directory for relative paths in the snapshot.
+        snapshot (str, optional): The snapshot name. Defaults to the current time, with a
+            sequence suffix if a snapshot of the same second exists.
+
+    Returns:
+        A dictionary with the snapshot path and chunk statistics, including the number
+        of unchanged files.
+
+    Raises:
+        ValueError: If a snapshot with the given name exists.
+    """
+    repo = ChunkRepository(repository)
+    if snapshot and os.path.exists(os.path.join(repo.snapshots_dir, f'{snapshot}.json')):
+        raise ValueError(f"Snapshot {snapshot} already exists in {repo.path}")
+    source = os.path.abspath(base_dir)
+    previous = _previous_files(repo, source)
+    stats = {'files': 0, 'chunks': 0, 'new_chunks': 0, 'bytes': 0, 'new_bytes': 0, 'unchanged': 0}
+    entries = []
+    for item in tqdm(files, desc="Chunking files", unit="file"):
+        file, st = split_entry(item)
+        arcname = entry_arcname(item, base_dir)
+        if ".." in arcname or os.path.isabs(arcname):
+            print(f"Security Warning: Skipping {file} due to potential path traversal (arcname: {arcname})")
+            continue
+        name = arcname.replace(os.sep, '/')
+        try:
+            if st is None or stat.S_ISLNK(st.st_mode):
+                st = os.stat(file)
+            entry = previous.get(name)
+            if _is_unchanged(entry, st):
+                chunk_ids = entry[4]
+                stats['unchanged'] += 1
+                stats['chunks'] += len(chunk_ids)
+                stats['bytes'] += st.st_size
+            else:
+                chunk_ids = _store_file(repo, file, stats)
+        except OSError as e:
+            print(f"Error adding {file} to repository: {e}")
+            continue
+        stats['files'] += 1
+        entries.append([name, st.st_size, st.st_mode & 0o7777, st.st_mtime_ns, chunk_ids, st.st_ino])
+
+    index = {'version': REPOSITORY_VERSION, 'created': snapshot or time.strftime('%Y%m%dT%H%M%S'),
+             'source': source, 'files': entries}
+    stats['snapshot'] = _write_snapshot(repo, index, snapshot)
+    return stats
+
+
+def restore_snapshot(snapshot_path, destination, jobs=4):
+    """
+    Restores a snapshot, reading chunks for several files in parallel.
+
+    Args:
+        snapshot_path (str): The path of the snapshot index inside a repository.
+        destination (str): The directory to restore into.
+        jobs (int, optional): The number of restore threads. Defaults to 4.
+    """
+    repo = ChunkRepository(os.path.dirname(os.path.dirname(os.path.abspath(snapshot_path))))
+    with open(snapshot_path, 'r', encoding='utf-8') as f:
+        index = json.load(f)
+    root = os.path.realpath(destination)
+
+    def restore_file(entry):
+        rel_path, _, mode, mtime_ns, chunk_ids = entry[:5]
+        target = os.path.realpath(os.path.join(root, rel_path))
+        if os.path.isabs(rel_path) or os.path.commonpath([root, target]) != root:
+            print(f"Security Warning: Skipping {rel_path} due to potential path traversal")
+            return
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        with open(target, 'wb') as out:
+            for chunk_id in chunk_ids:
+                out.write(repo.get(chunk_id))
+        os.chmod(target, mode)
+        os.utime(target, ns=(mtime_ns, mtime_ns))
+
+    # Files are restored concurrently, so chunk reads and decompression overlap.
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as pool:
+        for _ in tqdm(pool.map(restore_file, index['files']), total=len(index['files']),
+                      desc="Restoring files", unit="file"):
+            pass
+
+
+def is_snapshot(path):
+    """Returns True if a path looks like a snapshot index inside a repository."""
+    return path.endswith('.json') and os.path.basename(os.path.dirname(os.path.abspath(path))) == 'snapshots'
@@ -0,0 +1,267 @@
+#! /usr/env/bin python
+"""
+This module provides the registry of compression codecs.
+
+Each `Codec` knows how to build a raw compressor for ZIP members (when the
+ZIP format defines a method for it) and how to wrap an output stream for TAR
+archives. zstd and lz4 are optional and only available when the `zstandard`
+and `lz4` packages are installed. `CodecStats` records the bytes and time
+spent in a codec so that runs can report their achieved throughput.
+"""
+import bz2
+import gzip
+import lzma
+import os
+import zlib
+
+ZIP_STORED = 0
+ZIP_DEFLATED = 8
+ZIP_BZIP2 = 12
+ZIP_LZMA = 14
+ZIP_ZSTD = 93
+
+# The historical --compression presets, per archive format.
+PRESETS = {
+    'zip': {
+        None: ('deflate', 6),
+        'fast': ('deflate', 1),
+        'normal': ('deflate', 6),
+        'maximum': ('bzip2', 9),
+        'gz': ('deflate', 6),
+    },
+    'tar': {
+        None: ('store', None),
+        'fast': ('store', None),
+        'normal': ('store', None),
+        'maximum': ('store', None),
+        'gz': ('gz', 9),
+    },
+}
+
+
+class _StoreCompressor:
+    def compress(self, data):
+        return data
+
+    def flush(self):
+        return b''
+
+
+class Codec:
+    """
+    A compression codec.
+
+    Args:
+        name (str): The codec name used on the command line.
+        levels (range): The valid compression levels.
+        default_level (int): The level used when none is given.
+        zip_method (int, optional): The ZIP compression method id, if ZIP supports the codec.
+        tar_suffix (str, optional): The file suffix of TAR archives using the codec.
+        compressobj (callable, optional): Called as `compressobj(level)`; returns an object with
+            `compress` and `flush` producing a raw stream for a ZIP member.
+        tar_stream (callable, optional): Called as `tar_stream(fileobj, level, jobs)`; returns a
+            writable file object that compresses into `fileobj`.
+        requires (str, optional): The optional package the codec needs.
+    """
+
+    def __init__(self, name, levels, default_level, zip_method=None, tar_suffix=None,
+                 compressobj=None, tar_stream=None, requires=None):
+        self.name = name
+        self.levels = levels
+        self.default_level = default_level
+        self.zip_method = zip_method
+        self.tar_suffix = tar_suffix
+        self._compressobj = compressobj
+        self._tar_stream = tar_stream
+        self.requires = requires
+
+    @property
+    def available(self):
+        """Whether the codec's optional dependency is installed."""
+        if not self.requires:
+            return True
+        try:
+            __import__(self.requires)
+        except ImportError:
+            return False
+        return True
+
+    def check_level(self, level):
+        """Returns `level`, or the default level if None; raises ValueError if out of range."""
+        if level is None:
+            return self.default_level
+        if level not in self.levels:
+            raise ValueError(f"Invalid level {level} for {self.name} "
+                             f"(expected {self.levels.start}-{self.levels.stop - 1})")
+        return level
+
+    def compressobj(self, level=None):
+        """Returns a raw compressor for a ZIP member."""
+        if self._compressobj is None:
+            raise ValueError(f"The {self.name} codec is not supported in ZIP archives")
+        return self._compressobj(self.check_level(level))
+
+    def tar_stream(self, fileobj, level=None, jobs=1):
+        """Returns a writable stream compressing a TAR archive into `fileobj`."""
+        if self._tar_stream is None:
+            raise ValueError(f"The {self.name} codec is not supported in TAR archives")
+        return self._tar_stream(fileobj, self.check_level(level), jobs)
+
+
+def _zstd_threads(jobs):
+    # zstandard uses -1 for "one thread per core" and 0 for single-threaded.
+    return -1 if jobs == 0 else (jobs if jobs > 1 else 0)
+
+
+def _zip_lzma_compressobj(level):
+    # ZIP's LZMA members start with a properties header, which zipfile's compressor writes.
+    import zipfile
+    return zipfile.LZMACompressor()
+
+
+def _zstd_compressobj(level):
+    import zstandard
+    return zstandard.ZstdCompressor(level=level).compressobj()
+
+
+def _zstd_tar_stream(fileobj, level, jobs):
+    import zstandard
+    compressor = zstandard.ZstdCompressor(level=level, threads=_zstd_threads(jobs))
+    return compressor.stream_writer(fileobj, closefd=False)
+
+
+def _lz4_tar_stream(fileobj, level, jobs):
+    import lz4.frame
+    return lz4.frame.LZ4FrameFile(fileobj, 'wb', compression_level=level)
+
+
+def _gz_tar_stream(fileobj, level, jobs):
+    if jobs != 1:
+        from bakzip.services.gzip_writer import ParallelGzipWriter
+        return ParallelGzipWriter(fileobj, level=level, jobs=jobs or os.cpu_count() or 1)
+    return gzip.GzipFile(fileobj=fileobj, mode='wb', compresslevel=level)
+
+
+CODECS = {}
+
+
+def register_codec(codec):
+    """Adds a codec to the registry, replacing any codec with the same name."""
+    CODECS[codec.name] = codec
+    return codec
+
+
+register_codec(Codec(
+    'store', range(0, 1), 0, ZIP_STORED, '',
+    compressobj=lambda level: _StoreCompressor(),
+    tar_stream=lambda fileobj, level, jobs: fileobj,
+))
+register_codec(Codec(
+    'deflate', range(0, 10), 6, ZIP_DEFLATED, '.gz',
+    compressobj=lambda level: zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS),
+    tar_stream=_gz_tar_stream,
+))
+register_codec(Codec(
+    'gz', range(0, 10), 9, ZIP_DEFLATED, '.gz',
+    compressobj=lambda level: zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS),
+    tar_stream=_gz_tar_stream,
+))
+register_codec(Codec(
+    'bzip2', range(1, 10), 9, ZIP_BZIP2, '.bz2',
+    compressobj=bz2.BZ2Compressor,
+    tar_stream=lambda fileobj, level, jobs: bz2.BZ2File(fileobj, 'wb', compresslevel=level),
+))
+register_codec(Codec(
+    # ZIP's LZMA method always uses the default preset; the level applies to .tar.xz.
+    'xz', range(0, 10), 6, ZIP_LZMA, '.xz',
+    compressobj=_zip_lzma_compressobj,
+    tar_stream=lambda fileobj, level, jobs: lzma.LZMAFile(fileobj, 'wb', preset=level),
+))
+register_codec(Codec(
+    'zstd', range(1, 23), 3, ZIP_ZSTD, '.zst',
+    compressobj=_zstd_compressobj, tar_stream=_zstd_tar_stream, requires='zstandard',
+))
+register_codec(Codec(
+    'lz4', range(0, 17), 0, None, '.lz4',
+    tar_stream=_lz4_tar_stream, requires='lz4',
+))
+
+
+def get_codec(name):
+    """
+    Returns a registered and available codec.
+
+    Raises:
+        ValueError: If the codec is unknown or its optional package is missing.
+    """
+    codec = CODECS.get(name)
+    if codec is None:
+        raise ValueError(f"Unknown compression codec: {name}")
+    if not codec.available:
+        raise ValueError(f"The {name} codec requires the '{codec.requires}' package")
+    return codec
+
+
+def codec_for_zip_method(method):
+    """Returns the codec writing a ZIP compression method."""
+    for codec in CODECS.values():
+        if codec.zip_method == method:
+            return codec
+    raise ValueError(f"Unsupported compression method: {method}")
+
+
+def resolve_compression(compression, archive_format, level=None):
+    """
+    Maps a --compression value to a codec and level.
+
+    Args:
+        compression (str): A preset ('fast', 'normal', 'maximum', 'gz'), a codec name or None.
+        archive_format (str): 'zip' or 'tar'.
+        level (int, optional): An explicit level, overriding the preset's level.
+
+    Returns:
+        A tuple of the `Codec` and the level to use.
+    """
+    presets = PRESETS.get(archive_format, {})
+    if compression in presets:
+        name, preset_level = presets[compression]
+    else:
+        name, preset_level = compression, None
+    codec = get_codec(name)
+    return codec, codec.check_level(level if level is not None else preset_level)
+
+
+class CodecStats:
+    """
+    The bytes and time spent compressing with one codec.
+
+    `seconds` is the time spent inside the codec summed over all threads,
+    so `throughput` is the per-core speed; `wall_seconds` is set by the
+    writer to the elapsed time of the whole archive.
+    """
+
+    def __init__(self, codec, level):
+        self.codec = codec
+        self.level = level
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.seconds = 0.0
+        self.wall_seconds = 0.0
+
+    def add(self, bytes_in, bytes_out, seconds):
+        self.bytes_in += bytes_in
+        self.bytes_out += bytes_out
+        self.seconds += seconds
+
+    def throughput(self):
+        """Returns the achieved input throughput in MB/s."""
+        seconds = self.seconds or self.wall_seconds
+        return self.bytes_in / seconds / 1e6 if seconds else 0.0
+
+    def ratio(self):
+        """Returns the compressed size as a fraction of the input size."""
+        return self.bytes_out / self.bytes_in if self.bytes_in else 1.0
+
+    def summary(self):
+        return (f'{self.codec.name} level {self.level}: {self.bytes_in} -> {self.bytes_out} bytes '
+                f'(ratio {self.ratio():.3f}), {self.throughput():.1f} MB/s')
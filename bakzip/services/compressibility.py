@@ -0,0 +1,90 @@
+#! /usr/env/bin python
+"""
+This module decides whether content is worth compressing.
+
+Media files, existing archives and encrypted blobs barely shrink, so pushing
+them through LZMA or BZIP2 only burns CPU. `is_compressible` checks known
+extensions, then magic numbers, then trial-compresses a small sample at the
+fastest zlib level, which costs a fraction of compressing the whole file.
+"""
+import os
+import zlib
+
+SAMPLE_SIZE = 64 * 1024
+# Files this small are compressed anyway; the decision would cost more than it saves.
+MIN_SIZE = 4 * 1024
+# Samples that do not shrink below this ratio are treated as incompressible.
+MAX_RATIO = 0.95
+
+INCOMPRESSIBLE_EXTENSIONS = frozenset([
+    '.jpg', '.jpeg', '.png', '.gif', '.webp', '.heic', '.heif', '.avif',
+    '.mp3', '.m4a', '.aac', '.ogg', '.opus', '.flac',
+    '.mp4', '.m4v', '.mov', '.mkv', '.webm', '.avi', '.wmv',
+    '.zip', '.gz', '.tgz', '.bz2', '.xz', '.txz', '.7z', '.rar', '.zst', '.lz4', '.br',
+    '.jar', '.apk', '.whl', '.docx', '.xlsx', '.pptx', '.odt', '.ods', '.epub',
+    '.gpg', '.age', '.enc',
+])
+
+_MAGIC_PREFIXES = (
+    b'\xff\xd8\xff',             # JPEG
+    b'\x89PNG\r\n\x1a\n',        # PNG
+    b'GIF8',                     # GIF
+    b'PK\x03\x04',               # ZIP and its derivatives
+    b'\x1f\x8b',                 # gzip
+    b'BZh',                      # bzip2
+    b'\xfd7zXZ\x00',             # xz
+    b"7z\xbc\xaf'\x1c",          # 7-Zip
+    b'Rar!\x1a\x07',             # RAR
+    b'\x28\xb5\x2f\xfd',         # zstd
+    b'\x04\x22\x4d\x18',         # lz4 frame
+    b'OggS',                     # Ogg
+    b'fLaC',                     # FLAC
+    b'ID3',                      # MP3 with ID3 tag
+    b'\x1a\x45\xdf\xa3',         # Matroska / WebM
+)
+
+
+def has_incompressible_magic(sample):
+    """Returns True if a sample starts with the signature of a compressed format."""
+    if sample.startswith(_MAGIC_PREFIXES):
+        return True
+    # ISO base media (MP4, MOV, HEIC) and RIFF WebP keep their tag after a size field.
+    return sample[4:8] == b'ftyp' or (sample[:4] == b'RIFF' and sample[8:12] == b'WEBP')
+
+
+def is_sample_compressible(sample):
+    """Returns True if a fast trial compression shrinks the sample enough."""
+    if not sample:
+        return True
+    return len(zlib.compress(sample, 1)) < len(sample) * MAX_RATIO
+
+
+def is_compressible(path, size=None, sample=None):
+    """
+    Decides whether a file is worth compressing.
+
+    Args:
+        path (str): The path of the file.
+        size (int, optional): The file size, if already known from the scan.
+        sample (bytes, optional): The start of the file, if already read; avoids opening it.
+
+    Returns:
+        False if the file looks already compressed or random, True otherwise.
+    """
+    if size is None:
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            return True
+    if size < MIN_SIZE:
+        return True
+    if os.path.splitext(path)[1].lower() in INCOMPRESSIBLE_EXTENSIONS:
+        return False
+    if sample is None:
+        try:
+            with open(path, 'rb') as f:
+                sample = f.read(SAMPLE_SIZE)
+        except OSError:
+            return True
+    sample = bytes(sample[:SAMPLE_SIZE])
+    return not has_incompressible_magic(sample) and is_sample_compressible(sample)
@@ -0,0 +1,152 @@
+#! /usr/env/bin python
+"""
+This module provides the duplicate detection of the archive writers.
+
+A `Deduplicator` sees the regular files of one archive in order and tells
+the writer when a file is a hardlink of, or byte-identical to, a file it
+already archived. Hardlinks are found for free from the scan's
+`(st_dev, st_ino)`. For content, files are grouped by size, and only a
+file whose size was seen before is hashed, together with the first file
+of that size, so a tree without duplicate sizes is never read twice.
+
+TAR writers store duplicates as hardlink members (content copies carry a
+`BAKZIP.copy` pax record, so `bakzip restore` extracts them as separate
+files); ZIP writers copy the already-compressed payload instead of reading
+and compressing the file again.
+"""
+import hashlib
+import os
+import stat
+from collections import namedtuple
+
+# Smaller files cost about as much to archive as a hardlink member or a hash.
+MIN_SIZE = 4096
+HASH_READ_SIZE = 1024 * 1024
+
+# The pax record marking a TAR hardlink member that is a copy, not a hardlink, of its target.
+COPY_PAX_KEY = 'BAKZIP.copy'
+
+Duplicate = namedtuple('Duplicate', ['target', 'hardlink'])
+Duplicate.__doc__ = """The member name a file duplicates, and whether it is a hardlink of it (same inode)."""
+
+
+def _digest(path, data):
+    digest = hashlib.blake2b(digest_size=20)
+    if data is not None:
+        digest.update(data)
+        return digest.digest()
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(HASH_READ_SIZE)
+            if not chunk:
+                break
+            digest.update(chunk)
+    return digest.digest()
+
+
+class Deduplicator:
+    """
+    Finds files of an archive that duplicate an earlier member.
+
+    Call `match` for each file in archive order, before writing it, and
+    `discard` for a file that could not be written, so nothing links to it.
+
+    Args:
+        min_size (int, optional): Files smaller than this are never content-matched.
+            Defaults to 4 KiB. Hardlinks are always matched.
+
+    Attributes:
+        duplicates (int): The number of duplicate files found.
+        duplicate_bytes (int): Their total size, which was not compressed again.
+        hashed_bytes (int): The bytes hashed to compare contents.
+    """
+
+    def __init__(self, min_size=MIN_SIZE):
+        self.min_size = min_size
+        self.duplicates = 0
+        self.duplicate_bytes = 0
+        self.hashed_bytes = 0
+        self._inodes = {}
+        self._sizes = set()
+        # The first file of each size, until a second one makes it worth hashing.
+        self._first_of_size = {}
+        self._by_digest = {}
+
+    def _hash(self, path, size, data=None):
+        try:
+            digest = _digest(path, data)
+        except OSError:
+            return None
+        self.hashed_bytes += size
+        return digest
+
+    def _hash_first(self, size):
+        first = self._first_of_size.pop(size, None)
+        if first is None:
+            return
+        path, arcname, st = first
+        try:
+            current = os.stat(path)
+        except OSError:
+            return
+        if (current.st_size, current.st_mtime_ns) != (st.st_size, st.st_mtime_ns):
+            return  # Changed since it was archived; its member may not match its content now.
+        digest = self._hash(path, size)
+        if digest is not None:
+            self._by_digest.setdefault((size, digest), arcname)
+
+    def match(self, path, arcname, st, data=None):
+        """
+        Returns the earlier member a file duplicates, or None, and remembers the file.
+
+        Args:
+            path (str): The path of the file.
+            arcname (str): Its member name.
+            st (os.stat_result): Its lstat result from the scan. Files without one and
+                non-regular files are never matched.
+            data (bytes, optional): The content of the file if it was already read.
+
+        Returns:
+            Duplicate: The member the file duplicates, or None if it must be archived.
+        """
+        if st is None or not stat.S_ISREG(st.st_mode):
+            return None
+        inode = (st.st_dev, st.st_ino)
+        if st.st_nlink > 1:
+            duplicate = self._inodes.get(inode)
+            if duplicate is not None:
+                return self._found(duplicate, st.st_size)
+        duplicate = None
+        size = st.st_size
+        if data is not None and len(data) != size:
+            return None  # Changed since the scan.
+        if size >= self.min_size:
+            if size not in self._sizes:
+                # The first file of this size is only hashed if another one shows up.
+                self._sizes.add(size)
+                self._first_of_size[size] = (path, arcname, st)
+            else:
+                self._hash_first(size)
+                digest = self._hash(path, size, data)
+                if digest is not None:
+                    target = self._by_digest.setdefault((size, digest), arcname)
+                    if target != arcname:
+                        duplicate = self._found(Duplicate(target, False), size)
+        if st.st_nlink > 1:
+            # Later links of this inode duplicate whatever this file turned out to be.
+            self._inodes[inode] = duplicate or Duplicate(arcname, True)
+        return duplicate
+
+    def _found(self, duplicate, size):
+        self.duplicates += 1
+        self.duplicate_bytes += size
+        return duplicate
+
+    def discard(self, arcname):
+        """Forgets a file that could not be written, so later files are not matched to it."""
+        for key in [key for key, duplicate in self._inodes.items() if duplicate.target == arcname]:
+            del self._inodes[key]
+        for key in [key for key, target in self._by_digest.items() if target == arcname]:
+            del self._by_digest[key]
+        for size in [size for size, first in self._first_of_size.items() if first[1] == arcname]:
+            del self._first_of_size[size]
@@ -7,9 +7,14 @@ import os
 import fnmatch
 import re
 import functools
+import time
+from bakzip.services.tree_walker import DEFAULT_SCAN_JOBS, scan_tree
+from bakzip.services.file_catalog import FileCatalog
+from bakzip.services.ignore_engine import IGNORE_FILE_NAME, IgnoreMatcher, read_patterns
 
 
-@functools.lru_cache(maxsize=1)
+# A few entries avoid recompiling when callers alternate between ignore lists.
+@functools.lru_cache(maxsize=16)
 def _get_compiled_regex(ignore_list_tuple):
     """
     Compiles a list of ignore patterns into a single regular expression.
@@ -23,31 +28,31 @@ def _get_compiled_regex(ignore_list_tuple):
     return re.compile('|'.join(regex_patterns))
 
 
-def get_ignore_list(directory):
+def get_ignore_list(directory, expand=True):
     """
     Returns a list of ignore patterns from a .bakzipignore file.
 
     Args:
         directory: The directory to search for the .bakzipignore file.
+        expand: Whether to add the glob variants used by `should_ignore`. The
+            `IgnoreMatcher` engine expects the raw patterns (expand=False).
 
     Returns:
         A list of ignore patterns.
     """
+    patterns = read_patterns(os.path.join(directory, IGNORE_FILE_NAME))
+    if not expand:
+        return patterns
+
     ignore_list = []
-    ignore_file = os.path.join(directory, '.bakzipignore')
-    if os.path.exists(ignore_file):
-        with open(ignore_file, 'r', encoding='utf-8') as f:
-            for line in f:
-                line = line.strip()
-                # Ignore comments and empty lines
-                if line and not line.startswith('#'):
-                    ignore_list.append(line)
-                    if line.endswith('/'):
-                        if not line.startswith('*/') and not line.startswith('/'):
-                            ignore_list.extend([line + '*', '*/' + line, '*/' + line + '*'])
-
-                    if '.' not in line and not line.endswith('/'):
-                        ignore_list.extend([line + '/', line + '/*', '*/' + line, '*/' + line + '/*'])
+    for line in patterns:
+        ignore_list.append(line)
+        if line.endswith('/'):
+            if not line.startswith('*/') and not line.startswith('/'):
+                ignore_list.extend([line + '*', '*/' + line, '*/' + line + '*'])
+
+        if '.' not in line and not line.endswith('/'):
+            ignore_list.extend([line + '/', line + '/*', '*/' + line, '*/' + line + '/*'])
 
     return ignore_list
 
@@ -76,62 +81,172 @@ def should_ignore(path, ignore_list):
     return False
 
 
-def process_directory(directory, log_file_path, verbose=False):
+class ScanStats:
     """
-    Processes a directory, filtering files based on a .bakzipignore file.
+    Counters collected while a directory is scanned.
+
+    Attributes:
+        included (int): The number of files yielded for the backup.
+        skipped (int): The number of files skipped by the ignore rules.
+        skipped_size (int): The total size of skipped files (verbose mode only).
+        pruned (int): The number of directories excluded by the ignore rules, which are not listed.
+    """
+
+    def __init__(self):
+        self.included = 0
+        self.skipped = 0
+        self.skipped_size = 0
+        self.pruned = 0
+
+
+class _TimedIgnore:
+    """Wraps an `IgnoreMatcher`, adding the time spent matching to the 'ignore' phase."""
+
+    def __init__(self, matcher, metrics):
+        self.matcher = matcher
+        self.metrics = metrics
+        self.ignore_file = matcher.ignore_file
+
+    def enter(self, path, rel_path):
+        started = time.perf_counter()
+        matcher = self.matcher.enter(path, rel_path)
+        self.metrics.add_time('ignore', time.perf_counter() - started, 0)
+        return self if matcher is self.matcher else _TimedIgnore(matcher, self.metrics)
+
+    def __call__(self, rel_path, is_dir):
+        started = time.perf_counter()
+        ignored = self.matcher(rel_path, is_dir)
+        self.metrics.add_time('ignore', time.perf_counter() - started)
+        return ignored
+
+
+def iter_directory(directory, log_file_path, verbose=False, stats=None, skipped_files=None, jobs=DEFAULT_SCAN_JOBS,
+                   metrics=None, entries=False, report=None, catalog=None):
+    """
+    Lazily scans a directory, yielding files not excluded by .bakzipignore files.
+
+    Patterns use gitignore semantics through `IgnoreMatcher`, and nested
+    .bakzipignore files apply to their own subtree.
+
+    Files are yielded as soon as their directory is listed, so archive writers
+    can start compressing before the scan finishes and memory does not grow
+    with the number of files. Directories are listed in parallel by
+    `scan_tree` and files come out in sorted, deterministic order.
 
     Args:
         directory: The directory to process.
         log_file_path: The path to the log file.
         verbose: Whether to enable verbose logging and file size calculation for skipped files.
-
-    Returns:
-        A tuple containing:
-            - A list of files to include in the backup.
-            - A list of skipped files.
-            - The total size of skipped files (calculated only if verbose is True).
+        stats (ScanStats, optional): Counters updated while scanning.
+        skipped_files (list or FileCatalog, optional): If given, skipped files are added to it
+            (their paths, for a list).
+        jobs (int, optional): The number of directory listing threads.
+        metrics (Metrics, optional): Receives the 'scan' and 'ignore' phase timings.
+        entries (bool, optional): Whether to yield `FileEntry` records, which carry the
+            scan's stat data so the archive writers do not stat each file again.
+        report (IgnoreReport, optional): Receives the rule deciding each file and pruned
+            directory (see `ignore_report`).
+        catalog (FileCatalog, optional): Receives the included files of each directory once they
+            are yielded, so they can be kept without a `FileEntry` record per file.
+
+    Yields:
+        The paths (or `FileEntry` records) of files to include in the backup.
     """
-    ignore_list = tuple(get_ignore_list(directory))
-    files_to_include = []
-    skipped_files = []
-    total_skipped_size = 0
+    ignore = IgnoreMatcher(get_ignore_list(directory, expand=False))
+    if report is not None:
+        ignore = report.wrap(ignore)
+    if metrics is not None:
+        ignore = _TimedIgnore(ignore, metrics)
+    listings = scan_tree(directory, ignore, jobs)
+    if metrics is not None:
+        listings = metrics.timed_iter('scan', listings)
+    if stats is None:
+        stats = ScanStats()
 
     log_file = None
     if verbose:
         log_file = open(log_file_path, 'w', encoding='utf-8')
 
     try:
-        for root, dirs, files in os.walk(directory, topdown=True):
-            rel_root = os.path.relpath(root, directory)
-            if rel_root == '.':
-                rel_root = ''
-
-            filtered_dirs = []
-            for d in dirs:
-                relative_path = os.path.join(rel_root, d)
-                if not should_ignore(relative_path, ignore_list):
-                    filtered_dirs.append(d)
-            dirs[:] = filtered_dirs
-
-            log_entries = []
-            for file in files:
-                file_path = os.path.join(root, file)
-                rel_path = os.path.join(rel_root, file)
-                if not should_ignore(rel_path, ignore_list):
-                    files_to_include.append(file_path)
-                else:
-                    skipped_files.append(file_path)
-                    if verbose:
-                        file_size = os.path.getsize(file_path)
-                        total_skipped_size += file_size
-                        log_entries.append(f"Skipped: {file_path} Size: {file_size} \n")
-
+        for listing in listings:
+            for entry in listing.files:
+                stats.included += 1
+                yield entry if entries else entry.path
+
+            if catalog is not None:
+                catalog.add_listing(listing)
+            stats.skipped += len(listing.skipped)
+            stats.pruned += len(listing.pruned)
+            if report is not None:
+                report.add_listing(listing)
+            if isinstance(skipped_files, FileCatalog):
+                skipped_files.add_listing(listing, listing.skipped)
+            elif skipped_files is not None:
+                skipped_files.extend(entry.path for entry in listing.skipped)
             if verbose:
+                log_entries = []
+                for entry in listing.skipped:
+                    # The size comes from the scan's stat data; no extra syscall.
+                    file_size = entry.stat.st_size if entry.stat else 0
+                    stats.skipped_size += file_size
+                    log_entries.append(f"Skipped: {entry.path} Size: {file_size} \n")
+                log_entries.extend(f"Pruned: {entry.path} \n" for entry in listing.pruned)
                 if log_entries:
                     log_file.write("".join(log_entries))
-                log_file.write(f"Processed directory: {root} \n")
+                log_file.write(f"Processed directory: {listing.path} \n")
     finally:
         if log_file:
             log_file.close()
 
-    return files_to_include, skipped_files, total_skipped_size
+
+def process_directory(directory, log_file_path, verbose=False, jobs=DEFAULT_SCAN_JOBS):
+    """
+    Processes a directory, filtering files based on a .bakzipignore file.
+
+    This collects the results of `iter_directory` into lists; prefer
+    `iter_directory` for large trees, or `catalog_directory` to keep them.
+
+    Args:
+        directory: The directory to process.
+        log_file_path: The path to the log file.
+        verbose: Whether to enable verbose logging and file size calculation for skipped files.
+        jobs (int, optional): The number of directory listing threads.
+
+    Returns:
+        A tuple containing:
+            - A list of files to include in the backup.
+            - A list of skipped files.
+            - The total size of skipped files (calculated only if verbose is True).
+    """
+    stats = ScanStats()
+    skipped_files = []
+    files_to_include = list(iter_directory(directory, log_file_path, verbose, stats, skipped_files, jobs))
+    return files_to_include, skipped_files, stats.skipped_size
+
+
+def catalog_directory(directory, log_file_path, verbose=False, jobs=DEFAULT_SCAN_JOBS):
+    """
+    Scans a directory like `process_directory`, into `FileCatalog`s.
+
+    A catalog stores the paths and stat data in columns instead of a string
+    per path, so a large tree can be kept in memory and read more than once.
+
+    Args:
+        directory: The directory to process.
+        log_file_path: The path to the log file.
+        verbose: Whether to enable verbose logging and file size calculation for skipped files.
+        jobs (int, optional): The number of directory listing threads.
+
+    Returns:
+        A tuple containing:
+            - A catalog of files to include in the backup.
+            - A catalog of skipped files.
+            - The total size of skipped files (calculated only if verbose is True).
+    """
+    stats = ScanStats()
+    files_to_include = FileCatalog(directory)
+    skipped_files = FileCatalog(directory)
+    for _ in iter_directory(directory, log_file_path, verbose, stats, skipped_files, jobs, entries=True,
+                            catalog=files_to_include):
+        pass
+    return files_to_include, skipped_files, stats.skipped_size
@@ -0,0 +1,182 @@
+#! /usr/env/bin python
+"""
+This module provides a compact, columnar catalog of scanned files.
+
+A list of `FileEntry` records costs a few hundred bytes per file: two path
+strings, a tuple and an `os.stat_result`. A `FileCatalog` keeps each
+directory once in an interned table, the basenames in one bytes buffer and
+the stat fields the archive writers use in typed arrays, about a tenth
+of that. Records are built on demand when the catalog is read, so callers
+that only count or sum files never create per-file strings.
+"""
+import os
+import stat
+import sys
+from array import array
+from collections import namedtuple
+from bakzip.services.tree_walker import FileEntry
+
+
+class CatalogStat(namedtuple('CatalogStat', ['st_mode', 'st_ino', 'st_dev', 'st_nlink', 'st_uid', 'st_gid',
+                                             'st_size', 'st_mtime_ns', 'st_rdev'])):
+    """The stat fields a catalog keeps for a file, with the attribute names of `os.stat_result`."""
+    __slots__ = ()
+
+    @property
+    def st_mtime(self):
+        # The same arithmetic as os.stat, so the float is identical to the scan's.
+        sec, nsec = divmod(self.st_mtime_ns, 1000000000)
+        return sec + nsec * 1e-9
+
+
+class FileCatalog:
+    """
+    The files of a scan, stored in columns.
+
+    Iterating a catalog (or indexing it) yields `FileEntry` records rooted at
+    `root`, so it can be passed wherever the scanner's records are accepted.
+
+    Args:
+        root (str): The scanned directory; file paths are `root` joined with their relative path.
+
+    Attributes:
+        root (str): The scanned directory.
+        dirs (list): The relative path of every directory holding a file, each once.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.dirs = []
+        self._dir_ids = {}
+        self._dir = array('I')
+        self._names = bytearray()
+        self._name_ends = array('Q')
+        self._mode = array('I')
+        self._ino = array('Q')
+        self._dev = array('Q')
+        self._nlink = array('I')
+        self._uid = array('I')
+        self._gid = array('I')
+        self._size = array('q')
+        self._mtime_ns = array('q')
+        # Only device files have a device number, so it is not worth a column.
+        self._rdev = {}
+        # The (directory id, basename) of every file, built by the first `in` test.
+        self._index = None
+
+    def __len__(self):
+        return len(self._dir)
+
+    def _dir_id(self, rel_dir):
+        dir_id = self._dir_ids.get(rel_dir)
+        if dir_id is None:
+            dir_id = self._dir_ids[rel_dir] = len(self.dirs)
+            self.dirs.append(rel_dir)
+        return dir_id
+
+    def add(self, rel_path, st):
+        """
+        Adds a file.
+
+        Args:
+            rel_path (str): The path of the file relative to `root`.
+            st (os.stat_result): Its lstat result, or None if it could not be stat'ed.
+        """
+        rel_dir, name = os.path.split(rel_path)
+        self._append(self._dir_id(rel_dir), name, st)
+
+    def add_listing(self, listing, entries=None):
+        """
+        Adds the files of a `DirectoryListing`.
+
+        Args:
+            listing (DirectoryListing): A listing from `scan_tree`.
+            entries (list, optional): The records of the listing to add. Defaults to its included files.
+        """
+        entries = listing.files if entries is None else entries
+        if not entries:
+            return
+        dir_id = self._dir_id(listing.rel_path)
+        start = len(listing.rel_path) + 1 if listing.rel_path else 0
+        for entry in entries:
+            self._append(dir_id, entry.rel_path[start:], entry.stat)
+
+    def _append(self, dir_id, name, st):
+        self._index = None
+        self._dir.append(dir_id)
+        self._names += os.fsencode(name)
+        self._name_ends.append(len(self._names))
+        if st is None:
+            # A mode of 0 marks a file without stat data.
+            st = CatalogStat(0, 0, 0, 0, 0, 0, 0, 0, 0)
+        elif stat.S_ISCHR(st.st_mode) or stat.S_ISBLK(st.st_mode):
+            self._rdev[len(self._mode)] = st.st_rdev
+        self._mode.append(st.st_mode)
+        self._ino.append(st.st_ino)
+        self._dev.append(st.st_dev)
+        self._nlink.append(st.st_nlink)
+        self._uid.append(st.st_uid)
+        self._gid.append(st.st_gid)
+        self._size.append(st.st_size)
+        self._mtime_ns.append(st.st_mtime_ns)
+
+    def name(self, index):
+        """Returns the basename of a file."""
+        start = self._name_ends[index - 1] if index else 0
+        return os.fsdecode(bytes(self._names[start:self._name_ends[index]]))
+
+    def rel_path(self, index):
+        """Returns the path of a file relative to `root`."""
+        return os.path.join(self.dirs[self._dir[index]], self.name(index))
+
+    def path(self, index):
+        """Returns the path of a file, as the scanner would."""
+        return os.path.join(self.root, self.rel_path(index))
+
+    def stat(self, index):
+        """Returns the scan's stat data of a file as a `CatalogStat`, or None if it had none."""
+        mode = self._mode[index]
+        if not mode:
+            return None
+        return CatalogStat(mode, self._ino[index], self._dev[index], self._nlink[index], self._uid[index],
+                           self._gid[index], self._size[index], self._mtime_ns[index], self._rdev.get(index, 0))
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('catalog index out of range')
+        rel_path = self.rel_path(index)
+        return FileEntry(os.path.join(self.root, rel_path), rel_path, self.stat(index), self.root)
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    def paths(self):
+        """Yields the path of every file."""
+        for index in range(len(self)):
+            yield self.path(index)
+
+    def __contains__(self, path):
+        if isinstance(path, FileEntry):
+            path = path.path
+        rel_dir, name = os.path.split(os.path.relpath(path, self.root))
+        dir_id = self._dir_ids.get(rel_dir)
+        if dir_id is None:
+            return False
+        if self._index is None:
+            # Built on demand, so catalogs that are only read in order stay compact.
+            self._index = {(self._dir[index], self.name(index)) for index in range(len(self))}
+        return (dir_id, name) in self._index
+
+    def total_size(self):
+        """Returns the total size of the regular files, from the scan's stat data."""
+        return sum(size for mode, size in zip(self._mode, self._size) if stat.S_ISREG(mode))
+
+    def nbytes(self):
+        """Returns the approximate memory used by the catalog's columns and tables."""
+        columns = (self._dir, self._name_ends, self._mode, self._ino, self._dev, self._nlink, self._uid, self._gid,
+                   self._size, self._mtime_ns)
+        return (sum(column.buffer_info()[1] * column.itemsize for column in columns) + len(self._names)
+                + sum(sys.getsizeof(rel_dir) for rel_dir in self.dirs))
@@ -0,0 +1,118 @@
+#! /usr/env/bin python
+"""
+This module provides a block-parallel gzip writer.
+
+`ParallelGzipWriter` cuts the uncompressed stream into fixed-size blocks and
+deflates them concurrently in a thread pool (zlib releases the GIL). Like
+pigz, each block is primed with the last 32 KiB of the previous block and
+ends on a sync flush, so the blocks join into one standard gzip member that
+`gzip -d` and `tarfile` read as usual.
+"""
+import struct
+import time
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from bakzip.services.compressibility import SAMPLE_SIZE, is_sample_compressible
+
+BLOCK_SIZE = 1024 * 1024
+DICT_SIZE = 32 * 1024
+
+
+def _deflate_block(data, level, zdict, last, adaptive):
+    if adaptive and not is_sample_compressible(data[:SAMPLE_SIZE]):
+        # Incompressible blocks (media, archives) are emitted as stored deflate blocks.
+        level = 0
+    if zdict:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS, zdict=zdict)
+    else:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush(zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH)
+
+
+class ParallelGzipWriter:
+    """
+    A write-only file object that gzip-compresses blocks in parallel.
+
+    At most `2 * jobs` blocks are in flight, so memory stays bounded by
+    roughly `2 * jobs * block_size` regardless of the stream length.
+
+    Args:
+        fileobj: The binary file object receiving the gzip stream.
+        level (int, optional): The zlib compression level. Defaults to 9.
+        jobs (int, optional): The number of compression threads. Defaults to 4.
+        block_size (int, optional): The uncompressed block size. Defaults to 1 MiB.
+        adaptive (bool, optional): Whether to store blocks whose sample does not compress.
+    """
+
+    def __init__(self, fileobj, level=9, jobs=4, block_size=BLOCK_SIZE, adaptive=False):
+        self.fileobj = fileobj
+        self.level = level
+        self.jobs = max(1, jobs)
+        self.block_size = block_size
+        self.adaptive = adaptive
+        self.closed = False
+        self._buffer = bytearray()
+        self._dict = b''
+        self._crc = 0
+        self._size = 0
+        self._pending = deque()
+        self._pool = ThreadPoolExecutor(max_workers=self.jobs)
+        xfl = 2 if level == 9 else (4 if level == 1 else 0)
+        self.fileobj.write(struct.pack('<2sBBIBB', b'\x1f\x8b', 8, 0, int(time.time()), xfl, 255))
+
+    def writable(self):
+        return True
+
+    def tell(self):
+        """Returns the number of uncompressed bytes written so far."""
+        return self._size
+
+    def write(self, data):
+        if self.closed:
+            raise ValueError("write to closed file")
+        data = memoryview(data).cast('B')
+        self._size += len(data)
+        self._buffer += data
+        while len(self._buffer) >= self.block_size:
+            block = bytes(self._buffer[:self.block_size])
+            del self._buffer[:self.block_size]
+            self._submit(block, last=False)
+        return len(data)
+
+    def _submit(self, block, last):
+        self._crc = zlib.crc32(block, self._crc)
+        self._pending.append(self._pool.submit(_deflate_block, block, self.level, self._dict, last, self.adaptive))
+        self._dict = block[-DICT_SIZE:]
+        self._drain(2 * self.jobs)
+
+    def _drain(self, limit):
+        while len(self._pending) > limit:
+            self.fileobj.write(self._pending.popleft().result())
+
+    def flush(self):
+        self.fileobj.flush()
+
+    def close(self):
+        """
+        Compresses the remaining data and writes the gzip trailer.
+
+        The underlying file object is flushed but left open.
+        """
+        if self.closed:
+            return
+        try:
+            self._submit(bytes(self._buffer), last=True)
+            self._buffer = bytearray()
+            self._drain(0)
+            self.fileobj.write(struct.pack('<II', self._crc, self._size & 0xFFFFFFFF))
+            self.fileobj.flush()
+        finally:
+            self._pool.shutdown()
+            self.closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
@@ -0,0 +1,279 @@
+#! /usr/env/bin python
+"""
+This module provides a compiled, gitignore-style ignore engine.
+
+Patterns follow gitignore semantics: `!` negates, a leading or inner `/`
+anchors a pattern to the directory of its `.bakzipignore` file, a trailing
+`/` matches directories only, and `**` matches across directories. The last
+matching pattern wins, and patterns in nested `.bakzipignore` files override
+those of their parents.
+
+Each file's patterns are split into literal basename and path tables, an
+extension table, and combined regular expressions for the remaining globs
+(bucketed by their first literal path component when anchored), so the cost
+of matching a path stays nearly constant as the number of patterns grows.
+"""
+import os
+import re
+from collections import namedtuple
+
+IGNORE_FILE_NAME = '.bakzipignore'
+
+IgnoreRule = namedtuple('IgnoreRule', ['pattern', 'negate', 'dir_only', 'source', 'index'])
+IgnoreRule.__doc__ = """A parsed pattern: its text, flags, the directory of its ignore file and its line index."""
+
+_GLOB_CHARS = frozenset('*?[\\')
+_EXTENSION = re.compile(r'\*(\.[^*?\[\\/]+)')
+
+
+def read_patterns(path):
+    """
+    Reads the raw patterns of an ignore file, skipping comments and empty lines.
+
+    Args:
+        path (str): The path of the ignore file.
+
+    Returns:
+        A list of patterns, or an empty list if the file does not exist.
+    """
+    patterns = []
+    if os.path.exists(path):
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if line and not line.startswith('#'):
+                    patterns.append(line)
+    return patterns
+
+
+def _has_glob(pattern):
+    return any(c in _GLOB_CHARS for c in pattern)
+
+
+def glob_to_regex(pattern):
+    """
+    Translates a gitignore glob into a regular expression string.
+
+    `*` and `?` do not match `/`, `**/` matches zero or more directories and
+    a trailing `/**` matches everything inside a directory. Only non-capturing
+    groups are produced.
+    """
+    i, n, out = 0, len(pattern), []
+    while i < n:
+        c = pattern[i]
+        if c == '*':
+            if pattern.startswith('**/', i):
+                out.append('(?:.*/)?')
+                i += 3
+                continue
+            if pattern.startswith('**', i):
+                out.append('.*')
+                i += 2
+                continue
+            out.append('[^/]*')
+        elif c == '?':
+            out.append('[^/]')
+        elif c == '[':
+            j = i + 1
+            if j < n and pattern[j] in '!^':
+                j += 1
+            if j < n and pattern[j] == ']':
+                j += 1
+            j = pattern.find(']', j)
+            if j < 0:
+                out.append('\\[')
+            else:
+                body = pattern[i + 1:j].replace('\\', '\\\\')
+                if body[:1] in ('!', '^'):
+                    body = '^' + body[1:]
+                out.append(f'[{body}]')
+                i = j
+        elif c == '\\' and i + 1 < n:
+            i += 1
+            out.append(re.escape(pattern[i]))
+        else:
+            out.append(re.escape(c))
+        i += 1
+    return ''.join(out)
+
+
+def _combine(items):
+    # Alternatives are ordered by descending rule index, so the first (and
+    # only) group that matches belongs to the last matching pattern.
+    if not items:
+        return None
+    items = sorted(items, key=lambda item: item[0], reverse=True)
+    regex = re.compile('|'.join(f'({expression})' for _, expression in items))
+    return regex, [index for index, _ in items]
+
+
+def _search(combined, path, best):
+    if combined is None:
+        return best
+    regex, indexes = combined
+    m = regex.fullmatch(path)
+    if m:
+        return max(best, indexes[m.lastindex - 1])
+    return best
+
+
+class _Buckets:
+    def __init__(self):
+        self.names = {}
+        self.extensions = {}
+        self.paths = {}
+        self.basename_globs = []
+        self.prefixed_globs = {}
+        self.anchored_globs = []
+
+    def add(self, index, pattern, anchored):
+        if not anchored:
+            ext = _EXTENSION.fullmatch(pattern)
+            if not _has_glob(pattern):
+                self.names[pattern] = index
+            elif ext:
+                self.extensions[ext.group(1)] = index
+            else:
+                self.basename_globs.append((index, glob_to_regex(pattern)))
+        elif not _has_glob(pattern):
+            self.paths[pattern] = index
+        else:
+            first = pattern.split('/', 1)[0]
+            if _has_glob(first):
+                self.anchored_globs.append((index, glob_to_regex(pattern)))
+            else:
+                self.prefixed_globs.setdefault(first, []).append((index, glob_to_regex(pattern)))
+
+    def compile(self):
+        self.basename_globs = _combine(self.basename_globs)
+        self.anchored_globs = _combine(self.anchored_globs)
+        self.prefixed_globs = {first: _combine(items) for first, items in self.prefixed_globs.items()}
+
+    def last_match(self, path, name):
+        best = max(self.names.get(name, -1), self.paths.get(path, -1))
+        if self.extensions:
+            dot = name.find('.')
+            while dot >= 0:
+                best = max(best, self.extensions.get(name[dot:], -1))
+                dot = name.find('.', dot + 1)
+        best = _search(self.basename_globs, name, best)
+        if self.prefixed_globs:
+            best = _search(self.prefixed_globs.get(path.split('/', 1)[0]), path, best)
+        return _search(self.anchored_globs, path, best)
+
+
+class IgnoreRules:
+    """
+    The compiled patterns of a single ignore file.
+
+    Args:
+        patterns (iterable): The raw patterns, in file order.
+        source (str, optional): The directory of the ignore file, relative to the scan root.
+    """
+
+    def __init__(self, patterns, source=''):
+        self.rules = []
+        self._files = _Buckets()
+        self._dirs = _Buckets()
+        for pattern in patterns:
+            self._add(pattern, source)
+        self._files.compile()
+        self._dirs.compile()
+
+    def _add(self, raw, source):
+        pattern = raw
+        negate = pattern.startswith('!')
+        if negate:
+            pattern = pattern[1:]
+        elif pattern.startswith('\\!') or pattern.startswith('\\#'):
+            pattern = pattern[1:]
+        dir_only = pattern.endswith('/')
+        pattern = os.path.normcase(pattern.rstrip('/'))
+        anchored = '/' in pattern
+        pattern = pattern.lstrip('/')
+        if pattern.startswith('**/') and '/' not in pattern[3:]:
+            pattern, anchored = pattern[3:], False
+        if not pattern:
+            return
+        index = len(self.rules)
+        self.rules.append(IgnoreRule(raw, negate, dir_only, source, index))
+        self._dirs.add(index, pattern, anchored)
+        if not dir_only:
+            self._files.add(index, pattern, anchored)
+
+    def last_match(self, path, is_dir):
+        """
+        Returns the last rule matching a `/`-separated path, or None.
+
+        Args:
+            path (str): The path relative to the ignore file's directory.
+            is_dir (bool): Whether the path is a directory.
+        """
+        buckets = self._dirs if is_dir else self._files
+        index = buckets.last_match(path, path.rsplit('/', 1)[-1])
+        return self.rules[index] if index >= 0 else None
+
+
+class IgnoreMatcher:
+    """
+    Decides whether paths are ignored, merging nested ignore files.
+
+    A matcher is callable as `matcher(rel_path, is_dir)`, which makes it a
+    drop-in `ignore` argument for `scan_tree`. The walker calls `enter` for
+    every directory that contains an ignore file, so nested rules apply to
+    that directory's subtree only. Matching assumes the path's parent
+    directories were not ignored, which holds while walking because ignored
+    directories are pruned.
+
+    Args:
+        patterns (iterable, optional): The patterns of the root ignore file.
+    """
+
+    ignore_file = IGNORE_FILE_NAME
+
+    def __init__(self, patterns=(), _layers=None):
+        if _layers is None:
+            patterns = list(patterns)
+            _layers = (('', IgnoreRules(patterns)),) if patterns else ()
+        self.layers = _layers
+
+    @classmethod
+    def from_directory(cls, directory):
+        """Builds a matcher from the root ignore file of a directory."""
+        return cls(read_patterns(os.path.join(directory, IGNORE_FILE_NAME)))
+
+    def enter(self, path, rel_path):
+        """
+        Returns the matcher for a directory, adding its ignore file if present.
+
+        Args:
+            path (str): The directory path.
+            rel_path (str): The directory path relative to the scan root.
+        """
+        if not rel_path:
+            return self
+        patterns = read_patterns(os.path.join(path, IGNORE_FILE_NAME))
+        if not patterns:
+            return self
+        source = os.path.normcase(rel_path.replace(os.sep, '/'))
+        return IgnoreMatcher(_layers=self.layers + ((source, IgnoreRules(patterns, source)),))
+
+    def match(self, rel_path, is_dir):
+        """
+        Returns the rule deciding a path, or None if no rule matches.
+
+        Args:
+            rel_path (str): The path relative to the scan root.
+            is_dir (bool): Whether the path is a directory.
+        """
+        path = os.path.normcase(rel_path.replace(os.sep, '/'))
+        for source, rules in reversed(self.layers):
+            sub_path = path[len(source) + 1:] if source else path
+            rule = rules.last_match(sub_path, is_dir)
+            if rule is not None:
+                return rule
+        return None
+
+    def __call__(self, rel_path, is_dir):
+        rule = self.match(rel_path, is_dir)
+        return rule is not None and not rule.negate
@@ -0,0 +1,206 @@
+#! /usr/env/bin python
+"""
+This module provides the ignore-rule attribution report.
+
+An `IgnoreReport` wraps the `IgnoreMatcher` given to `scan_tree` and
+attributes every path to the `.bakzipignore` pattern that decided it: the
+files it excluded (or kept, for `!` patterns) with their size from the
+scan's stat data, the directories it pruned and the time spent matching
+the paths it decided. Pruned directories are never listed by the scan, so
+their contents are only counted when `du` is set, which sizes them in a
+background thread while the backup runs.
+"""
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from bakzip.services.ignore_engine import IGNORE_FILE_NAME
+
+
+def disk_usage(path):
+    """
+    Counts the files below a directory and their apparent size, like `du -s --apparent-size`.
+
+    Symlinks are counted but not followed, and unreadable directories are skipped.
+
+    Returns:
+        A tuple of the number of files and their total size in bytes.
+    """
+    files = size = 0
+    stack = [path]
+    while stack:
+        try:
+            with os.scandir(stack.pop()) as it:
+                for entry in it:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append(entry.path)
+                            continue
+                        size += entry.stat(follow_symlinks=False).st_size
+                    except OSError:
+                        pass
+                    files += 1
+        except OSError:
+            pass
+    return files, size
+
+
+class RuleStats:
+    """
+    What one ignore rule decided during a scan.
+
+    Attributes:
+        rule (IgnoreRule): The rule, or None for the paths no rule matched.
+        files (int): The files the rule decided, including those inside pruned directories once sized.
+        bytes (int): The total size of those files.
+        dirs (int): The directories the rule pruned.
+        paths (int): The number of paths matched against the rules and decided by this one.
+        seconds (float): The time spent matching those paths.
+    """
+
+    def __init__(self, rule):
+        self.rule = rule
+        self.files = 0
+        self.bytes = 0
+        self.dirs = 0
+        self.paths = 0
+        self.seconds = 0.0
+        self._sizes = []
+
+    @property
+    def pattern(self):
+        """The rule's pattern as written in its ignore file."""
+        return self.rule.pattern if self.rule else '(no rule)'
+
+    @property
+    def ignore_file(self):
+        """The ignore file of the rule, relative to the scan root."""
+        if self.rule is None:
+            return ''
+        return f'{self.rule.source}/{IGNORE_FILE_NAME}' if self.rule.source else IGNORE_FILE_NAME
+
+    @property
+    def excludes(self):
+        """Whether the rule excludes paths, as opposed to keeping them with `!` (or no rule)."""
+        return self.rule is not None and not self.rule.negate
+
+
+class _ReportingIgnore:
+    """Wraps an `IgnoreMatcher`, recording the rule deciding each path in an `IgnoreReport`."""
+
+    def __init__(self, matcher, report):
+        self.matcher = matcher
+        self.report = report
+        self.ignore_file = matcher.ignore_file
+
+    def enter(self, path, rel_path):
+        matcher = self.matcher.enter(path, rel_path)
+        return self if matcher is self.matcher else _ReportingIgnore(matcher, self.report)
+
+    def __call__(self, rel_path, is_dir):
+        started = time.perf_counter()
+        rule = self.matcher.match(rel_path, is_dir)
+        elapsed = time.perf_counter() - started
+        ignored = rule is not None and not rule.negate
+        # Kept directories are walked rather than reported, so only their time is recorded.
+        self.report._decide(rel_path, rule, elapsed, remember=rule is not None and (ignored or not is_dir))
+        return ignored
+
+
+class IgnoreReport:
+    """
+    Attributes scanned files, sizes and matching time to ignore rules.
+
+    Pass it to `iter_directory`, which wraps its matcher with `wrap` and
+    feeds the listings back through `add_listing`. Call `close` once the scan
+    is done (it waits for the background sizing) and then read `rows`.
+
+    Args:
+        du (bool, optional): Whether to size pruned directories in a background thread.
+            Without it, pruned directories are counted but their contents are not.
+    """
+
+    def __init__(self, du=False):
+        self.du = du
+        self._stats = {}
+        self._decided = {}
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=1) if du else None
+
+    def wrap(self, matcher):
+        """Returns a matcher for `scan_tree` that records its decisions in this report."""
+        return _ReportingIgnore(matcher, self)
+
+    def _rule_stats(self, rule):
+        stats = self._stats.get(rule)
+        if stats is None:
+            stats = self._stats[rule] = RuleStats(rule)
+        return stats
+
+    def _decide(self, rel_path, rule, elapsed, remember):
+        # Called from the scan's listing threads.
+        with self._lock:
+            stats = self._rule_stats(rule)
+            stats.paths += 1
+            stats.seconds += elapsed
+            if remember:
+                self._decided[rel_path] = rule
+
+    def _pop(self, rel_path):
+        with self._lock:
+            return self._rule_stats(self._decided.pop(rel_path, None))
+
+    def add_listing(self, listing):
+        """Attributes the files and pruned directories of a `DirectoryListing` to their rules."""
+        for entry in listing.files + listing.skipped:
+            stats = self._pop(entry.rel_path)
+            stats.files += 1
+            stats.bytes += entry.stat.st_size if entry.stat else 0
+        for entry in listing.pruned:
+            stats = self._pop(entry.rel_path)
+            stats.dirs += 1
+            if self._pool is not None:
+                stats._sizes.append(self._pool.submit(disk_usage, entry.path))
+
+    def close(self):
+        """Waits for the pruned directories to be sized and adds their contents to the rows."""
+        if self._pool is None:
+            return
+        for stats in self._stats.values():
+            for future in stats._sizes:
+                files, size = future.result()
+                stats.files += files
+                stats.bytes += size
+            stats._sizes = []
+        self._pool.shutdown()
+        self._pool = None
+
+    def cancel(self):
+        """Stops sizing pruned directories, for a scan that was abandoned."""
+        if self._pool is None:
+            return
+        for stats in self._stats.values():
+            for future in stats._sizes:
+                future.cancel()
+        self._pool.shutdown(wait=False)
+        self._pool = None
+
+    def rows(self):
+        """Returns the `RuleStats` of every rule that decided a path, the most bytes first."""
+        return sorted(self._stats.values(), key=lambda stats: (stats.bytes, stats.files, stats.dirs), reverse=True)
+
+    def lines(self):
+        """Returns the report as table lines, with the totals of the excluding rules last."""
+        lines = [f'{"Pattern":<30} {"Ignore file":<24} {"Action":<7} {"Files":>8} {"Bytes":>14} {"Dirs":>6} '
+                 f'{"Paths":>8} {"Match ms":>9}']
+        for stats in self.rows():
+            action = 'exclude' if stats.excludes else 'keep'
+            lines.append(f'{stats.pattern:<30} {stats.ignore_file:<24} {action:<7} {stats.files:>8} '
+                         f'{stats.bytes:>14} {stats.dirs:>6} {stats.paths:>8} {stats.seconds * 1000:>9.1f}')
+        excluded = [stats for stats in self._stats.values() if stats.excludes]
+        lines.append(f'{"Excluded":<30} {"":<24} {"":<7} {sum(s.files for s in excluded):>8} '
+                     f'{sum(s.bytes for s in excluded):>14} {sum(s.dirs for s in excluded):>6} '
+                     f'{sum(s.paths for s in excluded):>8} {sum(s.seconds for s in excluded) * 1000:>9.1f}')
+        if not self.du and any(stats.dirs for stats in excluded):
+            lines.append('Files inside pruned directories are not counted; use --ignore-report du to size them.')
+        return lines
@@ -0,0 +1,163 @@
+#! /usr/env/bin python
+"""
+This module provides a minimal Linux inotify binding.
+
+It calls `inotify_init1`, `inotify_add_watch` and `inotify_rm_watch` from
+libc through ctypes and parses the event records read from the inotify file
+descriptor, so watch mode needs no extra package. On other platforms
+creating an `Inotify` raises OSError.
+"""
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+from collections import namedtuple
+
+IN_ACCESS = 0x00000001
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_DONT_FOLLOW = 0x02000000
+IN_EXCL_UNLINK = 0x04000000
+IN_ISDIR = 0x40000000
+
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+_EVENT = struct.Struct('iIII')
+# Large reads return many events per system call.
+READ_SIZE = 64 * 1024
+
+InotifyEvent = namedtuple('InotifyEvent', ['wd', 'mask', 'cookie', 'name'])
+InotifyEvent.__doc__ = """An inotify event: the watch descriptor, the event mask, the rename cookie and the file name."""
+
+_libc = None
+
+
+def _load_libc():
+    global _libc
+    if _libc is None:
+        name = ctypes.util.find_library('c')
+        if name is None:
+            raise OSError(errno.ENOSYS, "inotify is not available on this platform")
+        libc = ctypes.CDLL(name, use_errno=True)
+        if not hasattr(libc, 'inotify_init1'):
+            raise OSError(errno.ENOSYS, "inotify is not available on this platform")
+        libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+        _libc = libc
+    return _libc
+
+
+def _check(result, path=None):
+    if result < 0:
+        error = ctypes.get_errno()
+        raise OSError(error, os.strerror(error), path)
+    return result
+
+
+def parse_events(buffer):
+    """
+    Parses the event records returned by a read from an inotify descriptor.
+
+    Args:
+        buffer (bytes): The data read.
+
+    Returns:
+        list: The `InotifyEvent` records, with names decoded like `os.fsdecode`.
+    """
+    events = []
+    offset = 0
+    while offset + _EVENT.size <= len(buffer):
+        wd, mask, cookie, length = _EVENT.unpack_from(buffer, offset)
+        offset += _EVENT.size
+        name = buffer[offset:offset + length].rstrip(b'\0')
+        offset += length
+        events.append(InotifyEvent(wd, mask, cookie, os.fsdecode(name)))
+    return events
+
+
+class Inotify:
+    """
+    An inotify instance. Use it as a context manager or call `close`.
+
+    Raises:
+        OSError: If inotify is unavailable or the instance cannot be created.
+    """
+
+    def __init__(self):
+        self._libc = _load_libc()
+        self.fd = _check(self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC))
+
+    def add_watch(self, path, mask):
+        """
+        Watches a file or directory.
+
+        Args:
+            path (str): The path to watch.
+            mask (int): The IN_* events to report.
+
+        Returns:
+            int: The watch descriptor.
+
+        Raises:
+            OSError: If the path cannot be watched, for instance when the
+                `fs.inotify.max_user_watches` limit is reached.
+        """
+        return _check(self._libc.inotify_add_watch(self.fd, os.fsencode(path), mask), path)
+
+    def rm_watch(self, wd):
+        """Removes a watch. Watches the kernel already removed are ignored."""
+        try:
+            _check(self._libc.inotify_rm_watch(self.fd, wd))
+        except OSError as e:
+            if e.errno != errno.EINVAL:
+                raise
+
+    def read_events(self, timeout=None):
+        """
+        Waits for events and returns all that are queued.
+
+        Args:
+            timeout (float, optional): The maximum number of seconds to wait. Defaults to
+                None (wait until an event arrives).
+
+        Returns:
+            list: The `InotifyEvent` records, empty if the timeout expired.
+        """
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return []
+        events = []
+        while True:
+            try:
+                buffer = os.read(self.fd, READ_SIZE)
+            except BlockingIOError:
+                break
+            if not buffer:
+                break
+            events.extend(parse_events(buffer))
+        return events
+
+    def close(self):
+        """Closes the descriptor, which removes all watches."""
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
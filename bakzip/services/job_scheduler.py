@@ -0,0 +1,249 @@
+#! /usr/env/bin python
+"""
+This module provides the scheduler behind `bakzip --job-file`.
+
+A job file (TOML, YAML or JSON) lists backup jobs, each with its own
+directory, output, format and compression, plus optional `defaults` shared
+by all jobs and the `cpu_limit` and `io_limit` of the run. `run_jobs` runs
+the jobs concurrently in one process: a job takes as many CPU slots as it
+has compression workers, and one I/O slot on each device it reads from or
+writes to, so jobs on the same filesystem do not compete for its disk
+beyond `io_limit`. The biggest jobs start first, so a large tree does not
+end up running alone at the end.
+"""
+import collections
+import contextlib
+import io
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from bakzip.services.directory_processor import iter_directory
+
+JOB_FILE_KEYS = ('cpu_limit', 'io_limit', 'defaults', 'jobs')
+ESTIMATE_THREADS = 4
+
+
+def _load_toml(stream):
+    try:
+        import tomllib
+    except ImportError:  # Python < 3.11
+        try:
+            import tomli as tomllib
+        except ImportError:
+            raise ValueError("TOML job files need Python 3.11+ or the 'tomli' package") from None
+    return tomllib.load(stream)
+
+
+def _load_yaml(stream):
+    try:
+        import yaml
+    except ImportError:
+        raise ValueError("YAML job files need the 'PyYAML' package") from None
+    return yaml.safe_load(stream)
+
+
+def load_job_file(path):
+    """
+    Reads a job file, choosing the parser from its extension.
+
+    Example (TOML):
+
+        cpu_limit = 8
+        io_limit = 1
+
+        [defaults]
+        format = "tar"
+        compression = "zstd"
+
+        [[jobs]]
+        name = "etc"
+        directory = "/etc"
+        output = "/backup/etc"
+
+    Args:
+        path (str): A `.toml`, `.yaml`, `.yml` or `.json` file.
+
+    Returns:
+        A tuple containing:
+            - The jobs, as (name, options) tuples with the defaults applied.
+            - The CPU limit, or None for the number of CPU cores.
+            - The number of concurrent jobs per device.
+
+    Raises:
+        OSError: If the file cannot be read.
+        ValueError: If the file is malformed.
+    """
+    extension = os.path.splitext(path)[1].lower()
+    with open(path, 'rb') as stream:
+        if extension == '.toml':
+            config = _load_toml(stream)
+        elif extension in ('.yaml', '.yml'):
+            config = _load_yaml(stream)
+        elif extension == '.json':
+            config = json.load(stream)
+        else:
+            raise ValueError(f"Unsupported job file type: {path} (use .toml, .yaml or .json)")
+    if not isinstance(config, dict) or not isinstance(config.get('jobs'), list) or not config['jobs']:
+        raise ValueError(f"{path} lists no jobs")
+    unknown = set(config) - set(JOB_FILE_KEYS)
+    if unknown:
+        raise ValueError(f"Unknown job file keys: {', '.join(sorted(unknown))}")
+    defaults = config.get('defaults') or {}
+    jobs = []
+    names = set()
+    for number, options in enumerate(config['jobs'], 1):
+        if not isinstance(options, dict) or 'directory' not in options:
+            raise ValueError(f"Job {number} of {path} has no directory")
+        options = {**defaults, **options}
+        name = str(options.pop('name', None) or os.path.basename(os.path.abspath(options['directory'])))
+        if name in names:
+            raise ValueError(f"Duplicate job name: {name}")
+        names.add(name)
+        jobs.append((name, options))
+    return jobs, config.get('cpu_limit'), config.get('io_limit', 1)
+
+
+def device_of(path):
+    """Returns the device ID of the filesystem holding `path`, or of its closest existing parent."""
+    path = os.path.abspath(path)
+    while True:
+        try:
+            return os.stat(path).st_dev
+        except OSError:
+            parent = os.path.dirname(path)
+            if parent == path:
+                raise
+            path = parent
+
+
+def estimate_size(directory):
+    """Returns the total size of the files a backup of `directory` would include."""
+    total = 0
+    try:
+        for entry in iter_directory(directory, os.devnull, entries=True):
+            if entry.stat is not None:
+                total += entry.stat.st_size
+    except OSError:
+        # The backup itself reports the error.
+        pass
+    return total
+
+
+class Job:
+    """
+    A backup job of a job file.
+
+    Args:
+        name (str): The name shown in the summary.
+        args (argparse.Namespace): The backup arguments of the job.
+
+    Attributes:
+        devices (tuple): The devices the job reads from and writes to.
+        size (int): The estimated bytes to back up, set by `run_jobs`.
+        result: The return value of the job's run, or None.
+        error (Exception): The exception the run raised, or None.
+        log (str): The output the job printed.
+        seconds (float): The wall time of the run.
+    """
+
+    def __init__(self, name, args):
+        self.name = name
+        self.args = args
+        output = args.output or '.'
+        self.devices = tuple(sorted({device_of(args.directory), device_of(os.path.dirname(output) or '.')}))
+        self.size = 0
+        self.result = None
+        self.error = None
+        self.log = ''
+        self.seconds = 0.0
+
+    def cpu_slots(self, cpu_limit):
+        """Returns the CPU slots the job takes: one per compression worker, at most `cpu_limit`."""
+        jobs = self.args.jobs
+        return cpu_limit if jobs <= 0 else min(jobs, cpu_limit)
+
+
+class _ThreadOutput:
+    """A stdout that keeps what each job thread prints apart, so concurrent logs do not interleave."""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.buffers = {}
+
+    def write(self, text):
+        return self.buffers.get(threading.get_ident(), self.stream).write(text)
+
+    def flush(self):
+        self.stream.flush()
+
+    def isatty(self):
+        return False
+
+
+def _run_job(job, run, output):
+    buffer = output.buffers[threading.get_ident()] = io.StringIO()
+    started = time.perf_counter()
+    try:
+        job.result = run(job)
+    except Exception as e:  # pylint: disable=broad-except
+        job.error = e
+    finally:
+        job.seconds = time.perf_counter() - started
+        job.log = buffer.getvalue()
+        del output.buffers[threading.get_ident()]
+    return job
+
+
+def run_jobs(jobs, run, cpu_limit=None, io_limit=1, on_finish=None):
+    """
+    Runs jobs concurrently within CPU and per-device I/O limits, biggest first.
+
+    Jobs start in order of their estimated size. A job that waits for I/O
+    slots lets smaller jobs on other devices start; a job that waits for CPU
+    slots holds back the jobs after it, so small jobs cannot starve it.
+
+    Args:
+        jobs (list): The `Job` objects to run.
+        run (callable): Runs a job; called as `run(job)` in a worker thread.
+        cpu_limit (int, optional): The total CPU slots. Defaults to the number of CPU cores.
+        io_limit (int, optional): The number of jobs that may use a device at once. Defaults to 1.
+        on_finish (callable, optional): Called as `on_finish(job)` in the calling thread as each job ends.
+
+    Returns:
+        list: The jobs, in the order they finished.
+    """
+    cpu_limit = max(1, cpu_limit or os.cpu_count() or 1)
+    io_limit = max(1, io_limit)
+    with ThreadPoolExecutor(max_workers=min(len(jobs), ESTIMATE_THREADS) or 1) as pool:
+        for job, size in zip(jobs, pool.map(lambda job: estimate_size(job.args.directory), jobs)):
+            job.size = size
+    pending = sorted(jobs, key=lambda job: job.size, reverse=True)
+    free_cpu = cpu_limit
+    device_jobs = collections.Counter()
+    running = {}
+    finished = []
+    output = _ThreadOutput(sys.stdout)
+    with contextlib.redirect_stdout(output), ThreadPoolExecutor(max_workers=min(len(jobs), cpu_limit) or 1) as pool:
+        while pending or running:
+            for job in list(pending):
+                if any(device_jobs[device] >= io_limit for device in job.devices):
+                    continue
+                cpu = job.cpu_slots(cpu_limit)
+                if cpu > free_cpu:
+                    break
+                pending.remove(job)
+                free_cpu -= cpu
+                device_jobs.update(job.devices)
+                running[pool.submit(_run_job, job, run, output)] = job
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                job = running.pop(future)
+                free_cpu += job.cpu_slots(cpu_limit)
+                device_jobs.subtract(job.devices)
+                finished.append(job)
+                if on_finish:
+                    on_finish(job)
+    return finished
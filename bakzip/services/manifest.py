@@ -0,0 +1,201 @@
+#! /usr/env/bin python
+"""
+This module provides backup manifests for incremental and differential backups.
+
+A manifest is written next to each archive as `<archive>.manifest.json`. It is
+a JSON Lines file: a header object followed by one `["f", path, size, mtime_ns,
+inode, hash]` record per file in the source tree and one `["d", path]` record
+per file deleted since the base backup. Because every manifest describes the
+full state of the tree, the next run can compare against it directly.
+"""
+import hashlib
+import json
+import os
+import stat
+import time
+from bakzip.services.tree_walker import entry_arcname, split_entry
+
+MANIFEST_SUFFIX = '.manifest.json'
+MANIFEST_VERSION = 1
+HASH_READ_SIZE = 1024 * 1024
+
+
+def manifest_path(archive):
+    """Returns the manifest path that belongs to an archive path."""
+    if archive.endswith(MANIFEST_SUFFIX):
+        return archive
+    return archive + MANIFEST_SUFFIX
+
+
+def archive_name(path):
+    """Returns the archive file name for an archive or manifest path."""
+    name = os.path.basename(path)
+    if name.endswith(MANIFEST_SUFFIX):
+        name = name[:-len(MANIFEST_SUFFIX)]
+    return name
+
+
+def hash_file(path):
+    """Returns the hex BLAKE2b digest of a file's content."""
+    digest = hashlib.blake2b(digest_size=20)
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(HASH_READ_SIZE)
+            if not chunk:
+                break
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def load_manifest(path):
+    """
+    Loads a manifest file.
+
+    Args:
+        path (str): The manifest path, or the path of the archive it belongs to.
+
+    Returns:
+        A tuple containing:
+            - The header dictionary.
+            - A dictionary mapping relative paths to `[size, mtime_ns, inode, hash]`.
+            - A list of deleted relative paths.
+
+    Raises:
+        ValueError: If the file is not a BakZIP manifest.
+    """
+    files = {}
+    deleted = []
+    with open(manifest_path(path), 'r', encoding='utf-8') as f:
+        header = json.loads(f.readline() or 'null')
+        if not isinstance(header, dict) or header.get('version') != MANIFEST_VERSION:
+            raise ValueError(f"Not a BakZIP manifest: {path}")
+        for line in f:
+            record = json.loads(line)
+            if record[0] == 'f':
+                files[record[1]] = record[2:]
+            elif record[0] == 'd':
+                deleted.append(record[1])
+    return header, files, deleted
+
+
+def _header(output, base):
+    return {
+        'version': MANIFEST_VERSION,
+        'archive': os.path.basename(output),
+        'kind': 'incremental' if base is not None else 'full',
+        'base': base,
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+    }
+
+
+def write_manifest(output, files, deleted=(), base=None):
+    """
+    Writes the manifest of an archive from a known state of the tree.
+
+    This is how watch mode records a delta archive without scanning the tree.
+
+    Args:
+        output (str): The archive path; the manifest is written next to it.
+        files (dict): Maps relative paths to `[size, mtime_ns, inode, hash]` for every
+            file in the tree, as returned by `load_manifest`.
+        deleted (iterable, optional): The relative paths deleted since the base archive.
+        base (str, optional): The name of the base archive, for incremental archives.
+    """
+    path = manifest_path(output)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(json.dumps(_header(output, base)) + '\n')
+        for rel_path, record in files.items():
+            f.write(json.dumps(['f', rel_path] + list(record)) + '\n')
+        for rel_path in deleted:
+            f.write(json.dumps(['d', rel_path]) + '\n')
+    os.replace(tmp_path, path)
+
+
+class ManifestBuilder:
+    """
+    Records the state of the scanned tree and selects files that changed.
+
+    Args:
+        directory (str): The directory being backed up.
+        output (str): The archive path; the manifest is written next to it.
+        previous (dict, optional): The files of the base manifest. When given,
+            only new or changed files pass through `filter`.
+        base (str, optional): The name of the base archive, recorded in the header.
+        use_hash (bool, optional): Whether to record content hashes. A file whose
+            size is unchanged but whose metadata changed is only treated as changed
+            if its content hash differs.
+    """
+
+    def __init__(self, directory, output, previous=None, base=None, use_hash=False):
+        self.directory = directory
+        self.path = manifest_path(output)
+        self.previous = previous
+        self.base = base
+        self.use_hash = use_hash
+        self.changed = 0
+        self.deleted = []
+        self._remaining = dict(previous) if previous is not None else {}
+        self._tmp_path = self.path + '.tmp'
+        self._file = open(self._tmp_path, 'w', encoding='utf-8')
+        header = _header(output, base)
+        header['kind'] = 'incremental' if previous is not None else 'full'
+        self._file.write(json.dumps(header) + '\n')
+
+    def _is_changed(self, path, record, old):
+        if old is None:
+            return True
+        if old[:3] == record[:3]:
+            record[3] = old[3]
+            return False
+        if self.use_hash and old[3] and old[0] == record[0]:
+            record[3] = hash_file(path)
+            return record[3] != old[3]
+        return True
+
+    def filter(self, files):
+        """
+        Records each file and yields only those that are new or changed.
+
+        Args:
+            files (iterable): The file paths or `FileEntry` records produced by the scanner.
+                The scan's stat data of `FileEntry` records is used instead of stat'ing again.
+
+        Yields:
+            The items of files to archive, unchanged.
+        """
+        for item in files:
+            path, st = split_entry(item)
+            rel_path = entry_arcname(item, self.directory).replace(os.sep, '/')
+            if st is None or stat.S_ISLNK(st.st_mode):
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    # Let the archive writer report the unreadable file.
+                    yield item
+                    continue
+            record = [st.st_size, st.st_mtime_ns, st.st_ino, None]
+            old = self._remaining.pop(rel_path, None)
+            changed = self.previous is None or self._is_changed(path, record, old)
+            if changed and self.use_hash and record[3] is None:
+                record[3] = hash_file(path)
+            self._file.write(json.dumps(['f', rel_path] + record) + '\n')
+            if changed:
+                self.changed += 1
+                yield item
+
+    def close(self):
+        """
+        Writes the deleted paths and atomically moves the manifest into place.
+        """
+        self.deleted = sorted(self._remaining)
+        for rel_path in self.deleted:
+            self._file.write(json.dumps(['d', rel_path]) + '\n')
+        self._file.close()
+        os.replace(self._tmp_path, self.path)
+
+    def discard(self):
+        """Removes the partially written manifest."""
+        self._file.close()
+        if os.path.exists(self._tmp_path):
+            os.remove(self._tmp_path)
@@ -0,0 +1,102 @@
+#! /usr/env/bin python
+"""
+This module provides helpers for streaming scan results into archive writers.
+
+`bounded_prefetch` runs a producer iterable (typically the directory scanner)
+in a background thread and hands its items to the consumer through a bounded
+queue, so scanning and compressing overlap while memory stays constant.
+"""
+import queue
+import threading
+
+DEFAULT_QUEUE_SIZE = 4096
+
+_DONE = object()
+
+
+class _Failure:
+    def __init__(self, error):
+        self.error = error
+
+
+class PrefetchIterator:
+    """
+    An iterator fed by a background producer thread through a bounded queue.
+
+    The producer starts immediately. Use the iterator as a context manager (or
+    call `close`) to stop the producer and wait for it to finish.
+    """
+
+    def __init__(self, iterable, maxsize=DEFAULT_QUEUE_SIZE):
+        self._items = queue.Queue(maxsize=maxsize)
+        self._stop = threading.Event()
+        self._finished = False
+        self._producer = threading.Thread(target=self._produce, args=(iterable,), name='bakzip-scan', daemon=True)
+        self._producer.start()
+
+    def _put(self, item):
+        while not self._stop.is_set():
+            try:
+                self._items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _produce(self, iterable):
+        try:
+            for item in iterable:
+                if not self._put(item):
+                    break
+        except BaseException as e:  # pylint: disable=broad-except
+            self._put(_Failure(e))
+            return
+        finally:
+            close = getattr(iterable, 'close', None)
+            if self._stop.is_set() and close:
+                close()
+        self._put(_DONE)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._finished:
+            raise StopIteration
+        item = self._items.get()
+        if item is _DONE:
+            self._finished = True
+            raise StopIteration
+        if isinstance(item, _Failure):
+            self._finished = True
+            raise item.error
+        return item
+
+    def close(self):
+        """Stops the producer and waits for its thread to exit."""
+        self._finished = True
+        self._stop.set()
+        self._producer.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def bounded_prefetch(iterable, maxsize=DEFAULT_QUEUE_SIZE):
+    """
+    Iterates over `iterable` in a background thread through a bounded queue.
+
+    Items are yielded in the producer's order, and an exception raised by the
+    producer is re-raised in the consumer.
+
+    Args:
+        iterable: The iterable to consume in the background.
+        maxsize (int, optional): The maximum number of buffered items. Defaults to 4096.
+
+    Returns:
+        PrefetchIterator: The iterator over the items of `iterable`.
+    """
+    return PrefetchIterator(iterable, maxsize)
@@ -0,0 +1,202 @@
+#! /usr/env/bin python
+"""
+This module provides a read-ahead stage for the archive writers.
+
+Without it, each file is opened, read and compressed in strict sequence,
+so the CPU idles while the disk seeks and the disk idles while the CPU
+compresses. `read_ahead` reads upcoming files in background threads into
+memory, bounded by a byte budget, while the writer compresses the current
+one. Files too large for the budget are not read ahead; the kernel is told
+to start reading them with `posix_fadvise(WILLNEED)` instead, where the
+platform supports it.
+"""
+import os
+import stat
+import time
+from collections import deque, namedtuple
+from concurrent.futures import Future, ThreadPoolExecutor
+from bakzip.services.read_order import get_order_key
+
+DEFAULT_READ_AHEAD = 64 * 1024 * 1024
+DEFAULT_READ_THREADS = 4
+# Files larger than this fraction of the budget are only hinted to the kernel.
+MAX_FILE_FRACTION = 4
+# Reads are issued in large, block-aligned requests.
+READ_SIZE = 1024 * 1024
+# The number of upcoming files sorted together when a read order is set.
+DEFAULT_ORDER_WINDOW = 1024
+
+Prefetched = namedtuple('Prefetched', ['item', 'data'])
+Prefetched.__doc__ = """An item and the content of its file, or None if the file was not read ahead."""
+
+# Stands in for the read of files that are not regular files; opening a FIFO would block.
+_NOT_READ = Future()
+_NOT_READ.set_result(None)
+
+
+def _advise(path):
+    if not hasattr(os, 'posix_fadvise'):
+        return
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def read_file(path, size):
+    """
+    Reads a whole file with large reads into a preallocated buffer.
+
+    Args:
+        path (str): The path of the file.
+        size (int): The expected size; the file may have changed since it was stat'ed.
+
+    Returns:
+        The content of the file as a bytes-like object.
+    """
+    with open(path, 'rb', buffering=0) as f:
+        if hasattr(os, 'posix_fadvise'):
+            try:
+                os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+            except OSError:
+                pass
+        buffer = bytearray(size)
+        view = memoryview(buffer)
+        filled = 0
+        while filled < size:
+            count = f.readinto(view[filled:filled + READ_SIZE])
+            if not count:
+                break
+            filled += count
+        if filled < size:
+            return bytes(view[:filled])
+        # The file grew after the stat; read the rest normally.
+        rest = f.read()
+        return bytes(buffer) + rest if rest else buffer
+
+
+def _load(path, size, metrics):
+    started = time.perf_counter()
+    try:
+        if size is None:
+            _advise(path)
+            return None
+        return read_file(path, size)
+    except OSError:
+        # The writer opens the file itself and reports the error.
+        return None
+    finally:
+        if metrics is not None:
+            metrics.add_time('read', time.perf_counter() - started)
+
+
+def _batches(items, key, stat_of, max_file_size, batch_size, batch_bytes):
+    # Stats items and groups them; a batch closes at `batch_size` items or `batch_bytes` of reads.
+    batch, nbytes = [], 0
+    for item in items:
+        path = key(item)
+        st = stat_of(item) if stat_of is not None else None
+        if st is None:
+            try:
+                st = os.stat(path)
+            except OSError:
+                st = None
+        size = st.st_size if st is not None and stat.S_ISREG(st.st_mode) and st.st_size <= max_file_size else None
+        if batch and nbytes + (size or 0) > batch_bytes:
+            yield batch
+            batch, nbytes = [], 0
+        batch.append((item, path, st, size))
+        nbytes += size or 0
+        if len(batch) >= batch_size:
+            yield batch
+            batch, nbytes = [], 0
+    if batch:
+        yield batch
+
+
+def read_ahead(items, key=None, max_bytes=DEFAULT_READ_AHEAD, threads=DEFAULT_READ_THREADS, metrics=None,
+               order=None, window=DEFAULT_ORDER_WINDOW, stat_of=None):
+    """
+    Reads the files of upcoming items in background threads.
+
+    Items come out in their input order. At most `max_bytes` of file content
+    is held in memory (at least one file is always read ahead), so memory
+    stays bounded regardless of the number of files.
+
+    With a read `order` (see `read_order`), upcoming items are taken in
+    windows of up to `window` files (and half the budget), and each window's
+    reads are issued sorted by disk position. The items still come out in
+    their input order.
+
+    Args:
+        items (iterable): The items to process, in order.
+        key (callable, optional): Returns the file path of an item. Defaults to the item itself.
+        max_bytes (int, optional): The read-ahead budget in bytes. Defaults to 64 MiB.
+            With 0, nothing is read ahead and every item is yielded with None.
+        threads (int, optional): The number of reader threads. Defaults to 4.
+        metrics (Metrics, optional): Receives the 'read' time of the reader threads and the
+            'read_wait' time the consumer spent waiting for data.
+        order (str, optional): 'none', 'inode' or 'extent'. Defaults to None (input order).
+        window (int, optional): The maximum number of files sorted together. Defaults to 1024.
+        stat_of (callable, optional): Returns the stat result of an item known from the scan
+            (see `FileEntry`), or None to stat the file. Symlinks are not read ahead.
+
+    Yields:
+        Prefetched: Each item with its file content, or None for files that were
+        too large, unreadable or not regular files; read those from disk.
+    """
+    if not max_bytes:
+        for item in items:
+            yield Prefetched(item, None)
+        return
+    if key is None:
+        key = lambda item: item  # noqa: E731
+    order_key = get_order_key(order)
+    max_file_size = max_bytes // MAX_FILE_FRACTION
+    batch_size = max(1, window) if order_key else 1
+    # Keep the queue short enough that hinted large files are read soon after.
+    queue_limit = max(4 * max(1, threads), batch_size)
+    pending = deque()
+    in_flight = 0
+    with ThreadPoolExecutor(max_workers=max(1, threads)) as pool:
+        def pop():
+            nonlocal in_flight
+            item, size, future = pending.popleft()
+            started = time.perf_counter()
+            data = future.result()
+            if metrics is not None:
+                metrics.add_time('read_wait', time.perf_counter() - started)
+            in_flight -= size or 0
+            return Prefetched(item, data)
+
+        try:
+            for batch in _batches(items, key, stat_of, max_file_size, batch_size, max(1, max_bytes // 2)):
+                nbytes = sum(size or 0 for _, _, _, size in batch)
+                while pending and in_flight + nbytes > max_bytes:
+                    yield pop()
+                submit_order = range(len(batch))
+                if order_key:
+                    submit_order = sorted(submit_order, key=lambda i: order_key(batch[i][1], batch[i][2]))
+                futures = [None] * len(batch)
+                for i in submit_order:
+                    _, path, st, size = batch[i]
+                    if st is not None and stat.S_ISREG(st.st_mode):
+                        futures[i] = pool.submit(_load, path, size, metrics)
+                    else:
+                        futures[i] = _NOT_READ
+                for (item, _, _, size), future in zip(batch, futures):
+                    pending.append((item, size, future))
+                in_flight += nbytes
+                while len(pending) > queue_limit:
+                    yield pop()
+            while pending:
+                yield pop()
+        finally:
+            for _, _, future in pending:
+                future.cancel()
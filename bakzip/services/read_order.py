@@ -0,0 +1,87 @@
+#! /usr/env/bin python
+"""
+This module provides sort keys for scheduling file reads by disk position.
+
+Reading files in directory order makes spinning disks and large ext4/XFS
+volumes seek back and forth. Sorting a window of upcoming reads by inode
+number, which on most filesystems correlates with where the data lives,
+or by the physical offset of the first extent reported by the Linux
+FIEMAP ioctl, turns those reads into mostly forward sweeps. Only the read
+order changes; `prefetch.read_ahead` still hands files to the archive
+writers in their original order, so the archive layout stays the same.
+"""
+import os
+import struct
+
+READ_ORDERS = ('none', 'inode', 'extent')
+
+# FS_IOC_FIEMAP = _IOWR('f', 11, struct fiemap)
+FS_IOC_FIEMAP = 0xC020660B
+_FIEMAP_HEADER = struct.Struct('=QQIIII')
+_FIEMAP_EXTENT = struct.Struct('=QQQQQIIII')
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+
+def physical_offset(path):
+    """
+    Returns the physical byte offset of a file's first extent, or None.
+
+    None is returned for empty or inline files and on platforms or
+    filesystems without FIEMAP support.
+    """
+    if fcntl is None:
+        return None
+    request = bytearray(_FIEMAP_HEADER.pack(0, 0xFFFFFFFFFFFFFFFF, 0, 0, 1, 0) + bytes(_FIEMAP_EXTENT.size))
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return None
+    try:
+        fcntl.ioctl(fd, FS_IOC_FIEMAP, request)
+    except OSError:
+        return None
+    finally:
+        os.close(fd)
+    mapped = _FIEMAP_HEADER.unpack_from(request)[3]
+    if not mapped:
+        return None
+    return _FIEMAP_EXTENT.unpack_from(request, _FIEMAP_HEADER.size)[1]
+
+
+def inode_key(path, st):
+    """Sorts reads by device and inode number."""
+    return (st.st_dev, st.st_ino) if st is not None else (0, 0)
+
+
+def extent_key(path, st):
+    """Sorts reads by device and physical offset, falling back to the inode number."""
+    if st is None:
+        return (0, 0, 0)
+    offset = physical_offset(path)
+    return (st.st_dev, offset if offset is not None else 0, st.st_ino)
+
+
+def get_order_key(order):
+    """
+    Returns the sort key function of a read order.
+
+    Args:
+        order (str): 'none', 'inode' or 'extent'.
+
+    Returns:
+        A function called as `key(path, stat_result)`, or None for 'none'.
+
+    Raises:
+        ValueError: If the order is unknown.
+    """
+    if order in (None, 'none'):
+        return None
+    if order == 'inode':
+        return inode_key
+    if order == 'extent':
+        return extent_key
+    raise ValueError(f"Unknown read order: {order}")
@@ -0,0 +1,189 @@
+#! /usr/env/bin python
+"""
+This module provides functions for restoring backups.
+
+The `restore_chain` function replays a full backup followed by its
+incremental (or differential) backups into a destination directory, applying
+the deletions recorded in each archive's manifest.
+"""
+import contextlib
+import os
+import shutil
+from bakzip.services.dedup import COPY_PAX_KEY
+from bakzip.services.manifest import load_manifest, manifest_path
+from bakzip.services.chunk_store import is_snapshot, restore_snapshot
+from bakzip.services.stream_cipher import DecryptingReader, is_encrypted
+from bakzip.services.zip_dictionary import DictionaryZipReader, needs_reader
+
+# The frame magic numbers of the TAR codecs tarfile does not detect itself.
+ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+LZ4_MAGIC = b'\x04\x22\x4d\x18'
+
+
+def _safe_target(destination, rel_path):
+    target = os.path.realpath(os.path.join(destination, rel_path))
+    root = os.path.realpath(destination)
+    if os.path.isabs(rel_path) or os.path.commonpath([root, target]) != root:
+        return None
+    return target
+
+
+def _extract_zstd_zip(archive, destination):
+    # pyzipper cannot decompress zstd members, with or without the archive's dictionary.
+    with DictionaryZipReader(archive) as reader:
+        for name in reader.namelist():
+            target = _safe_target(destination, name)
+            if target is None:
+                print(f"Security Warning: Skipping {name} due to potential path traversal")
+                continue
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            reader.extract(name, target)
+
+
+def _extract_zip(archive, destination, password=None):
+    if needs_reader(archive):
+        _extract_zstd_zip(archive, destination)
+        return
+    import pyzipper
+    with pyzipper.AESZipFile(archive) as zip_file:
+        if password:
+            zip_file.setpassword(password.encode())
+        for name in zip_file.namelist():
+            if _safe_target(destination, name) is None:
+                print(f"Security Warning: Skipping {name} due to potential path traversal")
+                continue
+            zip_file.extract(name, destination)
+
+
+def _decompressing(fileobj, stack):
+    # tarfile only detects gzip, bzip2 and xz; zstd and lz4 streams are decompressed here.
+    start = fileobj.tell()
+    magic = fileobj.read(4)
+    fileobj.seek(start)
+    if magic == ZSTD_MAGIC:
+        import zstandard
+        # Auto-tuned archives are several concatenated frames.
+        return stack.enter_context(zstandard.ZstdDecompressor().stream_reader(fileobj, read_across_frames=True))
+    if magic == LZ4_MAGIC:
+        import lz4.frame
+        return stack.enter_context(lz4.frame.LZ4FrameFile(fileobj, 'rb'))
+    return None
+
+
+def _open_tar(archive, password, stack):
+    import tarfile
+    raw = stack.enter_context(open(archive, 'rb'))
+    if is_encrypted(archive):
+        if not password:
+            raise ValueError(f"{archive} is encrypted; pass --password")
+        raw = DecryptingReader(raw, password)
+    stream = _decompressing(raw, stack)
+    if stream is not None:
+        # The decompressed stream cannot seek, so its members are read in order.
+        return stack.enter_context(tarfile.open(fileobj=stream, mode='r|'))
+    return stack.enter_context(tarfile.open(fileobj=raw, mode='r:*'))
+
+
+def _separate_copy(destination, member):
+    # A deduplicated copy is stored as a hardlink member; give it its own inode again.
+    target = os.path.join(destination, member.name)
+    original = os.path.join(destination, member.linkname)
+    if not os.path.exists(original) or not os.path.samefile(target, original):
+        return  # tarfile copied it already, as hardlinks are not supported here.
+    temporary = target + '.bakzip-copy'
+    shutil.copyfile(original, temporary)
+    # The link was extracted onto the same inode, so its mode is the one extraction gave the member.
+    shutil.copymode(original, temporary)
+    os.replace(temporary, target)
+    os.utime(target, (member.mtime, member.mtime))
+
+
+def _extract_tar(archive, destination, password=None):
+    import tarfile
+    with contextlib.ExitStack() as stack:
+        tar = _open_tar(archive, password, stack)
+        # Members are extracted as they are read, which streamed (zstd, lz4) archives need.
+        directories = []
+        for member in tar:
+            if _safe_target(destination, member.name) is None or member.isdev():
+                print(f"Security Warning: Skipping {member.name} due to potential path traversal")
+                continue
+            if hasattr(tarfile, 'data_filter'):
+                # The filter rejects absolute links and links pointing outside the destination.
+                try:
+                    tar.extract(member, destination, set_attrs=not member.isdir(), filter='data')
+                except tarfile.FilterError as ex:
+                    print(f"Security Warning: Skipping {member.name}: {ex}")
+                    continue
+            else:
+                if member.issym() and _safe_target(
+                        destination, os.path.join(os.path.dirname(member.name), member.linkname)) is None:
+                    print(f"Security Warning: Skipping {member.name}, a link outside the destination")
+                    continue
+                tar.extract(member, destination, set_attrs=not member.isdir())
+            if member.isdir():
+                directories.append(member)
+            elif member.islnk() and member.pax_headers.get(COPY_PAX_KEY):
+                _separate_copy(destination, member)
+        # Like extractall, set the directory attributes last, as extracting their files changes them.
+        for member in reversed(directories):
+            if hasattr(tarfile, 'data_filter'):
+                tar.extract(member, destination, filter='data')
+            else:
+                tar.extract(member, destination)
+
+
+def restore_archive(archive, destination, password=None):
+    """
+    Extracts a single ZIP or TAR archive and applies its recorded deletions.
+
+    Snapshot indexes of a chunk repository are restored with `restore_snapshot`.
+
+    Args:
+        archive (str): The path to the archive or repository snapshot.
+        destination (str): The directory to restore into.
+        password (str, optional): The password of an encrypted ZIP or TAR archive.
+
+    Returns:
+        The manifest header of the archive, or None if it has no manifest.
+    """
+    if is_snapshot(archive):
+        restore_snapshot(archive, destination)
+        return None
+    if archive.endswith('.zip'):
+        _extract_zip(archive, destination, password)
+    else:
+        _extract_tar(archive, destination, password)
+
+    if not os.path.exists(manifest_path(archive)):
+        return None
+    header, _, deleted = load_manifest(archive)
+    for rel_path in deleted:
+        target = _safe_target(destination, rel_path)
+        if target and os.path.isfile(target):
+            os.remove(target)
+    return header
+
+
+def restore_chain(archives, destination, password=None):
+    """
+    Restores a full backup followed by its incremental backups, in order.
+
+    Args:
+        archives (list): The archive paths, starting with the full backup.
+        destination (str): The directory to restore into.
+        password (str, optional): The password of encrypted ZIP or TAR archives.
+
+    Raises:
+        ValueError: If no archives are given.
+    """
+    if not archives:
+        raise ValueError("No archives to restore")
+    os.makedirs(destination, exist_ok=True)
+    restored = []
+    for archive in archives:
+        header = restore_archive(archive, destination, password)
+        base = header.get('base') if header else None
+        if base and base not in restored:
+            print(f"Warning: {archive} is based on {base}, which was not restored before it")
+        restored.append(os.path.basename(archive))
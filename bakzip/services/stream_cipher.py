@@ -0,0 +1,324 @@
+#! /usr/env/bin python
+"""
+This module provides chunked authenticated encryption for archive streams.
+
+`EncryptingWriter` cuts a stream (such as a compressed TAR archive) into
+fixed-size chunks and seals each with AES-256-GCM in a thread pool, so
+encryption keeps up with parallel compression. `DecryptingReader` reads the
+chunks back as a stream, or seeks to any chunk without decrypting the ones
+before it.
+
+Layout: a 40-byte header, then one record per chunk of `chunk_size`
+ciphertext bytes followed by a 16-byte tag (the last chunk is shorter).
+
+    magic (8) | algorithm (1) | log2 N, r, p of scrypt (3) | chunk size (4)
+    | salt (16) | nonce prefix (8)
+
+The key is derived from the password with scrypt and the salt. A chunk's
+nonce is the nonce prefix followed by its 32-bit index, and its associated
+data is the header followed by a flag marking the final chunk, so chunks
+cannot be reordered, dropped, truncated or moved to another stream
+without the tag check failing.
+"""
+import hashlib
+import os
+import struct
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+MAGIC = b'BAKZENC\x01'
+ALGORITHM_AES_256_GCM = 1
+HEADER = struct.Struct('>8sBBBBI16s8s')
+TAG_SIZE = 16
+KEY_SIZE = 32
+CHUNK_SIZE = 1024 * 1024
+# Readers buffer a whole chunk before its tag is checked, so larger chunks are refused.
+MAX_CHUNK_SIZE = 16 * CHUNK_SIZE
+MAX_CHUNKS = 2 ** 32
+# Interactive scrypt parameters (16 MiB of memory); each archive derives its key once.
+SCRYPT_LOG2_N = 14
+SCRYPT_R = 8
+SCRYPT_P = 1
+
+
+def _aes():
+    try:
+        from Cryptodome.Cipher import AES
+    except ImportError:
+        raise ValueError("Encryption requires the 'pycryptodomex' package") from None
+    return AES
+
+
+def derive_key(password, salt, log2_n=SCRYPT_LOG2_N, r=SCRYPT_R, p=SCRYPT_P):
+    """Derives the 256-bit stream key from a password with scrypt."""
+    if isinstance(password, str):
+        password = password.encode()
+    n = 1 << log2_n
+    return hashlib.scrypt(password, salt=salt, n=n, r=r, p=p, maxmem=256 * n * r * p, dklen=KEY_SIZE)
+
+
+def _nonce(prefix, index):
+    if index >= MAX_CHUNKS:
+        raise ValueError("The stream has too many chunks for its chunk size")
+    return prefix + struct.pack('>I', index)
+
+
+def _seal(key, nonce, aad, data, metrics):
+    started = time.perf_counter()
+    aes = _aes()
+    cipher = aes.new(key, aes.MODE_GCM, nonce=nonce, mac_len=TAG_SIZE)
+    cipher.update(aad)
+    ciphertext, tag = cipher.encrypt_and_digest(data)
+    if metrics is not None:
+        metrics.add_time('encrypt', time.perf_counter() - started)
+    return ciphertext + tag
+
+
+def _open(key, nonce, aad, record):
+    aes = _aes()
+    cipher = aes.new(key, aes.MODE_GCM, nonce=nonce, mac_len=TAG_SIZE)
+    cipher.update(aad)
+    try:
+        return cipher.decrypt_and_verify(record[:-TAG_SIZE], record[-TAG_SIZE:])
+    except ValueError:
+        raise ValueError("The encrypted archive is corrupt or the password is wrong") from None
+
+
+def is_encrypted(path):
+    """Returns whether a file starts with the header of an encrypted stream."""
+    try:
+        with open(path, 'rb') as f:
+            return f.read(len(MAGIC)) == MAGIC
+    except OSError:
+        return False
+
+
+class EncryptingWriter:
+    """
+    A write-only file object that encrypts chunks in parallel.
+
+    At most `2 * jobs` chunks are in flight, so memory stays bounded by
+    roughly `2 * jobs * chunk_size`. A full chunk is only sealed once more
+    data follows it, as the final chunk is marked as such.
+
+    Args:
+        fileobj: The binary file object receiving the encrypted stream.
+        password (str): The password the key is derived from.
+        jobs (int, optional): The number of encryption threads. Defaults to 1.
+        chunk_size (int, optional): The plaintext bytes per chunk, up to `MAX_CHUNK_SIZE`. Defaults to 1 MiB.
+        metrics (Metrics, optional): Receives the time spent encrypting as the 'encrypt' phase.
+
+    Raises:
+        ValueError: If pycryptodomex is not installed, or the chunk size is out of range.
+    """
+
+    def __init__(self, fileobj, password, jobs=1, chunk_size=CHUNK_SIZE, metrics=None):
+        _aes()
+        if not 1 <= chunk_size <= MAX_CHUNK_SIZE:
+            raise ValueError(f"The chunk size must be between 1 and {MAX_CHUNK_SIZE} bytes")
+        self.fileobj = fileobj
+        self.jobs = max(1, jobs)
+        self.chunk_size = chunk_size
+        self.metrics = metrics
+        self.closed = False
+        salt = os.urandom(16)
+        self._prefix = os.urandom(8)
+        self._header = HEADER.pack(MAGIC, ALGORITHM_AES_256_GCM, SCRYPT_LOG2_N, SCRYPT_R, SCRYPT_P, chunk_size,
+                                   salt, self._prefix)
+        self._key = derive_key(password, salt)
+        self._buffer = bytearray()
+        self._index = 0
+        self._size = 0
+        self._pending = deque()
+        self._pool = ThreadPoolExecutor(max_workers=self.jobs)
+        self.fileobj.write(self._header)
+
+    def writable(self):
+        return True
+
+    def tell(self):
+        """Returns the number of plaintext bytes written so far."""
+        return self._size
+
+    def write(self, data):
+        if self.closed:
+            raise ValueError("write to closed file")
+        data = memoryview(data).cast('B')
+        self._size += len(data)
+        self._buffer += data
+        while len(self._buffer) > self.chunk_size:
+            chunk = bytes(self._buffer[:self.chunk_size])
+            del self._buffer[:self.chunk_size]
+            self._submit(chunk, final=False)
+        return len(data)
+
+    def _submit(self, chunk, final):
+        nonce = _nonce(self._prefix, self._index)
+        self._index += 1
+        aad = self._header + (b'\x01' if final else b'\x00')
+        self._pending.append(self._pool.submit(_seal, self._key, nonce, aad, chunk, self.metrics))
+        self._drain(2 * self.jobs)
+
+    def _drain(self, limit):
+        while len(self._pending) > limit:
+            self.fileobj.write(self._pending.popleft().result())
+
+    def flush(self):
+        self.fileobj.flush()
+
+    def close(self):
+        """
+        Encrypts the remaining data as the final chunk.
+
+        The underlying file object is flushed but left open.
+        """
+        if self.closed:
+            return
+        try:
+            self._submit(bytes(self._buffer), final=True)
+            self._buffer = bytearray()
+            self._drain(0)
+            self.fileobj.flush()
+        finally:
+            self._pool.shutdown()
+            self.closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class DecryptingReader:
+    """
+    A read-only file object that decrypts and verifies a stream chunk by chunk.
+
+    Reading streams through the chunks in order. If `fileobj` is seekable,
+    `seek` jumps to the chunk holding the target offset and only that chunk
+    is decrypted.
+
+    Args:
+        fileobj: The binary file object holding the encrypted stream.
+        password (str): The password the stream was encrypted with.
+
+    Raises:
+        ValueError: If the stream is not an encrypted stream, its scrypt parameters or chunk size
+            exceed the writer's limits, or pycryptodomex is not installed.
+    """
+
+    def __init__(self, fileobj, password):
+        _aes()
+        self.fileobj = fileobj
+        self.closed = False
+        self._header = self._read_exact(HEADER.size)
+        if len(self._header) < HEADER.size or not self._header.startswith(MAGIC):
+            raise ValueError("Not an encrypted BakZip stream")
+        _, algorithm, log2_n, r, p, self.chunk_size, salt, self._prefix = HEADER.unpack(self._header)
+        if algorithm != ALGORITHM_AES_256_GCM:
+            raise ValueError(f"Unsupported encryption algorithm: {algorithm}")
+        # The header is read before it is authenticated, so scrypt must not be asked for more than the
+        # writer's parameters cost; larger ones could take gigabytes of memory or hours to derive. The
+        # chunk size bounds the record buffered before its tag is checked.
+        if not (1 <= log2_n <= SCRYPT_LOG2_N and 1 <= r <= SCRYPT_R and 1 <= p <= SCRYPT_P
+                and 1 <= self.chunk_size <= MAX_CHUNK_SIZE):
+            raise ValueError("Unsupported encryption parameters")
+        self._key = derive_key(password, salt, log2_n, r, p)
+        self._record_size = self.chunk_size + TAG_SIZE
+        self._size = None
+        if self.seekable():
+            self._start = fileobj.tell()
+            length = fileobj.seek(0, os.SEEK_END) - self._start
+            fileobj.seek(self._start)
+            self._records = max(1, -(-length // self._record_size))
+            self._size = max(0, length - self._records * TAG_SIZE)
+        self._index = 0
+        self._chunk = b''
+        self._offset = 0
+        self._skip = 0
+        self._position = 0
+        self._lookahead = None
+        self._eof = False
+
+    def _read_exact(self, size):
+        data = bytearray()
+        while len(data) < size:
+            block = self.fileobj.read(size - len(data))
+            if not block:
+                break
+            data += block
+        return bytes(data)
+
+    def _load_next(self):
+        if self._eof:
+            return False
+        record = self._lookahead if self._lookahead is not None else self._read_exact(self._record_size)
+        if len(record) < TAG_SIZE:
+            raise ValueError("The encrypted archive is truncated")
+        # A chunk is final if nothing follows it; the tag check rejects a truncated stream.
+        self._lookahead = self._read_exact(self._record_size)
+        final = not self._lookahead
+        aad = self._header + (b'\x01' if final else b'\x00')
+        self._chunk = _open(self._key, _nonce(self._prefix, self._index), aad, record)
+        self._index += 1
+        self._eof = final
+        return True
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        seekable = getattr(self.fileobj, 'seekable', None)
+        return bool(seekable and seekable())
+
+    def tell(self):
+        """Returns the plaintext position."""
+        return self._position
+
+    def read(self, size=-1):
+        out = bytearray()
+        while size is None or size < 0 or len(out) < size:
+            if self._offset >= len(self._chunk):
+                if not self._load_next():
+                    break
+                # After a seek, the target may lie inside the chunk.
+                self._offset = min(self._skip, len(self._chunk))
+                self._skip = 0
+                continue
+            end = len(self._chunk) if size is None or size < 0 else self._offset + size - len(out)
+            piece = self._chunk[self._offset:end]
+            out += piece
+            self._offset += len(piece)
+        self._position += len(out)
+        return bytes(out)
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        """Moves to a plaintext offset; only the chunk holding it is decrypted on the next read."""
+        if not self.seekable():
+            raise OSError("The underlying stream is not seekable")
+        if whence == os.SEEK_CUR:
+            offset += self._position
+        elif whence == os.SEEK_END:
+            offset += self._size
+        if offset < 0:
+            raise ValueError(f"Negative seek position {offset}")
+        index = min(offset // self.chunk_size, self._records - 1)
+        self.fileobj.seek(self._start + index * self._record_size)
+        self._index = index
+        self._chunk = b''
+        self._offset = 0
+        self._skip = offset - index * self.chunk_size
+        self._lookahead = None
+        self._eof = False
+        self._position = offset
+        return offset
+
+    def close(self):
+        self.closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
@@ -3,38 +3,415 @@
 This module provides functions for creating TAR archives.
 
 The `create_tar` function allows you to create a TAR archive from a list of files,
-with optional compression using gzip.
+compressed with any codec of the registry in `codecs` (gzip, bzip2, xz, zstd,
+lz4). With `jobs` greater than one, the gzip stream is compressed
+block-parallel by `ParallelGzipWriter` and zstd uses its own worker threads.
+With a password, the compressed stream is encrypted in parallel chunks by
+`stream_cipher.EncryptingWriter`. With a checkpoint journal, the stream is
+compressed in segments (concatenated gzip members, bzip2/xz streams or
+zstd/lz4 frames, which the usual tools read as one stream), and each
+checkpoint ends a segment, so a resumed archive is appended after it.
+Duplicate files found by a `dedup.Deduplicator` are stored as hardlink
+members of their original. The archive can also be written to a stream such
+as stdout or a pipe, as none of the writers seek.
 """
-import tarfile
+import contextlib
+import functools
+import io
+import stat
 import os
-from tqdm import tqdm
+import time
+from bakzip.services import prefetch
+from bakzip.services.codecs import CodecStats, resolve_compression
+from bakzip.services.dedup import COPY_PAX_KEY
+from bakzip.services.gzip_writer import ParallelGzipWriter
+from bakzip.services.stream_cipher import EncryptingWriter
+from bakzip.services.tree_walker import entry_arcname, split_entry
+from bakzip.utilities.progress import tqdm
 
-def create_tar(files, output, compression='gz', base_dir=None):
+try:
+    import grp
+    import pwd
+except ImportError:  # Windows
+    grp = pwd = None
+
+# Codecs tarfile compresses natively, with the keyword taking the level.
+_TARFILE_MODES = {
+    'store': ('w', None),
+    'gz': ('w:gz', 'compresslevel'),
+    'deflate': ('w:gz', 'compresslevel'),
+    'bzip2': ('w:bz2', 'compresslevel'),
+    'xz': ('w:xz', 'preset'),
+}
+
+def _iter_arcnames(files, base_dir, skip=frozenset()):
+    for item in files:
+        file, st = split_entry(item)
+        arcname = entry_arcname(item, base_dir)
+        if ".." in arcname or os.path.isabs(arcname):
+            print(f"Security Warning: Skipping {file} due to potential path traversal (arcname: {arcname})")
+            continue
+        if skip and arcname.replace(os.sep, '/') in skip:
+            continue  # Already in the archive being resumed.
+        yield file, arcname, st
+
+# gettarinfo looks the owner names up for every file; most trees have only a few owners.
+@functools.lru_cache(maxsize=256)
+def _user_name(uid):
+    try:
+        return pwd.getpwuid(uid)[0] if pwd else ''
+    except KeyError:
+        return ''
+
+@functools.lru_cache(maxsize=256)
+def _group_name(gid):
+    try:
+        return grp.getgrgid(gid)[0] if grp else ''
+    except KeyError:
+        return ''
+
+def _tarinfo(tar, file, arcname, st):
+    """
+    Builds the TarInfo of a file from its lstat result, like `TarFile.gettarinfo`
+    but without stat'ing the file again. Returns None for unsupported file types.
+    """
+    import tarfile
+    tarinfo = tar.tarinfo()
+    tarinfo.tarfile = tar
+    tarinfo.name = arcname.replace(os.sep, '/').lstrip('/')
+    mode = st.st_mode
+    linkname = ''
+    if stat.S_ISREG(mode):
+        inode = (st.st_ino, st.st_dev)
+        if st.st_nlink > 1 and inode in tar.inodes and tarinfo.name != tar.inodes[inode]:
+            # A hardlink to a file already in the archive.
+            member_type = tarfile.LNKTYPE
+            linkname = tar.inodes[inode]
+        else:
+            member_type = tarfile.REGTYPE
+            if inode[0]:
+                tar.inodes[inode] = tarinfo.name
+    elif stat.S_ISDIR(mode):
+        member_type = tarfile.DIRTYPE
+    elif stat.S_ISFIFO(mode):
+        member_type = tarfile.FIFOTYPE
+    elif stat.S_ISLNK(mode):
+        member_type = tarfile.SYMTYPE
+        linkname = os.readlink(file)
+    elif stat.S_ISCHR(mode):
+        member_type = tarfile.CHRTYPE
+    elif stat.S_ISBLK(mode):
+        member_type = tarfile.BLKTYPE
+    else:
+        return None
+    tarinfo.mode = mode
+    tarinfo.uid = st.st_uid
+    tarinfo.gid = st.st_gid
+    tarinfo.size = st.st_size if member_type == tarfile.REGTYPE else 0
+    tarinfo.mtime = st.st_mtime
+    tarinfo.type = member_type
+    tarinfo.linkname = linkname
+    tarinfo.uname = _user_name(st.st_uid)
+    tarinfo.gname = _group_name(st.st_gid)
+    if member_type in (tarfile.CHRTYPE, tarfile.BLKTYPE) and hasattr(os, 'major'):
+        tarinfo.devmajor = os.major(st.st_rdev)
+        tarinfo.devminor = os.minor(st.st_rdev)
+    return tarinfo
+
+def _link_to(tarinfo, duplicate):
+    # A hardlink member stores no data; extracting it links (or copies) the original member.
+    import tarfile
+    tarinfo.type = tarfile.LNKTYPE
+    tarinfo.linkname = duplicate.target
+    tarinfo.size = 0
+    if not duplicate.hardlink:
+        tarinfo.pax_headers = {COPY_PAX_KEY: '1'}
+
+def _add_file(tar, file, arcname, data, st=None, duplicate=None):
+    if data is None and st is None:
+        tar.add(file, arcname=arcname)
+        return
+    if tar.name and os.path.abspath(file) == tar.name:
+        return  # Like tar.add, never add the archive to itself.
+    tarinfo = tar.gettarinfo(file, arcname) if st is None else _tarinfo(tar, file, arcname, st)
+    if tarinfo is None:
+        return
+    if duplicate is not None:
+        _link_to(tarinfo, duplicate)
+    if not tarinfo.isreg():
+        tar.addfile(tarinfo)
+    elif data is not None:
+        # The file may have changed since it was read; the data read wins.
+        tarinfo.size = len(data)
+        tar.addfile(tarinfo, io.BytesIO(data))
+    else:
+        with open(file, 'rb') as f:
+            tar.addfile(tarinfo, f)
+
+def _add_files(tar, files, base_dir, metrics=None, read_ahead=0, read_order=None, skip=frozenset(),
+               on_added=None, dedup=None):
+    items = prefetch.read_ahead(_iter_arcnames(files, base_dir, skip), key=lambda item: item[0],
+                                max_bytes=read_ahead, metrics=metrics, order=read_order,
+                                stat_of=lambda item: item[2])
+    for (file, arcname, st), data in tqdm(items, desc="Creating TAR file", unit="file"):
+        name = arcname.replace(os.sep, '/')
+        try:
+            duplicate = dedup.match(file, name, st, data) if dedup is not None else None
+            if metrics is None:
+                _add_file(tar, file, arcname, data, st, duplicate)
+            else:
+                # tarfile reads, compresses and writes in one call, so it is timed as one phase.
+                offset, started = tar.offset, time.perf_counter()
+                _add_file(tar, file, arcname, data, st, duplicate)
+                elapsed = time.perf_counter() - started
+                metrics.add_time('tar', elapsed)
+                metrics.record_file(file, elapsed, tar.offset - offset, 0)
+        except OSError as e:
+            print(f"Error adding {file} to tar file: {e}")
+            if dedup is not None:
+                dedup.discard(name)
+            continue
+        if on_added is not None:
+            on_added(name)
+
+class _CountingStream:
+    """Wraps a write-only stream (stdout, a pipe), counting the bytes written so `tell` works."""
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.bytes_written = 0
+
+    def write(self, data):
+        self.fileobj.write(data)
+        self.bytes_written += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.bytes_written
+
+    def flush(self):
+        self.fileobj.flush()
+
+class _SegmentedStream:
     """
-    Creates a TAR archive from a list of files.
+    A write-only stream compressing into `raw` in independent segments.
+
+    `end_segment` finishes the current codec stream (a gzip member, zstd
+    frame, ...), so `raw` holds a complete prefix of the archive that a
+    resumed run can append to.
+    """
+
+    def __init__(self, raw, open_segment, offset=0):
+        self.raw = raw
+        self._open_segment = open_segment
+        self._segment = None
+        self._offset = offset
+
+    def write(self, data):
+        if self._segment is None:
+            self._segment = self._open_segment(self.raw)
+        self._segment.write(data)
+        self._offset += len(data)
+        return len(data)
+
+    def tell(self):
+        """Returns the uncompressed TAR offset."""
+        return self._offset
+
+    def end_segment(self):
+        if self._segment is not None and self._segment is not self.raw:
+            self._segment.close()
+        self._segment = None
+        self.raw.flush()
+
+class _TunedStream(_SegmentedStream):
+    """
+    A segmented stream compressing with the level an `AutoTuner` currently picks.
+
+    The time spent in each write is reported to the tuner, and a new segment
+    starts whenever the tuner changes the level.
+    """
+
+    def __init__(self, raw, codec, jobs, tuner, offset=0):
+        super().__init__(raw, lambda fileobj: codec.tar_stream(fileobj, self.level, jobs), offset)
+        self.tuner = tuner
+        self.level = tuner.choice.level
+
+    def write(self, data):
+        if self.tuner.choice.level != self.level:
+            self.end_segment()
+            self.level = self.tuner.choice.level
+        started = time.perf_counter()
+        written = super().write(data)
+        self.tuner.record(len(data), time.perf_counter() - started, elapsed=True)
+        return written
+
+def _segmented_stream(raw, codec, level, jobs, tuner=None, offset=0):
+    if tuner is not None:
+        return _TunedStream(raw, codec, jobs, tuner, offset)
+    return _SegmentedStream(raw, lambda fileobj: codec.tar_stream(fileobj, level, jobs), offset)
+
+def _create_tar_resumable(files, output, codec, level, jobs, base_dir, metrics, read_ahead, read_order,
+                          checkpoint, dedup=None, tuner=None):
+    """Writes a TAR archive in segments, committing them to a checkpoint journal. Returns the TAR size."""
+    import tarfile
+    resumed = checkpoint.resumed
+    with open(output, 'r+b' if resumed else 'wb') as raw:
+        if resumed:
+            raw.truncate(checkpoint.offset)
+            raw.seek(checkpoint.offset)
+        stream = _segmented_stream(raw, codec, level, jobs, tuner, checkpoint.state.get('tar_offset', 0))
+        tar = tarfile.open(fileobj=stream, mode='w')
+
+        def commit():
+            stream.end_segment()
+            checkpoint.commit(raw, raw.tell(), {'tar_offset': tar.offset})
+
+        def on_added(arcname):
+            checkpoint.add(arcname)
+            if checkpoint.due():
+                commit()
+
+        _add_files(tar, files, base_dir, metrics, read_ahead, read_order,
+                   skip=checkpoint.committed if resumed else frozenset(), on_added=on_added, dedup=dedup)
+        tar.close()
+        stream.end_segment()
+    return tar.offset
+
+@contextlib.contextmanager
+def _open_output(output, password, jobs, metrics):
+    # The archive file or stream, or an encrypting stream into it if a password is given.
+    with contextlib.nullcontext(output) if isinstance(output, _CountingStream) else open(output, 'wb') as raw:
+        if not password:
+            yield raw
+            return
+        with EncryptingWriter(raw, password, jobs=jobs, metrics=metrics) as encrypted:
+            yield encrypted
+
+def _finish(stats, tar_size, output, started, metrics):
+    # Throughput is measured over the whole write, as tarfile streams do not expose the codec time.
+    stats.wall_seconds = time.perf_counter() - started
+    stats.bytes_in = tar_size
+    try:
+        stats.bytes_out = output.tell() if isinstance(output, _CountingStream) else os.path.getsize(output)
+    except OSError:
+        pass
+    if metrics is not None:
+        # Compressed sizes are only known for the whole stream.
+        metrics.add_bytes(0, stats.bytes_out)
+    return stats
+
+def create_tar(files, output, compression='gz', base_dir=None, jobs=1, adaptive=False, level=None, metrics=None,
+               read_ahead=prefetch.DEFAULT_READ_AHEAD, read_order=None, password=None, checkpoint=None, dedup=None,
+               tuner=None):
+    """
+    Creates a TAR archive from a list of files, optionally encrypted.
 
     Args:
-        files (list): A list of file paths to include in the archive.
-        output (str): The path to the output TAR file.
-        compression (str, optional): The compression method to use. Defaults to 'gz'.
-            Supported values: 'gz' (gzip), None (no compression).
+        files (iterable): The file paths or `FileEntry` records to include in the archive.
+            Any iterable works, including the lazy `iter_directory` scanner. The members of
+            `FileEntry` records are built from their stat data, so files are not stat'ed again.
+        output (str or file object): The path to the output TAR file, or a writable binary
+            stream such as stdout or a pipe, which is written sequentially and left open.
+        compression (str, optional): The compression codec to use. Defaults to 'gz'.
+            Supported values: 'gz' (gzip), 'bzip2', 'xz', 'zstd', 'lz4', 'store' or None
+            (no compression). The 'fast', 'normal' and 'maximum' presets write an
+            uncompressed TAR.
         base_dir (str, optional): The base directory for relative paths in the archive.
-            Defaults to the directory of the first file if not provided.
-    """
-    mode = 'w:gz' if compression == 'gz' else 'w'
-    if base_dir is None and files:
-        base_dir = os.path.dirname(files[0])
-
-    with tarfile.open(output, mode) as tar:
-        for file in tqdm(files, desc="Creating TAR file", unit="file"):
-            arcname = os.path.relpath(file, base_dir)
-            if ".." in arcname or os.path.isabs(arcname):
-                print(f"Security Warning: Skipping {file} due to potential path traversal (arcname: {arcname})")
-                continue
-            try:
-                tar.add(file, arcname=arcname)
-            except OSError as e:
-                print(f"Error adding {file} to tar file: {e}")
+            Defaults to the directory of the first file if not provided, which
+            requires materialising `files`.
+        jobs (int, optional): The number of gzip compression threads. Defaults to 1,
+            which uses tarfile's own gzip stream. Use 0 for one thread per CPU core.
+        adaptive (bool, optional): Whether to store gzip blocks that do not compress,
+            such as the content of media files. Applies to the parallel gzip writer,
+            which is also used for jobs=1 when adaptive is set.
+        level (int, optional): The codec level, overriding the level of the preset.
+        metrics (Metrics, optional): Receives per-file timings as the 'tar' phase, which
+            covers reading, compressing and writing.
+        read_ahead (int, optional): The number of bytes of upcoming files read in the
+            background while the current one is compressed (see `prefetch`). Defaults
+            to 64 MiB; 0 reads each file only when it is added.
+        read_order (str, optional): Issue read-ahead reads sorted by 'inode' or physical
+            'extent' (see `read_order`). The member order in the archive is unchanged.
+        password (str, optional): Encrypt the compressed archive with AES-256-GCM in chunks
+            (see `stream_cipher`), using `jobs` encryption threads. Defaults to None.
+        checkpoint (Checkpoint, optional): Writes the archive in segments and commits them to
+            a checkpoint journal (see `checkpoint`). If it was resumed, the partial archive is
+            truncated to its last commit and the committed files are skipped. Not supported
+            with a password.
+        dedup (Deduplicator, optional): Finds hardlinks and files identical to an earlier
+            member (see `dedup`), which are stored as hardlink members of it instead of
+            being read and compressed again. Only `FileEntry` records are matched.
+        tuner (AutoTuner, optional): Adjusts the level of `compression` while the archive is
+            written (see `auto_tune`); each change starts a new codec stream in the archive.
+
+    Returns:
+        CodecStats: The uncompressed TAR size, the archive size and the time taken.
+
+    Raises:
+        ValueError: If the codec is unknown, unavailable or the level is invalid, or
+            encryption is requested without pycryptodomex or with a checkpoint, or a
+            checkpoint is given with a stream output.
+    """
+    import tarfile
+    codec, level = resolve_compression(compression, 'tar', level)
+    if password and checkpoint is not None:
+        raise ValueError("Encrypted TAR archives cannot be checkpointed")
+    if hasattr(output, 'write'):
+        if checkpoint is not None:
+            raise ValueError("Checkpoints need a TAR archive file, not a stream")
+        output = _CountingStream(output)
+    stats = CodecStats(codec, level)
+    started = time.perf_counter()
+    if base_dir is None:
+        # A `FileCatalog` knows its root; anything else is read to find it.
+        base_dir = getattr(files, 'root', None)
+    if base_dir is None:
+        files = list(files)
+        if files:
+            base_dir = os.path.dirname(split_entry(files[0])[0])
+
+    if jobs == 0:
+        jobs = os.cpu_count() or 1
+    if tuner is not None:
+        tuner.restrict(codec.name)
+    if checkpoint is not None:
+        tar_size = _create_tar_resumable(files, output, codec, level, jobs, base_dir, metrics, read_ahead,
+                                         read_order, checkpoint, dedup, tuner)
+        return _finish(stats, tar_size, output, started, metrics)
+    if tuner is not None and codec.name != 'store':
+        with _open_output(output, password, jobs, metrics) as raw:
+            stream = _segmented_stream(raw, codec, level, jobs, tuner)
+            with tarfile.open(fileobj=stream, mode='w') as tar:
+                _add_files(tar, files, base_dir, metrics, read_ahead, read_order, dedup=dedup)
+            stream.end_segment()
+        return _finish(stats, tar.offset, output, started, metrics)
+    if codec.name in ('gz', 'deflate') and (jobs > 1 or adaptive):
+        with _open_output(output, password, jobs, metrics) as raw, \
+                ParallelGzipWriter(raw, level=level, jobs=jobs, adaptive=adaptive) as gz, \
+                tarfile.open(fileobj=gz, mode='w') as tar:
+            _add_files(tar, files, base_dir, metrics, read_ahead, read_order, dedup=dedup)
+        return _finish(stats, tar.offset, output, started, metrics)
+
+    if codec.name in _TARFILE_MODES:
+        mode, keyword = _TARFILE_MODES[codec.name]
+        options = {keyword: level} if keyword else {}
+        # tarfile opens plain archive files itself.
+        plain_file = not password and not isinstance(output, _CountingStream)
+        with contextlib.nullcontext() if plain_file else _open_output(output, password, jobs, metrics) as raw, \
+                tarfile.open(None if raw else output, mode, fileobj=raw, **options) as tar:
+            _add_files(tar, files, base_dir, metrics, read_ahead, read_order, dedup=dedup)
+        return _finish(stats, tar.offset, output, started, metrics)
+
+    # zstd and lz4 wrap the file in a codec stream; tarfile writes it as a pipe.
+    with _open_output(output, password, jobs, metrics) as raw:
+        stream = codec.tar_stream(raw, level, jobs)
+        try:
+            with tarfile.open(fileobj=stream, mode='w|') as tar:
+                _add_files(tar, files, base_dir, metrics, read_ahead, read_order, dedup=dedup)
+        finally:
+            stream.close()
+    return _finish(stats, tar.offset, output, started, metrics)
 
 if __name__ == "__main__":
     create_tar(["test.txt"], "test.tar.gz")
@@ -0,0 +1,150 @@
+#! /usr/env/bin python
+"""
+This module provides a parallel, deterministic directory walker.
+
+`scan_tree` lists directories with `os.scandir` in a thread pool, keeping
+the stat data of each `DirEntry` so callers never stat a file twice.
+Ignored directories are pruned before they are listed, and results are
+produced depth-first with names sorted, so the order is the same on every
+run regardless of thread timing. `walk_tree` flattens the listings into the
+included files, which is what the archive writers consume.
+"""
+import os
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+DEFAULT_SCAN_JOBS = 8
+
+FileEntry = namedtuple('FileEntry', ['path', 'rel_path', 'stat', 'root'], defaults=[None])
+FileEntry.__doc__ = """A scanned file: its path, its path relative to the scan root, its lstat result (or None)
+and the scan root."""
+
+DirectoryListing = namedtuple('DirectoryListing', ['path', 'rel_path', 'files', 'skipped', 'pruned'])
+DirectoryListing.__doc__ = """The included and skipped `FileEntry` records of one directory, and its ignored
+subdirectories, which are not listed (their `FileEntry` records have no stat)."""
+
+
+def _stat(entry):
+    # lstat, like tarfile; for regular files DirEntry caches it, so this is the only stat of the file.
+    try:
+        return entry.stat(follow_symlinks=False)
+    except OSError:
+        return None
+
+
+def split_entry(item):
+    """
+    Returns the path and scan-time stat result of an item given to the archive writers.
+
+    Args:
+        item (FileEntry or str): A scanned entry, or a plain path.
+
+    Returns:
+        A tuple of the path and its lstat result, or None if the item is a plain path.
+    """
+    if isinstance(item, FileEntry):
+        return item.path, item.stat
+    return item, None
+
+
+def entry_arcname(item, base_dir):
+    """
+    Returns the path of an item relative to `base_dir`, like `os.path.relpath`.
+
+    The relative path of a `FileEntry` scanned from `base_dir` is reused, so
+    most files of a backup skip the path arithmetic of `relpath`.
+
+    Args:
+        item (FileEntry or str): A scanned entry, or a plain path.
+        base_dir (str): The directory the path is made relative to.
+    """
+    if isinstance(item, FileEntry):
+        if item.root is not None and item.root == base_dir:
+            return item.rel_path
+        item = item.path
+    return os.path.relpath(item, base_dir)
+
+
+def _list_directory(root, path, rel_path, ignore):
+    files, skipped, pruned, dirs = [], [], [], []
+    try:
+        with os.scandir(path) as it:
+            entries = sorted(it, key=lambda e: e.name)
+    except OSError:
+        return files, skipped, pruned, dirs
+
+    enter = getattr(ignore, 'enter', None)
+    if enter is not None and any(entry.name == ignore.ignore_file for entry in entries):
+        ignore = enter(path, rel_path)
+
+    for entry in entries:
+        rel_child = os.path.join(rel_path, entry.name)
+        try:
+            is_dir = entry.is_dir()
+        except OSError:
+            is_dir = False
+        if is_dir:
+            if ignore(rel_child, True):
+                pruned.append(FileEntry(entry.path, rel_child, None, root))
+            elif not entry.is_symlink():
+                # Like os.walk, symlinked directories are neither archived nor followed.
+                dirs.append((entry.path, rel_child, ignore))
+            continue
+        record = FileEntry(entry.path, rel_child, _stat(entry), root)
+        if ignore(rel_child, False):
+            skipped.append(record)
+        else:
+            files.append(record)
+    return files, skipped, pruned, dirs
+
+
+def scan_tree(directory, ignore=None, jobs=DEFAULT_SCAN_JOBS):
+    """
+    Lists a directory tree in parallel, yielding one listing per directory.
+
+    Directories are yielded depth-first in sorted order (a parent before its
+    children), the same shape as `os.walk(topdown=True)`. Up to `4 * jobs`
+    directories are listed ahead of the consumer.
+
+    Args:
+        directory (str): The root directory to scan.
+        ignore (callable, optional): Called as `ignore(rel_path, is_dir)`; returning
+            True skips a file or prunes a directory before it is listed. If it has
+            an `enter(path, rel_path)` method and an `ignore_file` name, `enter` is
+            called for directories containing that file and returns the callable
+            used for the directory's subtree (see `IgnoreMatcher`).
+        jobs (int, optional): The number of listing threads. Defaults to 8.
+
+    Yields:
+        DirectoryListing: The included and skipped files and pruned directories of each directory.
+    """
+    if ignore is None:
+        ignore = lambda rel_path, is_dir: False  # noqa: E731
+    window = 4 * max(1, jobs)
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as pool:
+        # Each stack item is [path, rel_path, ignore, future]; the top of the stack is visited next.
+        stack = [[directory, '', ignore, None]]
+        while stack:
+            for item in reversed(stack[-window:]):
+                if item[3] is None:
+                    item[3] = pool.submit(_list_directory, directory, *item[:3])
+            path, rel_path, _, future = stack.pop()
+            files, skipped, pruned, dirs = future.result()
+            stack.extend([*child, None] for child in reversed(dirs))
+            yield DirectoryListing(path, rel_path, files, skipped, pruned)
+
+
+def walk_tree(directory, ignore=None, jobs=DEFAULT_SCAN_JOBS):
+    """
+    Yields the included files of a directory tree in deterministic order.
+
+    Args:
+        directory (str): The root directory to scan.
+        ignore (callable, optional): Called as `ignore(rel_path, is_dir)`.
+        jobs (int, optional): The number of listing threads. Defaults to 8.
+
+    Yields:
+        FileEntry: The included files, carrying the stat data from the scan.
+    """
+    for listing in scan_tree(directory, ignore, jobs):
+        yield from listing.files
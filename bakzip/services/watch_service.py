@@ -0,0 +1,267 @@
+#! /usr/env/bin python
+"""
+This module provides the change journal behind `bakzip watch`.
+
+`TreeWatcher` puts an inotify watch on every directory of the source tree
+that the .bakzipignore rules do not prune, and records each event on a file
+that is not ignored in a `ChangeJournal`. `apply_journal` turns the journal
+into the files of a delta archive and updates the manifest state of the
+tree, so a delta is written without walking the tree. When the kernel drops
+events (queue overflow) or an ignore file changes, the journal asks for a
+rescan instead, which runs a regular incremental backup.
+"""
+import os
+import stat
+import time
+from bakzip.services import inotify
+from bakzip.services.ignore_engine import IGNORE_FILE_NAME, IgnoreMatcher
+from bakzip.services.manifest import hash_file
+
+WATCH_MASK = (inotify.IN_ATTRIB | inotify.IN_CLOSE_WRITE | inotify.IN_CREATE | inotify.IN_DELETE
+              | inotify.IN_MODIFY | inotify.IN_MOVED_FROM | inotify.IN_MOVED_TO | inotify.IN_ONLYDIR
+              | inotify.IN_DONT_FOLLOW | inotify.IN_EXCL_UNLINK)
+_REMOVED = inotify.IN_DELETE | inotify.IN_MOVED_FROM
+
+
+class ChangeJournal:
+    """
+    The paths changed since the last archive, relative to the watched directory.
+
+    Attributes:
+        changed (dict): The changed or created files, mapped to their size when last seen.
+        deleted (set): The deleted or moved-away files.
+        deleted_dirs (set): The deleted or moved-away directories, whose files are all gone.
+        rescan (bool): Whether events were lost, so only a full scan finds all changes.
+        started (float): The `time.monotonic()` of the first change, or None.
+        bytes (int): The total size of the changed files.
+    """
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        """Forgets all pending changes, after they were archived."""
+        self.changed = {}
+        self.deleted = set()
+        self.deleted_dirs = set()
+        self.rescan = False
+        self.started = None
+        self.bytes = 0
+
+    def _touch(self):
+        if self.started is None:
+            self.started = time.monotonic()
+
+    def change(self, rel_path, size=0):
+        """Records a created or modified file and its current size."""
+        self._touch()
+        self.bytes += size - self.changed.get(rel_path, 0)
+        self.changed[rel_path] = size
+        self.deleted.discard(rel_path)
+
+    def delete(self, rel_path):
+        """Records a deleted file."""
+        self._touch()
+        self.bytes -= self.changed.pop(rel_path, 0)
+        self.deleted.add(rel_path)
+
+    def delete_tree(self, rel_path):
+        """Records a deleted directory."""
+        self._touch()
+        prefix = rel_path + os.sep
+        for path in [path for path in self.changed if path.startswith(prefix)]:
+            self.delete(path)
+        self.deleted_dirs.add(rel_path)
+
+    def request_rescan(self):
+        """Records that changes were lost."""
+        self._touch()
+        self.rescan = True
+
+    def age(self):
+        """Returns the seconds since the first pending change, or 0."""
+        return time.monotonic() - self.started if self.started is not None else 0
+
+    def __bool__(self):
+        return bool(self.changed or self.deleted or self.deleted_dirs or self.rescan)
+
+
+class TreeWatcher:
+    """
+    Watches a directory tree with inotify and records its changes in a journal.
+
+    Args:
+        directory (str): The directory to watch.
+        journal (ChangeJournal, optional): The journal to record changes in.
+
+    Raises:
+        OSError: If inotify is unavailable on this platform.
+    """
+
+    def __init__(self, directory, journal=None):
+        self.directory = directory
+        self.journal = journal if journal is not None else ChangeJournal()
+        self.inotify = inotify.Inotify()
+        self._dirs = {}  # watch descriptor -> (path, rel_path, ignore matcher)
+        self._wds = {}  # rel_path -> watch descriptor
+        try:
+            self._add_tree(directory, '', IgnoreMatcher.from_directory(directory), record=False)
+        except BaseException:
+            self.close()
+            raise
+
+    def _add_tree(self, path, rel_path, matcher, record):
+        # The watch is added before the directory is listed, so no file created in between is missed.
+        stack = [(path, rel_path, matcher)]
+        while stack:
+            path, rel_path, matcher = stack.pop()
+            try:
+                wd = self.inotify.add_watch(path, WATCH_MASK)
+                with os.scandir(path) as it:
+                    entries = list(it)
+            except OSError as e:
+                print(f"Error watching {path}: {e}")
+                continue
+            if any(entry.name == IGNORE_FILE_NAME for entry in entries):
+                matcher = matcher.enter(path, rel_path)
+            self._dirs[wd] = (path, rel_path, matcher)
+            self._wds[rel_path] = wd
+            for entry in entries:
+                rel_child = os.path.join(rel_path, entry.name)
+                try:
+                    is_dir = entry.is_dir(follow_symlinks=False)
+                except OSError:
+                    continue
+                if matcher(rel_child, is_dir):
+                    continue
+                if is_dir:
+                    stack.append((entry.path, rel_child, matcher))
+                elif record:
+                    self._record_change(entry.path, rel_child)
+
+    def _remove_tree(self, rel_path):
+        prefix = rel_path + os.sep
+        for path in [path for path in self._wds if path == rel_path or path.startswith(prefix)]:
+            wd = self._wds.pop(path)
+            self._dirs.pop(wd, None)
+            self.inotify.rm_watch(wd)
+
+    def _record_change(self, path, rel_path):
+        try:
+            st = os.lstat(path)
+        except OSError:
+            # Already gone again; the deletion event follows.
+            return
+        self.journal.change(rel_path, st.st_size if stat.S_ISREG(st.st_mode) else 0)
+
+    def handle(self, event):
+        """Records a single inotify event in the journal."""
+        if event.mask & inotify.IN_Q_OVERFLOW:
+            self.journal.request_rescan()
+            return
+        if event.mask & inotify.IN_IGNORED:
+            # The kernel removed the watch because the directory is gone.
+            watched = self._dirs.pop(event.wd, None)
+            if watched is not None and self._wds.get(watched[1]) == event.wd:
+                del self._wds[watched[1]]
+            return
+        watched = self._dirs.get(event.wd)
+        if watched is None or not event.name:
+            return
+        path, rel_path, matcher = watched
+        child = os.path.join(path, event.name)
+        rel_child = os.path.join(rel_path, event.name)
+        is_dir = bool(event.mask & inotify.IN_ISDIR)
+        if event.name == IGNORE_FILE_NAME:
+            # Changed rules can include or exclude anything below; only a scan can tell.
+            self.journal.request_rescan()
+        if matcher(rel_child, is_dir):
+            return
+        if is_dir:
+            if event.mask & _REMOVED:
+                self._remove_tree(rel_child)
+                self.journal.delete_tree(rel_child)
+            elif event.mask & (inotify.IN_CREATE | inotify.IN_MOVED_TO):
+                self._add_tree(child, rel_child, matcher, record=True)
+        elif event.mask & _REMOVED:
+            self.journal.delete(rel_child)
+        else:
+            self._record_change(child, rel_child)
+
+    def poll(self, timeout=None):
+        """
+        Waits for changes and records them in the journal.
+
+        Args:
+            timeout (float, optional): The maximum number of seconds to wait.
+
+        Returns:
+            int: The number of events handled.
+        """
+        events = self.inotify.read_events(timeout)
+        for event in events:
+            self.handle(event)
+        return len(events)
+
+    def close(self):
+        """Removes all watches."""
+        self.inotify.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def apply_journal(directory, journal, files, use_hash=False):
+    """
+    Applies a journal to the manifest state of a tree.
+
+    Files whose size, modification time and inode are unchanged are not
+    archived again, and deletions are only recorded for paths that are gone.
+
+    Args:
+        directory (str): The watched directory.
+        journal (ChangeJournal): The changes since the state was recorded.
+        files (dict): The manifest state, mapping relative paths (with '/' separators) to
+            `[size, mtime_ns, inode, hash]` as returned by `load_manifest`. It is updated in place.
+        use_hash (bool, optional): Whether to record content hashes of the changed files.
+
+    Returns:
+        A tuple containing:
+            - The paths of the files to archive.
+            - The deleted relative paths.
+    """
+    to_archive = []
+    for rel_path in sorted(journal.changed):
+        path = os.path.join(directory, rel_path)
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        if not stat.S_ISREG(st.st_mode):
+            continue
+        key = rel_path.replace(os.sep, '/')
+        record = [st.st_size, st.st_mtime_ns, st.st_ino, None]
+        old = files.get(key)
+        if old is not None and old[:3] == record[:3]:
+            continue
+        if use_hash:
+            try:
+                record[3] = hash_file(path)
+            except OSError:
+                pass
+        files[key] = record
+        to_archive.append(path)
+
+    gone = {rel_path.replace(os.sep, '/') for rel_path in journal.deleted}
+    for rel_dir in journal.deleted_dirs:
+        prefix = rel_dir.replace(os.sep, '/') + '/'
+        gone.update(key for key in files if key.startswith(prefix))
+    deleted = []
+    for key in sorted(gone):
+        if key in files and not os.path.lexists(os.path.join(directory, key)):
+            del files[key]
+            deleted.append(key)
+    return to_archive, deleted
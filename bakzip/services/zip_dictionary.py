@@ -0,0 +1,219 @@
+#! /usr/env/bin python
+"""
+This module provides trained zstd dictionaries for ZIP archives of many small files.
+
+Every ZIP member is compressed on its own, so a small file only benefits
+from the redundancy inside itself. `train_dictionary` learns the strings the
+files share (headers, keys, boilerplate) from a sample of the scanned files;
+each member is then compressed against that dictionary and gets most of
+the ratio of a solid archive while staying a separate member.
+
+The dictionary is stored uncompressed as the first member of the archive,
+`DICTIONARY_NAME`, and `DictionaryZipReader` reads it back to decompress
+any single member with one seek. Other unzip tools list these archives but
+cannot decompress the zstd members, which need the dictionary.
+"""
+import os
+import stat
+import struct
+import zlib
+from bakzip.services.codecs import ZIP_ZSTD
+
+DICTIONARY_NAME = '.bakzip/zstd.dict'
+
+# zstd's default dictionary size; the samples should be about 100 times as large.
+DICTIONARY_SIZE = 110 * 1024
+SAMPLE_BYTES = 100 * DICTIONARY_SIZE
+# Only files up to this size are sampled: larger ones gain little from a dictionary.
+MAX_SAMPLE_FILE = 64 * 1024
+# zstd cannot train on fewer samples than this.
+MIN_SAMPLES = 8
+
+_LOCAL_HEADER = struct.Struct('<4sHHHHHIIIHH')
+_READ_SIZE = 1024 * 1024
+
+
+def sample_files(catalog, max_bytes=SAMPLE_BYTES, max_file=MAX_SAMPLE_FILE):
+    """
+    Reads the small regular files of a `FileCatalog`, spread evenly over the scan, as training samples.
+
+    Args:
+        catalog (FileCatalog): The scanned files.
+        max_bytes (int, optional): The total size of the samples.
+        max_file (int, optional): The size of the largest file sampled.
+
+    Returns:
+        A list of bytes, one per file that could be read.
+    """
+    indexes = []
+    total = 0
+    for index in range(len(catalog)):
+        st = catalog.stat(index)
+        if st is not None and stat.S_ISREG(st.st_mode) and 0 < st.st_size <= max_file:
+            indexes.append(index)
+            total += st.st_size
+    # Every step-th file, so the samples come from the whole tree.
+    step = max(1, -(-total // max_bytes))
+    samples = []
+    size = 0
+    for index in indexes[::step]:
+        if size >= max_bytes:
+            break
+        try:
+            with open(catalog.path(index), 'rb') as f:
+                data = f.read(max_file)
+        except OSError:
+            continue
+        samples.append(data)
+        size += len(data)
+    return samples
+
+
+def train_dictionary(samples, size=DICTIONARY_SIZE, jobs=1):
+    """
+    Trains a zstd dictionary from sample data.
+
+    Args:
+        samples (list): The sample data, e.g. from `sample_files`.
+        size (int, optional): The maximum size of the dictionary in bytes. It is reduced
+            to a tenth of the sample data, as a larger dictionary only adds overhead.
+        jobs (int, optional): The threads searching the training parameters (0 for one per CPU core).
+
+    Returns:
+        zstandard.ZstdCompressionDict: The dictionary, or None if there are too few samples
+        to train one.
+
+    Raises:
+        ImportError: If the zstandard package is not installed.
+    """
+    import zstandard
+    if len(samples) < MIN_SAMPLES:
+        return None
+    size = min(size, sum(len(sample) for sample in samples) // 10)
+    if size < 1024:
+        return None
+    try:
+        return zstandard.train_dictionary(size, samples, threads=-1 if jobs == 0 else jobs)
+    except zstandard.ZstdError:
+        return None
+
+
+def load_dictionary(data):
+    """Returns the zstd dictionary of the bytes stored in `DICTIONARY_NAME`."""
+    import zstandard
+    return zstandard.ZstdCompressionDict(data)
+
+
+def compressobj(dictionary, level):
+    """Returns a raw compressor for a ZIP member compressed with a dictionary."""
+    import zstandard
+    return zstandard.ZstdCompressor(level=level, dict_data=dictionary).compressobj()
+
+
+class DictionaryZipReader:
+    """
+    Reads the members of a ZIP archive whose zstd members use a stored dictionary.
+
+    Members are looked up in the central directory, so reading one member
+    seeks straight to its payload. zstd members are decompressed with the
+    archive's dictionary (or without one, for plain zstd archives) and
+    other members are read by `zipfile`.
+
+    Args:
+        archive (str): The path of the ZIP archive.
+
+    Attributes:
+        dictionary (zstandard.ZstdCompressionDict): The archive's dictionary, or None.
+    """
+
+    def __init__(self, archive):
+        import zipfile
+        self.zip_file = zipfile.ZipFile(archive)
+        self.dictionary = None
+        if DICTIONARY_NAME in self.zip_file.NameToInfo:
+            self.dictionary = load_dictionary(self.zip_file.read(DICTIONARY_NAME))
+
+    def namelist(self):
+        """Returns the names of the archived members, without the dictionary."""
+        return [name for name in self.zip_file.namelist() if name != DICTIONARY_NAME]
+
+    def _payload(self, info):
+        # The local header's name and extra field may differ from the central directory's.
+        fp = self.zip_file.fp
+        fp.seek(info.header_offset)
+        header = _LOCAL_HEADER.unpack(fp.read(_LOCAL_HEADER.size))
+        fp.seek(info.header_offset + _LOCAL_HEADER.size + header[9] + header[10])
+        remaining = info.compress_size
+        while remaining > 0:
+            chunk = fp.read(min(_READ_SIZE, remaining))
+            if not chunk:
+                import zipfile
+                raise zipfile.BadZipFile(f"Truncated member {info.filename}")
+            remaining -= len(chunk)
+            yield chunk
+
+    def iter_member(self, name):
+        """
+        Decompresses one member.
+
+        Args:
+            name (str): The name of the member.
+
+        Yields:
+            The member's content, in blocks.
+
+        Raises:
+            KeyError: If there is no such member.
+            zipfile.BadZipFile: If the member is truncated or its CRC does not match.
+        """
+        info = self.zip_file.getinfo(name)
+        if info.compress_type != ZIP_ZSTD:
+            with self.zip_file.open(info) as member:
+                yield from iter(lambda: member.read(_READ_SIZE), b'')
+            return
+        import zstandard
+        decompressor = zstandard.ZstdDecompressor(dict_data=self.dictionary).decompressobj()
+        crc = 0
+        for chunk in self._payload(info):
+            block = decompressor.decompress(chunk)
+            crc = zlib.crc32(block, crc)
+            yield block
+        if crc != info.CRC:
+            import zipfile
+            raise zipfile.BadZipFile(f"Bad CRC-32 for member {name}")
+
+    def read(self, name):
+        """Returns the content of one member."""
+        return b''.join(self.iter_member(name))
+
+    def extract(self, name, target):
+        """
+        Decompresses one member to a path.
+
+        Args:
+            name (str): The name of the member.
+            target (str): The path to write, whose directory must exist. Directory members
+                (names ending with '/') are created as directories instead.
+        """
+        if name.endswith('/'):
+            os.makedirs(target, exist_ok=True)
+            return
+        with open(target, 'wb') as f:
+            for block in self.iter_member(name):
+                f.write(block)
+
+    def close(self):
+        self.zip_file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def needs_reader(archive):
+    """Returns whether a ZIP archive has zstd members, which need a `DictionaryZipReader`."""
+    import zipfile
+    with zipfile.ZipFile(archive) as zip_file:
+        return any(info.compress_type == ZIP_ZSTD for info in zip_file.infolist())
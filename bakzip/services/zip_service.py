@@ -3,48 +3,346 @@
 This module provides functions for creating ZIP archives.
 
 The `create_zip` function allows you to create a ZIP archive from a list of files,
-with optional compression using pyzipper.
+with optional compression using pyzipper. With `jobs` greater than one, or with
+a codec pyzipper cannot write (zstd), or with a checkpoint journal, duplicate
+detection or a trained dictionary, or when writing to a stream such as stdout,
+members are compressed in a worker pool and written by the low-level
+`zip_writer`, which never seeks.
 """
+import contextlib
 import os
-import pyzipper
-from tqdm import tqdm
+import shutil
+import stat
+import time
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from bakzip.services import prefetch, zip_dictionary, zip_writer
+from bakzip.services.codecs import CodecStats, resolve_compression
+from bakzip.services.compressibility import is_compressible
+from bakzip.services.dedup import Duplicate
+from bakzip.services.file_catalog import CatalogStat
+from bakzip.services.tree_walker import entry_arcname, split_entry
+from bakzip.utilities.progress import tqdm
 
-def create_zip(files, output, password=None, compression='normal', base_dir=None):
+# The methods pyzipper's AESZipFile can write itself.
+_PYZIPPER_METHODS = (zip_writer.ZIP_STORED, zip_writer.ZIP_DEFLATED, zip_writer.ZIP_BZIP2, zip_writer.ZIP_LZMA)
+
+# A large member of a streamed archive, compressed by the writer when its turn comes.
+_Streamed = namedtuple('_Streamed', ['data'])
+
+def _iter_arcnames(files, base_dir, skip=frozenset()):
+    for item in files:
+        file, st = split_entry(item)
+        arcname = entry_arcname(item, base_dir)
+        if ".." in arcname or os.path.isabs(arcname):
+            print(f"Security Warning: Skipping {file} due to potential path traversal (arcname: {arcname})")
+            continue
+        if skip and arcname.replace(os.sep, '/') in skip:
+            continue  # Already in the archive being resumed.
+        if st is not None and stat.S_ISLNK(st.st_mode):
+            st = None  # The member holds the target's content, so the target is stat'ed.
+        yield file, arcname, st
+
+def _is_compressible(file, data, st):
+    if data is None:
+        return is_compressible(file, st.st_size if st is not None else None)
+    return is_compressible(file, len(data), data)
+
+def _member_method(file, method, level, adaptive, data, st):
+    if adaptive and not _is_compressible(file, data, st):
+        return zip_writer.ZIP_STORED, None
+    return method, level
+
+def _compress(file, arcname, method, level, password, adaptive, data, st, dictionary=None):
+    method, level = _member_method(file, method, level, adaptive, data, st)
+    return zip_writer.compress_member(file, arcname, method, level, password, data, st, dictionary)
+
+def _dictionary_member(dictionary):
+    data = dictionary.as_bytes()
+    now = time.time_ns()
+    st = CatalogStat(stat.S_IFREG | 0o644, 0, 0, 1, 0, 0, len(data), now, 0)
+    return zip_writer.compress_member(None, zip_dictionary.DICTIONARY_NAME, zip_writer.ZIP_STORED, data=data, st=st)
+
+def _resumed_dictionary(out, entries):
+    # The members already written use the dictionary of the archive, if it has one.
+    name = zip_dictionary.DICTIONARY_NAME.encode()
+    for entry in entries:
+        if entry.name == name:
+            return zip_dictionary.load_dictionary(zip_writer.read_payload(out, entry))
+    return None
+
+def _open_archive(output, mode):
+    # A stream is written in place and left open for the caller.
+    if hasattr(output, 'write'):
+        return contextlib.nullcontext(output)
+    return open(output, mode)
+
+def _zipinfo(zip_file, arcname, st, compress_type):
+    # Like ZipInfo.from_file, but from the scan's stat result instead of another os.stat.
+    zinfo = zip_file.zipinfo_cls(arcname, zip_writer.dos_date_time(st.st_mtime))
+    zinfo.external_attr = (st.st_mode & 0xFFFF) << 16
+    zinfo.file_size = st.st_size
+    zinfo.compress_type = compress_type
+    # ZipFile.write sets the level the same way.
+    zinfo._compresslevel = zip_file.compresslevel
+    return zinfo
+
+def _write_member(zip_file, file, arcname, st, data, compress_type):
+    if st is None:
+        if data is None:
+            zip_file.write(file, arcname, compress_type=compress_type)
+        else:
+            zinfo = zip_file.zipinfo_cls.from_file(file, arcname)
+            zip_file.writestr(zinfo, data, compress_type=compress_type, compresslevel=zip_file.compresslevel)
+        return
+    zinfo = _zipinfo(zip_file, arcname, st, compress_type)
+    if data is not None:
+        zip_file.writestr(zinfo, data)
+        return
+    with open(file, 'rb') as src, zip_file.open(zinfo, 'w') as dest:
+        shutil.copyfileobj(src, dest, zip_writer.READ_SIZE)
+
+def _record_member(metrics, file, member, write_elapsed):
+    metrics.add_time('read', member.read_elapsed)
+    metrics.add_time('compress', member.elapsed)
+    if member.encrypt_elapsed:
+        metrics.add_time('encrypt', member.encrypt_elapsed)
+    metrics.add_time('write', write_elapsed)
+    metrics.record_file(file, member.read_elapsed + member.elapsed + member.encrypt_elapsed,
+                        member.file_size, member.compress_size)
+
+def _read_ahead(files, base_dir, read_ahead, metrics, read_order, skip=frozenset()):
+    return prefetch.read_ahead(_iter_arcnames(files, base_dir, skip), key=lambda item: item[0],
+                               max_bytes=read_ahead, metrics=metrics, order=read_order,
+                               stat_of=lambda item: item[2])
+
+def _create_zip_parallel(files, output, password, method, level, base_dir, jobs, adaptive, stats, metrics,
+                         read_ahead, read_order, checkpoint=None, dedup=None, tuner=None, dictionary=None):
+    """
+    Compresses members in a thread pool and writes them sequentially.
+
+    At most `2 * jobs` members are in flight, so memory stays bounded and
+    members are written in the same order as `files`. With a checkpoint,
+    the written members are committed to its journal periodically and when
+    the run fails, and a resumed checkpoint continues its partial archive.
+    Duplicates found by `dedup` get a copy of their original's payload,
+    read back from the archive, instead of being compressed. When `output`
+    is a stream, members too large to spool in memory are compressed
+    straight into it by the writer thread. With a tuner, each member is
+    compressed with its current choice and reported back to it. A dictionary
+    is written as the first member and every member is compressed with it;
+    a resumed archive keeps the dictionary it was started with.
+    """
+    password = password.encode() if password else None
+    resumed = checkpoint is not None and checkpoint.resumed
+    streaming = hasattr(output, 'write')
+    # Copying payloads reads the archive back.
+    with _open_archive(output, 'r+b' if resumed else 'w+b' if dedup is not None else 'wb') as out:
+        offset, entries, skip = 0, (), frozenset()
+        if resumed:
+            # Drop the members written after the last commit and append from there.
+            offset = checkpoint.offset
+            entries = [zip_writer.decode_entry(record) for record in checkpoint.members]
+            if dictionary is not None and entries:
+                dictionary = _resumed_dictionary(out, entries)
+            out.truncate(offset)
+            out.seek(offset)
+            skip = checkpoint.committed
+        with zip_writer.ZipStreamWriter(out, offset, entries) as writer, \
+                ThreadPoolExecutor(max_workers=jobs) as pool:
+            pending = deque()
+            if dictionary is not None and not entries:
+                entry = writer.add_member(_dictionary_member(dictionary))
+                if checkpoint is not None:
+                    checkpoint.add(zip_dictionary.DICTIONARY_NAME, zip_writer.encode_entry(entry))
+            safe_offset = writer.offset
+            written = {}
+
+            def drain(limit):
+                nonlocal safe_offset
+                while len(pending) > limit:
+                    file, name, st, task = pending.popleft()
+                    try:
+                        if isinstance(task, _Streamed):
+                            started = time.perf_counter()
+                            entry, member = writer.add_streamed(
+                                file, name, *_member_method(file, method, level, adaptive, task.data, st),
+                                password, task.data, st, dictionary)
+                            stats.add(member.file_size, member.compress_size, member.elapsed)
+                            if tuner is not None:
+                                tuner.record(member.file_size, member.elapsed)
+                            if metrics is not None:
+                                elapsed = time.perf_counter() - started
+                                _record_member(metrics, file, member, elapsed - member.read_elapsed -
+                                               member.elapsed - member.encrypt_elapsed)
+                        elif isinstance(task, Duplicate) and task.target in written:
+                            started = time.perf_counter()
+                            entry = writer.copy_member(written[task.target], name,
+                                                       zip_writer.dos_date_time(st.st_mtime),
+                                                       (st.st_mode & 0xFFFF) << 16)
+                            if metrics is not None:
+                                elapsed = time.perf_counter() - started
+                                metrics.add_time('write', elapsed)
+                                metrics.record_file(file, elapsed, entry.file_size, entry.compress_size)
+                        else:
+                            if isinstance(task, Duplicate):
+                                # The original could not be written, so the file is compressed after all.
+                                task = pool.submit(_compress, file, name, method, level, password, adaptive,
+                                                   None, st, dictionary)
+                            member = task.result()
+                            started = time.perf_counter()
+                            entry = writer.add_member(member)
+                            stats.add(member.file_size, member.compress_size, member.elapsed)
+                            if tuner is not None:
+                                tuner.record(member.file_size, member.elapsed)
+                            if metrics is not None:
+                                _record_member(metrics, file, member, time.perf_counter() - started)
+                    except OSError as e:
+                        print(f"Error adding {file} to zip file: {e}")
+                        if dedup is not None:
+                            dedup.discard(name)
+                        continue
+                    if dedup is not None:
+                        written[name] = entry
+                    safe_offset = writer.offset
+                    if checkpoint is not None:
+                        checkpoint.add(name, zip_writer.encode_entry(entry))
+                        if checkpoint.due():
+                            checkpoint.commit(out, safe_offset)
+
+            try:
+                items = _read_ahead(files, base_dir, read_ahead, metrics, read_order, skip)
+                for (file, arcname, st), data in tqdm(items, desc="Zipping files", unit="file"):
+                    name = arcname.replace(os.sep, '/')
+                    if tuner is not None:
+                        method, level = tuner.choice.codec.zip_method, tuner.choice.level
+                    task = dedup.match(file, name, st, data) if dedup is not None else None
+                    if task is None and streaming and st is not None and st.st_size > zip_writer.STREAM_MIN_SIZE:
+                        task = _Streamed(data)
+                    if task is None:
+                        task = pool.submit(_compress, file, name, method, level, password, adaptive, data, st,
+                                           dictionary)
+                    pending.append((file, name, st, task))
+                    drain(2 * jobs)
+                drain(0)
+            except BaseException:
+                if checkpoint is not None:
+                    # Everything up to the last complete member can be kept.
+                    checkpoint.commit(out, safe_offset)
+                raise
+
+def create_zip(files, output, password=None, compression='normal', base_dir=None, jobs=1, adaptive=False,
+               level=None, metrics=None, read_ahead=prefetch.DEFAULT_READ_AHEAD, read_order=None, checkpoint=None,
+               dedup=None, tuner=None, dictionary=None):
     """
     Creates a ZIP archive from a list of files.
 
     Args:
-        files (list): A list of file paths to include in the archive.
-        output (str): The path to the output ZIP file.
+        files (iterable): The file paths or `FileEntry` records to include in the archive.
+            Any iterable works, including the lazy `iter_directory` scanner. The stat data
+            of `FileEntry` records is used to build the members, so files are not stat'ed again.
+        output (str or file object): The path to the output ZIP file, or a writable binary
+            stream such as stdout or a pipe, which is written sequentially and left open.
         password (str, optional): The password to encrypt the archive. Defaults to None.
-        compression (str, optional): The compression level to use. Defaults to 'normal'.
-            Supported values: 'fast', 'normal', 'maximum'.
+        compression (str, optional): The compression preset or codec. Defaults to 'normal'.
+            Supported values: 'fast' (deflate level 1), 'normal' (deflate), 'maximum' (bzip2),
+            or a codec name: 'store', 'deflate', 'bzip2', 'xz', 'zstd'.
         base_dir (str, optional): The base directory for relative paths in the archive.
-            Defaults to the directory of the first file if not provided.
+            Defaults to the directory of the first file if not provided, which
+            requires materialising `files`.
+        jobs (int, optional): The number of worker threads compressing members.
+            Defaults to 1 (sequential). Use 0 for one worker per CPU core.
+        adaptive (bool, optional): Whether to store files that look already compressed
+            (media, archives, encrypted data) with ZIP_STORED instead of recompressing them.
+        level (int, optional): The codec level, overriding the level of the preset.
+        metrics (Metrics, optional): Receives per-file timings and sizes. The worker pool
+            path reports separate 'read', 'compress', 'encrypt' and 'write' phases; the
+            pyzipper path reports them combined as the 'zip' phase.
+        read_ahead (int, optional): The number of bytes of upcoming files read in the
+            background while the current one is compressed (see `prefetch`). Defaults
+            to 64 MiB; 0 reads each file only when it is compressed.
+        read_order (str, optional): Issue read-ahead reads sorted by 'inode' or physical
+            'extent' (see `read_order`). The member order in the archive is unchanged.
+        checkpoint (Checkpoint, optional): Commits the written members to a checkpoint
+            journal (see `checkpoint`). If it was resumed, the partial archive is truncated
+            to its last commit and the committed files are skipped.
+        dedup (Deduplicator, optional): Finds hardlinks and files identical to an earlier
+            member (see `dedup`); their members copy the earlier member's compressed payload
+            instead of reading and compressing the file again.
+        tuner (AutoTuner, optional): Picks the codec and level of each member (see `auto_tune`),
+            replacing `compression` and `level`, and is told how fast members compressed.
+        dictionary (zstandard.ZstdCompressionDict, optional): A trained dictionary (see
+            `zip_dictionary`), stored as the first member and used to compress every zstd member.
+
+    Returns:
+        CodecStats: The bytes and time spent in the codec.
+
+    Raises:
+        ValueError: If the codec is unknown, unavailable, not supported by ZIP or the level is invalid,
+            or a checkpoint or `dedup` is given with a stream output, or a dictionary is given
+            with another codec than zstd or with a password, or a password is given with a codec
+            pyzipper cannot read back (zstd).
     """
-    compression_level = {
-        'fast': pyzipper.ZIP_LZMA,
-        'normal': pyzipper.ZIP_DEFLATED,
-        'maximum': pyzipper.ZIP_BZIP2
-    }.get(compression, pyzipper.ZIP_DEFLATED)
+    if tuner is not None:
+        codec, level = tuner.choice.codec, tuner.choice.level
+    else:
+        codec, level = resolve_compression(compression, 'zip', level)
+    if codec.zip_method is None:
+        raise ValueError(f"The {codec.name} codec is not supported in ZIP archives")
+    streaming = hasattr(output, 'write')
+    if streaming and (checkpoint is not None or dedup is not None):
+        raise ValueError("Checkpoints and duplicate detection need a ZIP archive file, not a stream")
+    if dictionary is not None and (codec.name != 'zstd' or password):
+        raise ValueError("A compression dictionary needs the zstd codec and no password")
+    if password and codec.zip_method not in _PYZIPPER_METHODS:
+        # Encrypted members are restored by pyzipper, which cannot decompress other methods.
+        raise ValueError(f"Password-protected ZIP archives cannot use the {codec.name} codec; use --format tar")
+    stats = CodecStats(codec, level)
+    started = time.perf_counter()
+
+    if base_dir is None:
+        # A `FileCatalog` knows its root; anything else is read to find it.
+        base_dir = getattr(files, 'root', None)
+    if base_dir is None:
+        files = list(files)
+        if files:
+            base_dir = os.path.dirname(split_entry(files[0])[0])
 
-    if base_dir is None and files:
-        base_dir = os.path.dirname(files[0])
+    if jobs == 0:
+        jobs = os.cpu_count() or 1
+    # pyzipper seeks back to patch each local header, which streams do not support.
+    if jobs > 1 or codec.zip_method not in _PYZIPPER_METHODS or checkpoint is not None or dedup is not None \
+            or streaming or tuner is not None or dictionary is not None:
+        _create_zip_parallel(files, output, password, codec.zip_method, level, base_dir, jobs, adaptive, stats,
+                             metrics, read_ahead, read_order, checkpoint, dedup, tuner, dictionary)
+        stats.wall_seconds = time.perf_counter() - started
+        return stats
 
-    with pyzipper.AESZipFile(output, 'w', compression=compression_level) as zip_file:
+    import pyzipper
+    with pyzipper.AESZipFile(output, 'w', compression=codec.zip_method, compresslevel=level) as zip_file:
         if password:
             zip_file.setpassword(password.encode())
             zip_file.setencryption(pyzipper.WZ_AES)
 
-        for file in tqdm(files, desc="Zipping files", unit="file"):
-            arcname = os.path.relpath(file, base_dir)
-            if ".." in arcname or os.path.isabs(arcname):
-                print(f"Security Warning: Skipping {file} due to potential path traversal (arcname: {arcname})")
-                continue
+        items = _read_ahead(files, base_dir, read_ahead, metrics, read_order)
+        for (file, arcname, st), data in tqdm(items, desc="Zipping files", unit="file"):
             try:
-                zip_file.write(file, arcname)
+                member_started = time.perf_counter()
+                compress_type = zip_file.compression
+                if adaptive and not _is_compressible(file, data, st):
+                    compress_type = pyzipper.ZIP_STORED
+                _write_member(zip_file, file, arcname, st, data, compress_type)
+                # pyzipper compresses while writing, so this includes the read time.
+                info = zip_file.filelist[-1]
+                member_elapsed = time.perf_counter() - member_started
+                stats.add(info.file_size, info.compress_size, member_elapsed)
+                if metrics is not None:
+                    metrics.add_time('zip', member_elapsed)
+                    metrics.record_file(file, member_elapsed, info.file_size, info.compress_size)
             except OSError as e:
                 print(f"Error adding {file} to zip file: {e}")
+    stats.wall_seconds = time.perf_counter() - started
+    return stats
 
 if __name__ == "__main__":
     create_zip(["test.txt"], "test.zip", "password", "normal")
@@ -0,0 +1,509 @@
+#! /usr/env/bin python
+"""
+This module provides a low-level ZIP writer for pre-compressed members.
+
+The `compress_member` function compresses (and optionally AES-encrypts) a
+single file into a self-contained payload, which allows the expensive work
+to run in a worker pool. `ZipStreamWriter` then writes those payloads
+sequentially with correct local headers, central directory and ZIP64
+records, so the result opens in stock unzip and 7-Zip. The writer never
+seeks, so archives can be written to pipes and stdout; large members of
+such archives are compressed straight into the stream by `add_streamed`,
+with their CRC and sizes in a data descriptor, instead of being spooled.
+"""
+import os
+import stat
+import struct
+import tempfile
+import time
+import zlib
+from collections import namedtuple
+from bakzip.services import zip_dictionary
+from bakzip.services.codecs import ZIP_STORED, ZIP_DEFLATED, ZIP_BZIP2, ZIP_LZMA, ZIP_ZSTD, codec_for_zip_method
+
+WZ_AES_COMPRESS_TYPE = 99
+
+ZIP64_LIMIT = 0xFFFFFFFF
+ZIP_FILECOUNT_LIMIT = 0xFFFF
+
+# Payloads larger than this are spooled to a temporary file instead of memory.
+SPOOL_MAX_SIZE = 8 * 1024 * 1024
+READ_SIZE = 1024 * 1024
+# Files larger than this may not fit a spooled payload in memory, so archives that
+# cannot hold a temporary file (pipes) compress them with `add_streamed`.
+STREAM_MIN_SIZE = SPOOL_MAX_SIZE // 2
+
+_VERSION_NEEDED = {
+    ZIP_STORED: 20,
+    ZIP_DEFLATED: 20,
+    ZIP_BZIP2: 46,
+    ZIP_LZMA: 63,
+    ZIP_ZSTD: 63,
+}
+
+_LOCAL_HEADER = struct.Struct('<4sHHHHHIIIHH')
+_DATA_DESCRIPTOR = struct.Struct('<4sIII')
+_DATA_DESCRIPTOR64 = struct.Struct('<4sIQQ')
+_CENTRAL_HEADER = struct.Struct('<4sHHHHHHIIIHHHHHII')
+_END_RECORD = struct.Struct('<4sHHHHIIH')
+_END_RECORD64 = struct.Struct('<4sQHHIIQQQQ')
+_END_LOCATOR64 = struct.Struct('<4sIQI')
+
+CompressedMember = namedtuple(
+    'CompressedMember',
+    ['arcname', 'payload', 'crc', 'file_size', 'compress_size', 'method',
+     'date_time', 'external_attr', 'flags', 'extra', 'version',
+     'elapsed', 'read_elapsed', 'encrypt_elapsed'],
+    defaults=[0.0, 0.0, 0.0],
+)
+
+CentralEntry = namedtuple(
+    'CentralEntry',
+    ['name', 'version', 'flags', 'method', 'dos_time', 'dos_date', 'crc', 'file_size', 'compress_size',
+     'extra', 'external_attr', 'header_offset'],
+)
+CentralEntry.__doc__ = """The central directory fields of a member written by `ZipStreamWriter`."""
+
+
+def encode_entry(entry):
+    """Returns a central directory entry as a JSON-serialisable list, for checkpoint journals."""
+    return [entry.name.hex(), *entry[1:9], entry.extra.hex(), *entry[10:]]
+
+
+def decode_entry(record):
+    """Returns the central directory entry of a list made by `encode_entry`."""
+    return CentralEntry(bytes.fromhex(record[0]), *record[1:9], bytes.fromhex(record[9]), *record[10:])
+
+
+def _get_compressor(method, level=None, dictionary=None):
+    if method == ZIP_STORED:
+        return None
+    codec = codec_for_zip_method(method)
+    if dictionary is not None and method == ZIP_ZSTD:
+        return zip_dictionary.compressobj(dictionary, codec.check_level(level))
+    return codec.compressobj(level)
+
+
+def dos_date_time(mtime):
+    """Returns the ZIP date_time tuple of a modification time, clamped to the range ZIP can store."""
+    date_time = time.localtime(mtime)[:6]
+    if date_time[0] < 1980:
+        date_time = (1980, 1, 1, 0, 0, 0)
+    return date_time
+
+
+def _aes_extra(method):
+    # WinZip AE-2 extra field: version, vendor id, AES-256 strength, real method.
+    return struct.pack('<HHH2sBH', 0x9901, 7, 2, b'AE', 3, method)
+
+
+def _iter_chunks(path, data):
+    if data is not None:
+        view = memoryview(data)
+        for start in range(0, len(view), READ_SIZE):
+            yield view[start:start + READ_SIZE]
+        return
+    with open(path, 'rb') as src:
+        while True:
+            chunk = src.read(READ_SIZE)
+            if not chunk:
+                break
+            yield chunk
+
+
+def _compress_into(write, path, data, method, level, encrypter, dictionary=None):
+    """
+    Compresses (and encrypts) a file into `write`.
+
+    Returns:
+        A tuple of the CRC, the file size and the compress, read and encrypt times.
+    """
+    compressor = _get_compressor(method, level, dictionary)
+    crc = 0
+    file_size = 0
+    elapsed = read_elapsed = encrypt_elapsed = 0.0
+
+    def emit(block):
+        nonlocal encrypt_elapsed
+        if block and encrypter:
+            started = time.perf_counter()
+            block = encrypter.encrypt(block)
+            encrypt_elapsed += time.perf_counter() - started
+        if block:
+            write(block)
+
+    chunks = _iter_chunks(path, data)
+    try:
+        if encrypter:
+            write(encrypter.encryption_header())
+        while True:
+            started = time.perf_counter()
+            chunk = next(chunks, None)
+            read_elapsed += time.perf_counter() - started
+            if chunk is None:
+                break
+            crc = zlib.crc32(chunk, crc)
+            file_size += len(chunk)
+            if compressor:
+                started = time.perf_counter()
+                chunk = compressor.compress(chunk)
+                elapsed += time.perf_counter() - started
+            emit(chunk)
+        if compressor:
+            started = time.perf_counter()
+            chunk = compressor.flush()
+            elapsed += time.perf_counter() - started
+            emit(chunk)
+        if encrypter:
+            write(encrypter.flush())
+    finally:
+        chunks.close()
+    return crc, file_size, elapsed, read_elapsed, encrypt_elapsed
+
+
+def _encrypter(password):
+    if not password:
+        return None
+    import pyzipper
+    return pyzipper.zipfile_aes.AESZipEncrypter(password)
+
+
+def _header_fields(arcname, method, encrypted):
+    # The flags, extra field, version needed and method of a member's headers.
+    flags = 0x800 if not arcname.isascii() else 0
+    extra = b''
+    version = _VERSION_NEEDED[method]
+    if encrypted:
+        flags |= 0x1
+        version = max(version, 51)
+        extra = _aes_extra(method)
+        method = WZ_AES_COMPRESS_TYPE
+    return flags, extra, version, method
+
+
+def compress_member(path, arcname, method=ZIP_DEFLATED, level=None, password=None, data=None, st=None,
+                    dictionary=None):
+    """
+    Reads and compresses a single file into a ZIP member payload.
+
+    This function is safe to call from worker threads; zlib, bz2, lzma and
+    zstandard release the GIL while compressing. The time spent inside the
+    compressor is returned as `elapsed`, and the time spent reading and
+    encrypting as `read_elapsed` and `encrypt_elapsed`, for metrics.
+
+    Args:
+        path (str): The path of the file to compress.
+        arcname (str): The name of the member inside the archive.
+        method (int, optional): The ZIP compression method, any method of a registered
+            codec (see `codecs`). Defaults to ZIP_DEFLATED.
+        level (int, optional): The compression level, or None for the codec default.
+        password (bytes, optional): If set, the payload is WinZip AES-256 encrypted.
+        data (bytes, optional): The content of the file if it was already read (see `prefetch`).
+        st (os.stat_result, optional): The stat result of the file if it is known from the
+            scan. Symlinks are stat'ed again, as the member holds the target's content.
+        dictionary (zstandard.ZstdCompressionDict, optional): The dictionary zstd members are
+            compressed with (see `zip_dictionary`).
+
+    Returns:
+        CompressedMember: The compressed payload and its header fields.
+    """
+    if st is None or stat.S_ISLNK(st.st_mode):
+        st = os.stat(path)
+    encrypter = _encrypter(password)
+    payload = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+    try:
+        crc, file_size, elapsed, read_elapsed, encrypt_elapsed = _compress_into(
+            payload.write, path, data, method, level, encrypter, dictionary)
+    except BaseException:
+        payload.close()
+        raise
+
+    compress_size = payload.tell()
+    payload.seek(0)
+    flags, extra, version, method = _header_fields(arcname, method, encrypter is not None)
+    if encrypter:
+        # AE-2 members do not store the CRC, the HMAC authenticates the data.
+        crc = 0
+    return CompressedMember(
+        arcname=arcname,
+        payload=payload,
+        crc=crc,
+        file_size=file_size,
+        compress_size=compress_size,
+        method=method,
+        date_time=dos_date_time(st.st_mtime),
+        external_attr=(st.st_mode & 0xFFFF) << 16,
+        flags=flags,
+        extra=extra,
+        version=version,
+        elapsed=elapsed,
+        read_elapsed=read_elapsed,
+        encrypt_elapsed=encrypt_elapsed,
+    )
+
+
+def _payload_offset(entry):
+    # The local header of a member written by `ZipStreamWriter.add_member` has the same extra field
+    # as the central directory, after the ZIP64 extra field `add_member` may put in front.
+    local_extra = len(entry.extra)
+    if entry.file_size >= ZIP64_LIMIT or entry.compress_size >= ZIP64_LIMIT:
+        local_extra += 20
+    return entry.header_offset + _LOCAL_HEADER.size + len(entry.name) + local_extra
+
+
+def read_payload(fileobj, entry):
+    """
+    Reads the payload of a member written by `ZipStreamWriter.add_member` back from the archive.
+
+    Args:
+        fileobj: The readable, seekable archive, with archive offsets equal to file positions.
+        entry (CentralEntry): The entry of the member.
+
+    Returns:
+        bytes: The member's stored (compressed and encrypted) data.
+    """
+    fileobj.seek(_payload_offset(entry))
+    return fileobj.read(entry.compress_size)
+
+
+class _ArchiveRegion:
+    """Reads a region of the archive being written, keeping the file position at the end."""
+
+    def __init__(self, fileobj, offset, size):
+        self.fileobj = fileobj
+        self.offset = offset
+        self.remaining = size
+
+    def read(self, size):
+        size = min(size, self.remaining)
+        if size <= 0:
+            return b''
+        end = self.fileobj.tell()
+        self.fileobj.seek(self.offset)
+        data = self.fileobj.read(size)
+        self.fileobj.seek(end)
+        self.offset += len(data)
+        self.remaining -= len(data)
+        return data
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        pass
+
+
+class ZipStreamWriter:
+    """
+    Writes pre-compressed members into a ZIP archive.
+
+    Members are appended strictly sequentially and the central directory is
+    written on `close`, so the underlying file object never needs to seek.
+
+    Args:
+        fileobj: The binary file object receiving the archive.
+        offset (int, optional): The archive offset of `fileobj`'s position, when
+            continuing a partial archive. Defaults to 0.
+        entries (iterable, optional): The `CentralEntry` records of the members before `offset`.
+    """
+
+    def __init__(self, fileobj, offset=0, entries=()):
+        self.fileobj = fileobj
+        self.offset = offset
+        self._central = list(entries)
+
+    def _write(self, data):
+        self.fileobj.write(data)
+        self.offset += len(data)
+
+    def add_member(self, member):
+        """
+        Appends a compressed member and closes its payload.
+
+        Args:
+            member (CompressedMember): The member returned by `compress_member`.
+
+        Returns:
+            CentralEntry: The central directory fields of the member.
+        """
+        name = member.arcname.encode('utf-8' if member.flags & 0x800 else 'ascii')
+        dos_date = (member.date_time[0] - 1980) << 9 | member.date_time[1] << 5 | member.date_time[2]
+        dos_time = member.date_time[3] << 11 | member.date_time[4] << 5 | member.date_time[5] // 2
+        version = member.version
+        zip64 = member.file_size >= ZIP64_LIMIT or member.compress_size >= ZIP64_LIMIT
+        extra = member.extra
+        file_size, compress_size = member.file_size, member.compress_size
+        if zip64:
+            version = max(version, 45)
+            extra = struct.pack('<HHQQ', 1, 16, file_size, compress_size) + extra
+            file_size = compress_size = ZIP64_LIMIT
+
+        header_offset = self.offset
+        self._write(_LOCAL_HEADER.pack(
+            b'PK\x03\x04', version, member.flags, member.method, dos_time, dos_date,
+            member.crc, compress_size, file_size, len(name), len(extra),
+        ) + name + extra)
+        with member.payload:
+            while True:
+                chunk = member.payload.read(READ_SIZE)
+                if not chunk:
+                    break
+                self._write(chunk)
+
+        entry = CentralEntry(name, version, member.flags, member.method, dos_time, dos_date, member.crc,
+                             member.file_size, member.compress_size, member.extra, member.external_attr,
+                             header_offset)
+        self._central.append(entry)
+        return entry
+
+    def add_streamed(self, path, arcname, method=ZIP_DEFLATED, level=None, password=None, data=None, st=None,
+                     dictionary=None):
+        """
+        Compresses a file straight into the archive, without spooling its payload.
+
+        The local header is written first, with bit 3 set, and the CRC and sizes
+        follow the data in a data descriptor (with 8-byte sizes and a ZIP64 extra
+        field in the local header if the file may exceed 4 GiB). This keeps large
+        members of non-seekable archives off the disk, at the cost of compressing
+        them in the writing thread.
+
+        Args:
+            path (str): The path of the file to compress.
+            arcname (str): The name of the member inside the archive.
+            method (int, optional): The ZIP compression method. Defaults to ZIP_DEFLATED.
+            level (int, optional): The compression level, or None for the codec default.
+            password (bytes, optional): If set, the payload is WinZip AES-256 encrypted.
+            data (bytes, optional): The content of the file if it was already read.
+            st (os.stat_result, optional): The stat result of the file from the scan.
+            dictionary (zstandard.ZstdCompressionDict, optional): The dictionary zstd members
+                are compressed with.
+
+        Returns:
+            A tuple of the member's `CentralEntry` and a `CompressedMember` without a
+            payload, carrying its sizes and timings.
+
+        Raises:
+            ValueError: If the file grew past 4 GiB while it was compressed without ZIP64.
+        """
+        if st is None or stat.S_ISLNK(st.st_mode):
+            st = os.stat(path)
+        encrypter = _encrypter(password)
+        flags, extra, version, zip_method = _header_fields(arcname, method, encrypter is not None)
+        flags |= 0x08
+        date_time = dos_date_time(st.st_mtime)
+        name = arcname.encode('utf-8' if flags & 0x800 else 'ascii')
+        dos_date = (date_time[0] - 1980) << 9 | date_time[1] << 5 | date_time[2]
+        dos_time = date_time[3] << 11 | date_time[4] << 5 | date_time[5] // 2
+        # Like zipfile, leave room for a payload slightly larger than the file.
+        zip64 = st.st_size * 1.05 > ZIP64_LIMIT
+        local_extra = extra
+        sizes = 0
+        if zip64:
+            version = max(version, 45)
+            local_extra = struct.pack('<HHQQ', 1, 16, 0, 0) + extra
+            sizes = ZIP64_LIMIT
+
+        header_offset = self.offset
+        self._write(_LOCAL_HEADER.pack(
+            b'PK\x03\x04', version, flags, zip_method, dos_time, dos_date, 0, sizes, sizes,
+            len(name), len(local_extra),
+        ) + name + local_extra)
+        payload_offset = self.offset
+        crc, file_size, elapsed, read_elapsed, encrypt_elapsed = _compress_into(
+            self._write, path, data, method, level, encrypter, dictionary)
+        compress_size = self.offset - payload_offset
+        if encrypter:
+            crc = 0  # AE-2, as in `compress_member`.
+        if zip64:
+            self._write(_DATA_DESCRIPTOR64.pack(b'PK\x07\x08', crc, compress_size, file_size))
+        elif file_size >= ZIP64_LIMIT or compress_size >= ZIP64_LIMIT:
+            raise ValueError(f"{path} grew past 4 GiB while it was archived")
+        else:
+            self._write(_DATA_DESCRIPTOR.pack(b'PK\x07\x08', crc, compress_size, file_size))
+
+        entry = CentralEntry(name, version, flags, zip_method, dos_time, dos_date, crc, file_size, compress_size,
+                             extra, (st.st_mode & 0xFFFF) << 16, header_offset)
+        self._central.append(entry)
+        member = CompressedMember(arcname, None, crc, file_size, compress_size, zip_method, date_time,
+                                  entry.external_attr, flags, extra, version, elapsed, read_elapsed, encrypt_elapsed)
+        return entry, member
+
+    def copy_member(self, source, arcname, date_time, external_attr):
+        """
+        Appends a member with the same content as an earlier one, copying its payload.
+
+        The payload is read back from the file object, which must be readable and
+        seekable, with archive offsets equal to file positions (opened 'w+b' or 'r+b').
+
+        Args:
+            source (CentralEntry): The entry of the earlier member, as returned by `add_member`.
+            arcname (str): The name of the new member.
+            date_time (tuple): The modification time of the new member (see `dos_date_time`).
+            external_attr (int): The file attributes of the new member.
+
+        Returns:
+            CentralEntry: The central directory fields of the new member.
+        """
+        flags = source.flags & ~0x800 | (0 if arcname.isascii() else 0x800)
+        return self.add_member(CompressedMember(
+            arcname=arcname,
+            payload=_ArchiveRegion(self.fileobj, _payload_offset(source), source.compress_size),
+            crc=source.crc,
+            file_size=source.file_size,
+            compress_size=source.compress_size,
+            method=source.method,
+            date_time=date_time,
+            external_attr=external_attr,
+            flags=flags,
+            extra=source.extra,
+            version=source.version,
+        ))
+
+    def close(self):
+        """
+        Writes the central directory and end records.
+        """
+        start = self.offset
+        for entry in self._central:
+            zip64_fields = []
+            version, file_size, compress_size, header_offset = (entry.version, entry.file_size,
+                                                                entry.compress_size, entry.header_offset)
+            if file_size >= ZIP64_LIMIT:
+                zip64_fields.append(file_size)
+                file_size = ZIP64_LIMIT
+            if compress_size >= ZIP64_LIMIT:
+                zip64_fields.append(compress_size)
+                compress_size = ZIP64_LIMIT
+            if header_offset >= ZIP64_LIMIT:
+                zip64_fields.append(header_offset)
+                header_offset = ZIP64_LIMIT
+            extra = entry.extra
+            if zip64_fields:
+                version = max(version, 45)
+                extra = struct.pack(f'<HH{len(zip64_fields)}Q', 1, 8 * len(zip64_fields), *zip64_fields) + extra
+            self._write(_CENTRAL_HEADER.pack(
+                b'PK\x01\x02', (3 << 8) | version, version, entry.flags, entry.method,
+                entry.dos_time, entry.dos_date, entry.crc, compress_size, file_size,
+                len(entry.name), len(extra), 0, 0, 0, entry.external_attr, header_offset,
+            ) + entry.name + extra)
+
+        count = len(self._central)
+        size = self.offset - start
+        if count > ZIP_FILECOUNT_LIMIT or size >= ZIP64_LIMIT or start >= ZIP64_LIMIT:
+            end64_offset = self.offset
+            self._write(_END_RECORD64.pack(
+                b'PK\x06\x06', _END_RECORD64.size - 12, 45, 45, 0, 0, count, count, size, start,
+            ))
+            self._write(_END_LOCATOR64.pack(b'PK\x06\x07', 0, end64_offset, 1))
+            count = min(count, ZIP_FILECOUNT_LIMIT)
+            size = min(size, ZIP64_LIMIT)
+            start = min(start, ZIP64_LIMIT)
+        self._write(_END_RECORD.pack(b'PK\x05\x06', 0, 0, count, count, size, start, 0))
+        self.fileobj.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
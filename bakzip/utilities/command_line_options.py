@@ -1,12 +1,75 @@
 import argparse
 
-def parse_arguments():
+# The options a job of a --job-file may set; the others apply to the whole run.
+JOB_OPTIONS = ('directory', 'output', 'compression', 'target', 'level', 'encryption', 'format', 'jobs',
+               'read_ahead', 'read_order', 'adaptive', 'dedup', 'dictionary', 'incremental', 'manifest', 'hash', 'verbose')
+
+def build_parser():
     parser = argparse.ArgumentParser(description='BakZip - A CLI tool to backup directories, excluding specified files and folders.')
-    parser.add_argument('-d','--directory', type=str, help='The directory to be backed up', default='.')
+    parser.add_argument('command', nargs='?', choices=['backup', 'restore', 'watch'], help='backup (default), restore archives into --directory, or watch --directory and write delta archives as it changes', default='backup')
+    parser.add_argument('archives', nargs='*', help='For restore: a full backup followed by its incremental backups, in order')
+    parser.add_argument('-d','--directory', type=str, help='The directory to be backed up (or restored into)', default='.')
     parser.add_argument('-o','--output', type=str, help='The name of the output backup file', default='default')
     parser.add_argument('-p','--password', action='store_true', help='Enable password protection. If set, you will be prompted for a password or it will be read from a project-appropriate environment variable.')
-    parser.add_argument('-c','--compression', type=str, choices=['fast', 'normal', 'maximum', 'gz'], help='The compression level', default='normal')
-    parser.add_argument('-e','--encryption', type=str, choices=['none', 'aes', 'rsa'], help='The encryption algorithm', default='none')
-    parser.add_argument('-f','--format', type=str, choices=['zip', 'tar', 'gz'], help='The backup format', default='zip')
+    parser.add_argument('-c','--compression', type=str, choices=['fast', 'normal', 'maximum', 'gz', 'store', 'deflate', 'bzip2', 'xz', 'zstd', 'lz4', 'auto'], help='The compression preset or codec (zstd needs the zstandard package, lz4 the lz4 package and is TAR only); auto trial-compresses a sample of the files and picks the codec and level meeting --target', default='normal')
+    parser.add_argument('--target', type=str, help='For --compression auto: the throughput to sustain (e.g. 200MB/s) or the time budget to get the best ratio within (e.g. 30m); default 100MB/s', default=None)
+    parser.add_argument('-l','--level', type=int, help='The codec compression level, overriding the level of the preset (e.g. 1-22 for zstd, 0-9 for xz)', default=None)
+    parser.add_argument('-e','--encryption', type=str, choices=['none', 'aes', 'rsa'], help='The encryption algorithm; aes needs --password (ZIP: WinZip AES per member, TAR: the whole archive in AES-256-GCM chunks)', default='none')
+    parser.add_argument('-f','--format', type=str, choices=['zip', 'tar', 'gz', 'repo'], help='The backup format (repo: deduplicating chunk repository at --output)', default='zip')
+    parser.add_argument('-j','--jobs', type=int, help='The number of parallel compression workers for ZIP members and gzip blocks (0 uses all CPU cores)', default=1)
+    parser.add_argument('--read-ahead', type=int, help='MiB of upcoming files read in the background while compressing (0 disables)', default=64)
+    parser.add_argument('--read-order', type=str, choices=['none', 'inode', 'extent'], help='Issue read-ahead reads sorted by inode number or physical extent (FIEMAP) to reduce seeking on HDDs; the archive order is unchanged', default='none')
+    parser.add_argument('-a','--adaptive', action='store_true', help='Store already-compressed content (media, archives, encrypted data) instead of recompressing it')
+    parser.add_argument('--dedup', action='store_true', help='Store hardlinks and files identical to an earlier file once (TAR hardlink members) or without compressing them again (ZIP)')
+    parser.add_argument('--dictionary', action='store_true', help='ZIP with --compression zstd: train a zstd dictionary on a sample of the small files, store it in the archive and compress every member with it (bakzip restore reads these archives, other unzip tools cannot)')
+    parser.add_argument('-i','--incremental', type=str, help='Archive only files changed since this previous backup (pass the full backup for a differential)', default=None)
+    parser.add_argument('-m','--manifest', action='store_true', help='Write a manifest next to the archive so later backups can be incremental')
+    parser.add_argument('--hash', action='store_true', help='Record content hashes in the manifest to ignore metadata-only changes')
+    parser.add_argument('--metrics-file', type=str, help='Write per-phase timings, throughput, the slowest files and peak memory to this file', default=None)
+    parser.add_argument('--metrics-format', type=str, choices=['json', 'prometheus'], help='The format of --metrics-file (prometheus: node_exporter textfile)', default='json')
+    parser.add_argument('--profile', type=str, help='Run the backup under cProfile and dump the stats to this file', default=None)
+    parser.add_argument('--ignore-report', type=str, nargs='?', const='du', choices=['scan', 'du'], help='Print the files, bytes and matching time attributed to each .bakzipignore pattern; du (the default) also sizes the pruned directories in a background thread, scan uses the scan data only', default=None)
+    parser.add_argument('--checkpoint-interval', type=int, help='Commit the files written so far to <archive>.journal every this many seconds, so an interrupted ZIP or TAR backup can be resumed (0 disables)', default=60)
+    parser.add_argument('--resume', action='store_true', help='Continue an interrupted backup from the last checkpoint of its journal instead of starting over')
+    parser.add_argument('--job-file', type=str, help='Run the backup jobs listed in this TOML, YAML or JSON file concurrently instead of backing up --directory', default=None)
+    parser.add_argument('--interval', type=int, help='Watch mode: write a delta archive this many seconds after the first pending change', default=300)
+    parser.add_argument('--delta-size', type=int, help='Watch mode: write a delta archive as soon as this many MiB of files changed', default=256)
+    parser.add_argument('-q','--quiet', action='store_true', help='Skip the banner and progress bars (also skipped when not writing to a terminal)')
     parser.add_argument('-v','--verbose', action='store_true', help='Enable verbose logging')
-    return parser.parse_args()
+    return parser
+
+def parse_arguments(argv=None):
+    return build_parser().parse_args(argv)
+
+def parse_job_options(options):
+    """
+    Parses the options of a job file entry like the equivalent command line.
+
+    Args:
+        options (dict): Option names from `JOB_OPTIONS` (with '_' or '-') mapped to their values.
+
+    Returns:
+        argparse.Namespace: The arguments of the job, with defaults for the options not given.
+
+    Raises:
+        ValueError: If an option is unknown or has an invalid value.
+    """
+    argv = ['backup']
+    for name, value in options.items():
+        dest = name.replace('-', '_')
+        if dest not in JOB_OPTIONS:
+            raise ValueError(f"Unknown job option: {name}")
+        flag = '--' + dest.replace('_', '-')
+        if isinstance(value, bool):
+            if value:
+                argv.append(flag)
+        elif value is not None:
+            argv.extend([flag, str(value)])
+    parser = build_parser()
+
+    def error(message):
+        raise ValueError(message)
+
+    # Report invalid values to the caller instead of printing the usage and exiting.
+    parser.error = error
+    return parser.parse_args(argv)
@@ -0,0 +1,203 @@
+"""
+This module provides the run metrics of a backup.
+
+A `Metrics` object collects monotonic per-phase timings (scan, ignore,
+read, compress, encrypt, write), bytes in and out, the slowest files and
+the peak memory of the process. Phases run concurrently (scanning overlaps
+compression, workers compress in parallel), so phase times are summed over
+threads and can add up to more than the wall time. The report is written
+as JSON or in the Prometheus textfile format.
+"""
+import contextlib
+import heapq
+import json
+import os
+import sys
+import threading
+import time
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+SLOWEST_FILES = 10
+
+
+def peak_rss_kb():
+    """Returns the peak resident set size of this process in KiB, or None if unknown."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS reports bytes, Linux and the BSDs KiB.
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+
+class Metrics:
+    """
+    Thread-safe counters and timers for one backup run.
+
+    Args:
+        slowest (int, optional): The number of slowest files to keep. Defaults to 10.
+    """
+
+    def __init__(self, slowest=SLOWEST_FILES):
+        self.phases = {}
+        self.files = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.slowest = slowest
+        self._slowest_files = []
+        self._lock = threading.Lock()
+        self._started = time.perf_counter()
+        self.wall_seconds = None
+
+    def add_time(self, phase, seconds, count=1):
+        """Adds `seconds` (and `count` calls) to a phase."""
+        with self._lock:
+            totals = self.phases.setdefault(phase, [0.0, 0])
+            totals[0] += seconds
+            totals[1] += count
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """Times the body of a `with` block as part of a phase."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - started)
+
+    def timed_iter(self, phase, iterable):
+        """Yields from `iterable`, timing how long each item takes to produce."""
+        iterator = iter(iterable)
+        while True:
+            started = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self.add_time(phase, time.perf_counter() - started, 0)
+                return
+            self.add_time(phase, time.perf_counter() - started)
+            yield item
+
+    def add_bytes(self, bytes_in, bytes_out):
+        """Adds bytes not attributed to a single file, such as a compressed stream's size."""
+        with self._lock:
+            self.bytes_in += bytes_in
+            self.bytes_out += bytes_out
+
+    def record_file(self, path, seconds, bytes_in, bytes_out):
+        """Counts an archived file and keeps it if it is among the slowest."""
+        with self._lock:
+            self.files += 1
+            self.bytes_in += bytes_in
+            self.bytes_out += bytes_out
+            item = (seconds, path, bytes_in)
+            if len(self._slowest_files) < self.slowest:
+                heapq.heappush(self._slowest_files, item)
+            elif item > self._slowest_files[0]:
+                heapq.heapreplace(self._slowest_files, item)
+
+    def finish(self):
+        """Stops the wall clock of the run."""
+        self.wall_seconds = time.perf_counter() - self._started
+
+    def report(self):
+        """Returns the metrics as a JSON-serialisable dict."""
+        wall = self.wall_seconds if self.wall_seconds is not None else time.perf_counter() - self._started
+        with self._lock:
+            return {
+                'wall_seconds': round(wall, 6),
+                'files': self.files,
+                'bytes_in': self.bytes_in,
+                'bytes_out': self.bytes_out,
+                'files_per_second': round(self.files / wall, 2) if wall else None,
+                'mb_per_second': round(self.bytes_in / wall / 1e6, 3) if wall else None,
+                'compression_ratio': round(self.bytes_out / self.bytes_in, 4) if self.bytes_in else None,
+                'peak_rss_kb': peak_rss_kb(),
+                'phases': {
+                    name: {'seconds': round(seconds, 6), 'count': count}
+                    for name, (seconds, count) in sorted(self.phases.items())
+                },
+                'slowest_files': [
+                    {'path': path, 'seconds': round(seconds, 6), 'bytes': size}
+                    for seconds, path, size in sorted(self._slowest_files, reverse=True)
+                ],
+            }
+
+    def to_json(self):
+        return json.dumps(self.report(), indent=2)
+
+    def to_prometheus(self):
+        """Returns the metrics in the Prometheus text exposition format."""
+        report = self.report()
+        lines = []
+
+        def metric(name, help_text, samples):
+            lines.append(f'# HELP bakzip_{name} {help_text}')
+            lines.append(f'# TYPE bakzip_{name} gauge')
+            for labels, value in samples:
+                lines.append(f'bakzip_{name}{labels} {value}')
+
+        metric('wall_seconds', 'Wall time of the last backup.', [('', report['wall_seconds'])])
+        metric('files', 'Files archived by the last backup.', [('', report['files'])])
+        metric('bytes_in', 'Uncompressed bytes read by the last backup.', [('', report['bytes_in'])])
+        metric('bytes_out', 'Compressed bytes written by the last backup.', [('', report['bytes_out'])])
+        if report['compression_ratio'] is not None:
+            metric('compression_ratio', 'Compressed size as a fraction of the input.',
+                   [('', report['compression_ratio'])])
+        if report['peak_rss_kb'] is not None:
+            metric('peak_rss_bytes', 'Peak resident set size of the backup process.',
+                   [('', report['peak_rss_kb'] * 1024)])
+        metric('phase_seconds', 'Time spent per phase, summed over threads.',
+               [(f'{{phase="{name}"}}', phase['seconds']) for name, phase in report['phases'].items()])
+        metric('last_run_timestamp_seconds', 'Unix time the last backup finished.', [('', int(time.time()))])
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path, fmt='json'):
+        """
+        Writes the report to a file, atomically so collectors never read a partial file.
+
+        Args:
+            path (str): The output path.
+            fmt (str, optional): 'json' or 'prometheus'. Defaults to 'json'.
+        """
+        text = self.to_prometheus() if fmt == 'prometheus' else self.to_json()
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(text)
+        os.replace(tmp_path, path)
+
+    def summary_lines(self):
+        """Returns human-readable lines for the verbose summary."""
+        report = self.report()
+        lines = [f'Phase {name}: {phase["seconds"]:.3f} s ({phase["count"]} calls)'
+                 for name, phase in report['phases'].items()]
+        if report['files_per_second'] is not None:
+            lines.append(f'Throughput: {report["files_per_second"]} files/s, {report["mb_per_second"]} MB/s')
+        if report['compression_ratio'] is not None:
+            lines.append(f'Compression ratio: {report["compression_ratio"]}')
+        if report['peak_rss_kb'] is not None:
+            lines.append(f'Peak memory: {report["peak_rss_kb"]} KiB')
+        for item in report['slowest_files'][:3]:
+            lines.append(f'Slow file: {item["path"]} {item["seconds"]:.3f} s ({item["bytes"]} bytes)')
+        return lines
+
+
+def run_profiled(func, path, *args, **kwargs):
+    """
+    Runs `func` under cProfile and dumps the stats to `path`.
+
+    Only the calling thread is profiled; inspect the dump with
+    `python -m pstats <path>` or a viewer such as snakeviz.
+
+    Returns:
+        The return value of `func`.
+    """
+    import cProfile
+    profiler = cProfile.Profile()
+    try:
+        return profiler.runcall(func, *args, **kwargs)
+    finally:
+        profiler.dump_stats(path)
@@ -0,0 +1,46 @@
+#! /usr/env/bin python
+"""
+This module provides the progress bars of the archive writers.
+
+`tqdm` is a stand-in for `tqdm.tqdm` that imports tqdm on first use and
+returns the iterable unchanged when progress bars are off: in quiet mode
+and when stderr is not a terminal, as under cron. Importing tqdm takes
+longer than the rest of a small backup, so it is skipped whenever no bar
+is drawn.
+"""
+import sys
+
+_quiet = False
+
+
+def set_quiet(quiet):
+    """
+    Turns progress bars off (or back on) for the whole process.
+
+    Args:
+        quiet (bool): Whether to hide progress bars.
+    """
+    global _quiet
+    _quiet = quiet
+
+
+def enabled():
+    """Returns whether progress bars are drawn."""
+    return not _quiet and sys.stderr is not None and sys.stderr.isatty()
+
+
+def tqdm(iterable, **kwargs):
+    """
+    Wraps an iterable in a tqdm progress bar if progress bars are enabled.
+
+    Args:
+        iterable (iterable): The items to iterate over.
+        **kwargs: Passed to `tqdm.tqdm`, such as `desc` and `unit`.
+
+    Returns:
+        The progress bar, or the iterable itself.
+    """
+    if not enabled():
+        return iterable
+    from tqdm import tqdm as progress_bar
+    return progress_bar(iterable, **kwargs)
@@ -0,0 +1,371 @@
+#! /usr/env/bin python
+"""
+End-to-end benchmark suite for BakZip.
+
+`run` generates a synthetic corpus (file count, size distribution, depth and
+compressibility are configurable), times each phase of a backup separately
+and writes the results as JSON. The read phases evict the corpus from the
+page cache and read it through the read-ahead stage in each read order
+(none, inode, extent), which shows the effect of read scheduling on
+seek-bound storage:
+
+    python benchmark_suite.py run --files 5000 --output current.json
+
+`compare` checks a result against a stored baseline and exits with status 1
+if any phase got slower (or used more memory) than the threshold allows:
+
+    python benchmark_suite.py compare baseline.json current.json --threshold 0.10
+
+Each phase reports seconds (best of --repeat runs), files/s, MB/s and the
+peak RSS of the process after the phase. Peak RSS is a high-water mark, so
+it only grows from one phase to the next; run phases selectively with
+--phases to measure one in isolation.
+"""
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+from bakzip.services.codecs import get_codec
+from bakzip.services.prefetch import read_ahead
+from bakzip.services.read_order import READ_ORDERS
+from bakzip.services.ignore_engine import IgnoreMatcher
+from bakzip.services.tree_walker import walk_tree
+from bakzip.services.tar_service import create_tar
+from bakzip.services.zip_service import create_zip
+from bakzip.utilities.metrics import peak_rss_kb
+
+RESULT_VERSION = 1
+DEFAULT_ZIP_CODECS = ('deflate', 'bzip2', 'xz', 'zstd')
+DEFAULT_TAR_CODECS = ('gz',)
+PHASES = ('scan', 'ignore', 'read', 'zip', 'tar', 'encryption')
+
+_WORDS = (
+    'backup archive directory compress stream block member header central record '
+    'file path ignore pattern manifest chunk snapshot restore codec level thread '
+    'def return import class self none true false for while with yield lambda'
+).split()
+
+
+def _file_content(rng, size, compressible):
+    if not compressible:
+        return rng.randbytes(size) if hasattr(rng, 'randbytes') else os.urandom(size)
+    words = []
+    length = 0
+    while length <= size:
+        word = rng.choice(_WORDS)
+        words.append(word)
+        length += len(word) + 1
+    return ' '.join(words).encode()[:size]
+
+
+def _directories(root, depth, fanout):
+    dirs = [root]
+    level = [root]
+    for d in range(depth):
+        level = [os.path.join(parent, f'dir_{d}_{i}') for parent in level for i in range(fanout)]
+        dirs.extend(level)
+    return dirs
+
+
+def generate_corpus(root, files=1000, median_size=16 * 1024, sigma=1.5, max_size=64 * 1024 * 1024,
+                    depth=3, fanout=4, compressible=0.7, seed=42):
+    """
+    Generates a deterministic synthetic corpus.
+
+    File sizes follow a log-normal distribution around `median_size`, clipped
+    to `max_size`. Files are spread round-robin over a directory tree `depth`
+    levels deep with `fanout` subdirectories per directory. A `compressible`
+    fraction of the files contain text, the rest random bytes.
+
+    Returns:
+        dict: The corpus parameters and its total file count and size.
+    """
+    rng = random.Random(seed)
+    dirs = _directories(root, depth, fanout)
+    for directory in dirs:
+        os.makedirs(directory, exist_ok=True)
+    total = 0
+    for i in range(files):
+        size = min(max_size, int(rng.lognormvariate(math.log(median_size), sigma)))
+        ext = '.txt' if rng.random() < compressible else '.bin'
+        path = os.path.join(dirs[i % len(dirs)], f'file_{i}{ext}')
+        with open(path, 'wb') as f:
+            total += f.write(_file_content(rng, size, ext == '.txt'))
+    return {
+        'files': files, 'median_size': median_size, 'sigma': sigma, 'max_size': max_size,
+        'depth': depth, 'fanout': fanout, 'compressible': compressible, 'seed': seed,
+        'directories': len(dirs), 'total_bytes': total,
+    }
+
+
+def _measure(func, repeat):
+    best = None
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def _phase(seconds, files, nbytes, **extra):
+    return dict(
+        seconds=round(seconds, 6),
+        files=files,
+        bytes=nbytes,
+        files_per_s=round(files / seconds, 1) if seconds else None,
+        mb_per_s=round(nbytes / seconds / 1e6, 2) if seconds and nbytes else None,
+        peak_rss_kb=peak_rss_kb(),
+        **extra,
+    )
+
+
+def _ignore_patterns(count):
+    patterns = ['*.log', '__pycache__/', 'node_modules/', '!keep.log']
+    patterns += [f'generated_{i}/*.tmp' for i in range(count)]
+    patterns += [f'*.ext{i}' for i in range(count)]
+    return patterns
+
+
+def evict_from_cache(paths):
+    """
+    Drops files from the page cache so the next read hits the disk.
+
+    Uses `posix_fadvise(DONTNEED)`, which needs no privileges but only
+    evicts clean pages. Returns False where the platform cannot do it.
+    """
+    if not hasattr(os, 'posix_fadvise'):
+        return False
+    for path in paths:
+        try:
+            fd = os.open(path, os.O_RDONLY)
+        except OSError:
+            continue
+        try:
+            os.fdatasync(fd)
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+        except OSError:
+            pass
+        finally:
+            os.close(fd)
+    return True
+
+
+def _read_phase(files, nbytes, order, repeat):
+    # Cold-cache reads through the read-ahead stage, without compression, so
+    # the result is bound by the disk's seeking rather than the CPU.
+    best = None
+    cold = False
+    for _ in range(repeat):
+        cold = evict_from_cache(files)
+        started = time.perf_counter()
+        for _ in read_ahead(files, order=order):
+            pass
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return _phase(best, len(files), nbytes, cold_cache=cold)
+
+
+def _archive_phase(func, output, files, nbytes, repeat):
+    seconds, _ = _measure(func, repeat)
+    size = os.path.getsize(output)
+    os.remove(output)
+    return _phase(seconds, files, nbytes, output_bytes=size, ratio=round(size / nbytes, 4) if nbytes else None)
+
+
+def run_suite(corpus, workdir, phases=PHASES, zip_codecs=DEFAULT_ZIP_CODECS, tar_codecs=DEFAULT_TAR_CODECS,
+              jobs=1, repeat=3, ignore_patterns=200):
+    """
+    Times each phase of a backup of `corpus`.
+
+    Args:
+        corpus (str): The corpus directory.
+        workdir (str): A directory for the archives, which are deleted after each phase.
+        phases (iterable, optional): The phases to run, a subset of `PHASES`.
+        zip_codecs (iterable, optional): The codecs timed in the zip phase; unavailable ones are skipped.
+        tar_codecs (iterable, optional): The codecs timed in the tar phase.
+        jobs (int, optional): The number of compression workers passed to the writers.
+        repeat (int, optional): The number of runs per phase; the fastest counts.
+        ignore_patterns (int, optional): The number of generated patterns of each kind in the ignore phase.
+
+    Returns:
+        dict: The phase results, keyed by phase name (e.g. 'zip-zstd').
+    """
+    results = {}
+    seconds, entries = _measure(lambda: list(walk_tree(corpus)), repeat)
+    files = [entry.path for entry in entries]
+    nbytes = sum(entry.stat.st_size for entry in entries if entry.stat)
+    if 'scan' in phases:
+        results['scan'] = _phase(seconds, len(files), 0)
+
+    if 'ignore' in phases:
+        matcher = IgnoreMatcher(_ignore_patterns(ignore_patterns))
+        seconds, _ = _measure(lambda: [matcher(entry.rel_path, False) for entry in entries], repeat)
+        results['ignore'] = _phase(seconds, len(files), 0, patterns=len(matcher.layers[0][1].rules))
+
+    if 'read' in phases:
+        for order in READ_ORDERS:
+            results[f'read-{order}'] = _read_phase(files, nbytes, order, repeat)
+
+    # The archive writers print progress through tqdm; the bars go to stderr.
+    if 'zip' in phases:
+        for name in zip_codecs:
+            try:
+                get_codec(name)
+            except ValueError as e:
+                print(f"Skipping zip-{name}: {e}", file=sys.stderr)
+                continue
+            output = os.path.join(workdir, f'bench-{name}.zip')
+            results[f'zip-{name}'] = _archive_phase(
+                lambda: create_zip(files, output, None, name, base_dir=corpus, jobs=jobs),
+                output, len(files), nbytes, repeat)
+
+    if 'tar' in phases:
+        for name in tar_codecs:
+            try:
+                codec = get_codec(name)
+            except ValueError as e:
+                print(f"Skipping tar-{name}: {e}", file=sys.stderr)
+                continue
+            output = os.path.join(workdir, f'bench.tar{codec.tar_suffix}')
+            results[f'tar-{name}'] = _archive_phase(
+                lambda: create_tar(files, output, name, base_dir=corpus, jobs=jobs),
+                output, len(files), nbytes, repeat)
+
+    if 'encryption' in phases:
+        # AES-256 ZIP with the fastest deflate level, so the cipher dominates.
+        output = os.path.join(workdir, 'bench-aes.zip')
+        results['encryption'] = _archive_phase(
+            lambda: create_zip(files, output, 'benchmark', 'fast', base_dir=corpus, jobs=jobs),
+            output, len(files), nbytes, repeat)
+    return results
+
+
+def _rate(phase):
+    return phase.get('mb_per_s') or phase.get('files_per_s')
+
+
+def compare_results(baseline, current, threshold=0.10):
+    """
+    Compares two result documents phase by phase.
+
+    A phase regresses if its throughput (MB/s, or files/s for phases without
+    bytes) dropped, or its peak RSS grew, by more than `threshold`.
+
+    Returns:
+        A list of (phase, metric, baseline value, current value, change) tuples, one per regression.
+    """
+    regressions = []
+    for name, old in baseline.get('phases', {}).items():
+        new = current.get('phases', {}).get(name)
+        if new is None:
+            continue
+        old_rate, new_rate = _rate(old), _rate(new)
+        if old_rate and new_rate is not None and new_rate < old_rate * (1 - threshold):
+            regressions.append((name, 'throughput', old_rate, new_rate, new_rate / old_rate - 1))
+        old_rss, new_rss = old.get('peak_rss_kb'), new.get('peak_rss_kb')
+        if old_rss and new_rss is not None and new_rss > old_rss * (1 + threshold):
+            regressions.append((name, 'peak_rss_kb', old_rss, new_rss, new_rss / old_rss - 1))
+    return regressions
+
+
+def _print_table(phases):
+    print(f"{'phase':<16}{'seconds':>10}{'files/s':>12}{'MB/s':>10}{'ratio':>8}{'peak RSS KiB':>14}")
+    for name, phase in phases.items():
+        print(f"{name:<16}{phase['seconds']:>10.3f}{phase['files_per_s'] or 0:>12.0f}"
+              f"{phase['mb_per_s'] or 0:>10.1f}{phase.get('ratio') or 0:>8.3f}{phase['peak_rss_kb'] or 0:>14}")
+
+
+def _run(args):
+    workdir = tempfile.mkdtemp(prefix='bakzip-bench-')
+    corpus = args.corpus or os.path.join(workdir, 'corpus')
+    try:
+        if args.corpus and os.path.isdir(corpus) and os.listdir(corpus):
+            corpus_info = {'path': corpus}
+        else:
+            corpus_info = generate_corpus(
+                corpus, files=args.files, median_size=args.median_size, sigma=args.sigma,
+                max_size=args.max_size, depth=args.depth, fanout=args.fanout,
+                compressible=args.compressible, seed=args.seed)
+        phases = run_suite(
+            corpus, workdir, phases=args.phases, zip_codecs=args.zip_codecs, tar_codecs=args.tar_codecs,
+            jobs=args.jobs, repeat=args.repeat, ignore_patterns=args.ignore_patterns)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    document = {
+        'version': RESULT_VERSION,
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'jobs': args.jobs,
+        'repeat': args.repeat,
+        'corpus': corpus_info,
+        'phases': phases,
+    }
+    _print_table(phases)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(document, f, indent=2)
+        print(f"Results written to: {args.output}")
+    return 0
+
+
+def _compare(args):
+    with open(args.baseline, encoding='utf-8') as f:
+        baseline = json.load(f)
+    with open(args.current, encoding='utf-8') as f:
+        current = json.load(f)
+    regressions = compare_results(baseline, current, args.threshold)
+    for name, metric, old, new, change in regressions:
+        print(f"REGRESSION {name} {metric}: {old} -> {new} ({change:+.1%})")
+    if not regressions:
+        print(f"No regressions beyond {args.threshold:.0%}.")
+    return 1 if regressions else 0
+
+
+def parse_arguments(argv=None):
+    parser = argparse.ArgumentParser(description='BakZip end-to-end benchmark suite')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run = commands.add_parser('run', help='Generate a corpus and time each backup phase')
+    run.add_argument('--corpus', help='Use (or create) this corpus directory instead of a temporary one')
+    run.add_argument('--files', type=int, default=2000, help='The number of files to generate')
+    run.add_argument('--median-size', type=int, default=16 * 1024, help='The median file size in bytes')
+    run.add_argument('--sigma', type=float, default=1.5, help='The spread of the log-normal size distribution')
+    run.add_argument('--max-size', type=int, default=64 * 1024 * 1024, help='The largest file size in bytes')
+    run.add_argument('--depth', type=int, default=3, help='The depth of the directory tree')
+    run.add_argument('--fanout', type=int, default=4, help='The subdirectories per directory')
+    run.add_argument('--compressible', type=float, default=0.7, help='The fraction of text (compressible) files')
+    run.add_argument('--seed', type=int, default=42, help='The random seed of the corpus')
+    run.add_argument('--phases', nargs='+', choices=PHASES, default=list(PHASES), help='The phases to run')
+    run.add_argument('--zip-codecs', nargs='+', default=list(DEFAULT_ZIP_CODECS), help='The codecs of the zip phase')
+    run.add_argument('--tar-codecs', nargs='+', default=list(DEFAULT_TAR_CODECS), help='The codecs of the tar phase')
+    run.add_argument('--ignore-patterns', type=int, default=200, help='The generated patterns per kind in the ignore phase')
+    run.add_argument('-j', '--jobs', type=int, default=1, help='The number of compression workers')
+    run.add_argument('--repeat', type=int, default=3, help='The runs per phase; the fastest counts')
+    run.add_argument('-o', '--output', help='Write the results as JSON to this file')
+
+    compare = commands.add_parser('compare', help='Flag regressions of a result against a baseline')
+    compare.add_argument('baseline', help='The baseline result JSON')
+    compare.add_argument('current', help='The result JSON to check')
+    compare.add_argument('--threshold', type=float, default=0.10, help='The tolerated relative slowdown (default 0.10)')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_arguments(argv)
+    return _run(args) if args.command == 'run' else _compare(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -21,10 +21,16 @@ setup(
     license='MIT',
     install_requires=[
         'pyzipper',
+        'pycryptodomex',
         'tqdm',
         'pyfiglet',
         'pytest'
     ],
+    extras_require={
+        'zstd': ['zstandard'],
+        'lz4': ['lz4'],
+        'repo': ['numpy'],
+    },
     entry_points={
         'console_scripts': [
             'bakzip=bakzip.main:main',
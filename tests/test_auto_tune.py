@@ -0,0 +1,121 @@
+import tarfile
+import zipfile
+import pytest
+from unittest.mock import patch
+from bakzip.services import auto_tune
+from bakzip.services.auto_tune import AutoTuner, Target, Trial, parse_target, sample_data
+from bakzip.services.codecs import CODECS
+from bakzip.services.directory_processor import catalog_directory
+from bakzip.services.tar_service import create_tar
+from bakzip.services.zip_service import create_zip
+
+
+def _trials():
+    return [Trial(CODECS['store'], 0, 1000e6, 1.0), Trial(CODECS['deflate'], 1, 100e6, 0.5),
+            Trial(CODECS['deflate'], 6, 30e6, 0.4), Trial(CODECS['bzip2'], 9, 5e6, 0.3)]
+
+
+def _tuner(target, jobs=1, total_bytes=None):
+    tuner = AutoTuner('zip', target, jobs, total_bytes)
+    tuner.trials = _trials()
+    tuner.choice = tuner._pick(tuner.required_throughput())
+    return tuner
+
+
+def test_parse_target():
+    assert parse_target("200MB/s") == Target(200e6, None)
+    assert parse_target("1.5 GiB/s") == Target(1.5 * (1 << 30), None)
+    assert parse_target("30m") == Target(None, 1800)
+    assert parse_target("90") == Target(None, 90)
+    with pytest.raises(ValueError, match="Invalid compression target"):
+        parse_target("fast")
+
+
+def test_picks_the_best_ratio_meeting_the_target():
+    assert _tuner(Target(50e6, None)).choice.level == 1
+    # Four threads make deflate level 6 fast enough.
+    assert _tuner(Target(50e6, None), jobs=4).choice.level == 6
+    # Nothing is fast enough, so the fastest setting wins.
+    assert _tuner(Target(5e9, None)).choice.codec.name == 'store'
+    # 100 MB in an hour only needs 28 kB/s.
+    assert _tuner(Target(None, 3600), total_bytes=100e6).choice.codec.name == 'bzip2'
+
+
+def test_adjusts_when_the_measured_throughput_drifts():
+    tuner = _tuner(Target(50e6, None))
+    assert tuner.choice.level == 1
+    with patch.object(auto_tune, "CHECK_BYTES", 1000):
+        # deflate level 1 runs at 40 MB/s in the backup, below the target.
+        tuner.record(1000, 1000 / 40e6)
+        assert (tuner.choice.codec.name, tuner.changes) == ('store', 1)
+        # The machine got faster: everything runs 10x faster than in the trials.
+        tuner.record(1000, 1000 / 10000e6)
+        assert tuner.choice.codec.name == 'deflate' and tuner.choice.level == 6
+        assert tuner.changes == 2
+
+
+def test_calibrate_measures_every_available_candidate(tmpdir):
+    src = tmpdir.mkdir("src")
+    for n in range(20):
+        src.join(f"f{n}.txt").write(f"line {n}\n" * 5000)
+    catalog = catalog_directory(str(src), None)[0]
+    samples = sample_data(catalog, files=4, size=1024)
+    assert len(samples) == 4 and all(len(sample) == 1024 for sample in samples)
+
+    tuner = AutoTuner('tar', Target(1, None))
+    choice = tuner.calibrate(samples)
+    assert {trial.codec.name for trial in tuner.trials} >= {'store', 'gz', 'bzip2', 'xz'}
+    assert choice.ratio == min(trial.ratio for trial in tuner.trials)
+    assert AutoTuner('zip', Target(1e15, None)).calibrate(samples).codec.name == 'store'
+
+
+class _SwitchingTuner:
+    """Picks deflate level 1 for the first member or segment and the given setting after that."""
+
+    def __init__(self, then):
+        self.choice = Trial(CODECS['deflate'], 1, 1, 1)
+        self.then = then
+        self.records = 0
+
+    def restrict(self, codec_name):
+        pass
+
+    def record(self, bytes_in, seconds, elapsed=False):
+        self.records += 1
+        self.choice = self.then
+
+
+def _tree(tmpdir):
+    src = tmpdir.mkdir("src")
+    for n in range(4):
+        src.join(f"f{n}.txt").write(f"content {n} " * 2000)
+    return src
+
+
+def test_zip_members_follow_the_tuner(tmpdir):
+    src = _tree(tmpdir)
+    output = str(tmpdir.join("a.zip"))
+    tuner = _SwitchingTuner(Trial(CODECS['bzip2'], 9, 1, 1))
+    with patch("bakzip.services.zip_service.tqdm", side_effect=lambda x, **kwargs: x):
+        create_zip(catalog_directory(str(src), None)[0], output, jobs=1, read_ahead=0, tuner=tuner)
+
+    assert tuner.records == 4
+    with zipfile.ZipFile(output) as zf:
+        assert zf.testzip() is None
+        types = [info.compress_type for info in zf.infolist()]
+    # Members already in flight keep the setting they were submitted with.
+    assert types[0] == zipfile.ZIP_DEFLATED and types[-1] == zipfile.ZIP_BZIP2
+
+
+def test_tar_starts_a_new_segment_when_the_level_changes(tmpdir):
+    src = _tree(tmpdir)
+    output = str(tmpdir.join("a.tar.gz"))
+    with patch("bakzip.services.tar_service.tqdm", side_effect=lambda x, **kwargs: x):
+        create_tar(catalog_directory(str(src), None)[0], output, 'gz', read_ahead=0,
+                   tuner=_SwitchingTuner(Trial(CODECS['gz'], 9, 1, 1)))
+
+    with tarfile.open(output, "r:gz") as tar:
+        assert tar.getnames() == [f"f{n}.txt" for n in range(4)]
+        assert tar.extractfile("f3.txt").read() == src.join("f3.txt").read_binary()
+    # Each level is its own gzip member.
+    assert tmpdir.join("a.tar.gz").read_binary().count(b"\x1f\x8b\x08") == 2
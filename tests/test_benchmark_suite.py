@@ -0,0 +1,42 @@
+import os
+from benchmark_suite import compare_results, generate_corpus
+
+
+def _sizes(root):
+    sizes = {}
+    for dirpath, _, filenames in os.walk(root):
+        for name in filenames:
+            path = os.path.join(dirpath, name)
+            sizes[os.path.relpath(path, root)] = os.path.getsize(path)
+    return sizes
+
+
+def test_generate_corpus_is_deterministic(tmpdir):
+    first = generate_corpus(str(tmpdir.join("a")), files=40, median_size=2000, depth=2, fanout=2, seed=7)
+    second = generate_corpus(str(tmpdir.join("b")), files=40, median_size=2000, depth=2, fanout=2, seed=7)
+
+    assert first == second
+    assert first["directories"] == 1 + 2 + 4
+    sizes = _sizes(str(tmpdir.join("a")))
+    assert len(sizes) == 40
+    assert sum(sizes.values()) == first["total_bytes"]
+    assert sizes == _sizes(str(tmpdir.join("b")))
+
+
+def test_compare_flags_slower_and_bigger_phases():
+    baseline = {"phases": {
+        "zip-deflate": {"mb_per_s": 100.0, "peak_rss_kb": 1000},
+        "scan": {"mb_per_s": None, "files_per_s": 5000.0, "peak_rss_kb": 1000},
+        "tar-gz": {"mb_per_s": 50.0, "peak_rss_kb": 1000},
+    }}
+    current = {"phases": {
+        "zip-deflate": {"mb_per_s": 80.0, "peak_rss_kb": 1050},
+        "scan": {"mb_per_s": None, "files_per_s": 4900.0, "peak_rss_kb": 1500},
+    }}
+
+    regressions = compare_results(baseline, current, threshold=0.10)
+
+    assert [(name, metric) for name, metric, *_ in regressions] == [
+        ("zip-deflate", "throughput"),
+        ("scan", "peak_rss_kb"),
+    ]
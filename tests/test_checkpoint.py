@@ -0,0 +1,105 @@
+import os
+import tarfile
+import zipfile
+import pytest
+from unittest.mock import patch
+from bakzip.services import zip_writer
+from bakzip.services.checkpoint import Checkpoint, journal_path
+from bakzip.services.tar_service import create_tar
+from bakzip.services.zip_service import create_zip
+
+SETTINGS = {'format': 'test'}
+
+
+@pytest.fixture(autouse=True)
+def no_progress_bars():
+    with patch("bakzip.services.tar_service.tqdm", side_effect=lambda x, **kwargs: x), \
+            patch("bakzip.services.zip_service.tqdm", side_effect=lambda x, **kwargs: x):
+        yield
+
+
+def _tree(tmpdir, count=6):
+    src = tmpdir.mkdir("src")
+    for n in range(count):
+        src.join(f"f{n}.txt").write(f"content {n} " * 2000)
+    return src, sorted(str(p) for p in src.listdir())
+
+
+def _failing(files, after):
+    for n, file in enumerate(files):
+        if n == after:
+            raise OSError("disk unplugged")
+        yield file
+
+
+def test_journal_keeps_only_committed_members(tmpdir):
+    output = str(tmpdir.join("a.zip"))
+    with open(output, 'wb') as archive:
+        checkpoint = Checkpoint.start(output, SETTINGS)
+        archive.write(b'x' * 10)
+        checkpoint.add("a", [1])
+        checkpoint.commit(archive, 10, {'tar_offset': 512})
+        archive.write(b'y' * 10)
+        checkpoint.add("b", [2])
+        checkpoint.close()
+
+    resumed = Checkpoint.resume(output, SETTINGS)
+    assert (resumed.offset, resumed.state, resumed.members, resumed.committed) == (10, {'tar_offset': 512}, [[1]], {"a"})
+    resumed.finish()
+    assert not os.path.exists(journal_path(output))
+
+
+def test_resume_rejects_other_settings_and_missing_journals(tmpdir):
+    output = str(tmpdir.join("a.zip"))
+    with pytest.raises(ValueError, match="No checkpoint journal"):
+        Checkpoint.resume(output, SETTINGS)
+    tmpdir.join("a.zip").write("")
+    Checkpoint.start(output, SETTINGS).close()
+    with pytest.raises(ValueError, match="other settings"):
+        Checkpoint.resume(output, {'format': 'other'})
+
+
+def test_zip_resumes_after_a_failure(tmpdir):
+    src, files = _tree(tmpdir)
+    output = str(tmpdir.join("a.zip"))
+    checkpoint = Checkpoint.start(output, SETTINGS, interval=3600)
+    with pytest.raises(OSError):
+        create_zip(_failing(files, 4), output, base_dir=str(src), compression='deflate', read_ahead=0,
+                   checkpoint=checkpoint)
+    checkpoint.close()
+
+    # The failure commits the members written before it; members still in flight are dropped.
+    resumed = Checkpoint.resume(output, SETTINGS)
+    names = [os.path.basename(f) for f in files]
+    done = len(resumed.committed)
+    assert done and resumed.committed == set(names[:done])
+    with patch("bakzip.services.zip_writer.compress_member", wraps=zip_writer.compress_member) as compress:
+        create_zip(files, output, base_dir=str(src), compression='deflate', read_ahead=0, checkpoint=resumed)
+    resumed.finish()
+
+    assert [call.args[1] for call in compress.call_args_list] == names[done:]
+    with zipfile.ZipFile(output) as archive:
+        assert archive.testzip() is None
+        assert archive.namelist() == [os.path.basename(f) for f in files]
+        assert archive.read("f5.txt") == src.join("f5.txt").read_binary()
+
+
+@pytest.mark.parametrize("compression, mode", [("store", "r:"), ("gz", "r:gz"), ("xz", "r:xz")])
+def test_tar_resumes_from_the_last_segment(tmpdir, compression, mode):
+    src, files = _tree(tmpdir)
+    output = str(tmpdir.join("a.tar"))
+    # An interval of 0 commits after every member.
+    checkpoint = Checkpoint.start(output, SETTINGS, interval=0)
+    with pytest.raises(OSError):
+        create_tar(_failing(files, 3), output, compression, base_dir=str(src), read_ahead=0,
+                   checkpoint=checkpoint)
+    checkpoint.close()
+
+    resumed = Checkpoint.resume(output, SETTINGS)
+    assert resumed.committed == {"f0.txt", "f1.txt", "f2.txt"}
+    create_tar(files, output, compression, base_dir=str(src), read_ahead=0, checkpoint=resumed)
+    resumed.finish()
+
+    with tarfile.open(output, mode) as tar:
+        assert tar.getnames() == [os.path.basename(f) for f in files]
+        assert tar.extractfile("f4.txt").read() == src.join("f4.txt").read_binary()
@@ -0,0 +1,125 @@
+import io
+import os
+import random
+import pytest
+from unittest.mock import patch
+from bakzip.services import chunk_store
+from bakzip.services.chunk_store import backup_to_repository, is_snapshot, iter_chunks, restore_snapshot
+
+SMALL = dict(min_size=1024, avg_size=4096, max_size=16384)
+
+
+def _random_bytes(size, seed):
+    rng = random.Random(seed)
+    return bytes(rng.getrandbits(8) for _ in range(size))
+
+
+def test_iter_chunks_respects_bounds_and_roundtrips():
+    data = _random_bytes(100000, 1)
+    chunks = list(iter_chunks(io.BytesIO(data), **SMALL))
+    assert b"".join(chunks) == data
+    assert all(len(c) <= SMALL["max_size"] for c in chunks)
+    assert all(len(c) >= SMALL["min_size"] for c in chunks[:-1])
+
+
+def test_iter_chunks_boundaries_survive_insertion():
+    data = _random_bytes(100000, 2)
+    edited = data[:500] + b"inserted bytes" + data[500:]
+    before = set(iter_chunks(io.BytesIO(data), **SMALL))
+    after = set(iter_chunks(io.BytesIO(edited), **SMALL))
+    # Only the chunk around the edit changes; the rest are shared.
+    assert len(after - before) <= 2
+    assert len(before & after) >= len(before) - 2
+
+
+def test_backup_dedups_and_restores(tmpdir):
+    src = tmpdir.mkdir("src")
+    src.join("a.bin").write_binary(_random_bytes(50000, 3))
+    src.mkdir("sub").join("copy.bin").write_binary(_random_bytes(50000, 3))
+    repo = str(tmpdir.join("repo"))
+    files = [str(src.join("a.bin")), str(src.join("sub", "copy.bin"))]
+
+    with patch.multiple(chunk_store, MIN_CHUNK_SIZE=1024, AVG_CHUNK_SIZE=4096, MAX_CHUNK_SIZE=16384), \
+         patch("bakzip.services.chunk_store.tqdm", side_effect=lambda x, **kwargs: x):
+        first = backup_to_repository(files, repo, str(src), snapshot="one")
+        second = backup_to_repository(files, repo, str(src), snapshot="two")
+        assert is_snapshot(second["snapshot"])
+        restore_snapshot(second["snapshot"], str(tmpdir.join("restored")), jobs=2)
+
+    assert first["new_bytes"] == 50000
+    assert second["new_chunks"] == 0
+    restored = tmpdir.join("restored", "sub", "copy.bin")
+    assert restored.read_binary() == src.join("sub", "copy.bin").read_binary()
+    assert os.stat(str(restored)).st_mtime_ns == os.stat(str(src.join("sub", "copy.bin"))).st_mtime_ns
+
+
+def test_block_hashing_finds_the_same_cuts_as_the_byte_loop():
+    pytest.importorskip("numpy")
+    data = _random_bytes(200000, 4)
+    blocks = list(iter_chunks(io.BytesIO(data), **SMALL))
+    with patch.object(chunk_store, "_numpy_gear", return_value=None):
+        assert list(iter_chunks(io.BytesIO(data), **SMALL)) == blocks
+    # Blocks smaller than a cut's distance from the start still see the bytes before them.
+    with patch.object(chunk_store, "_HASH_BLOCK", 1000):
+        assert list(iter_chunks(io.BytesIO(data), **SMALL)) == blocks
+
+
+def test_unchanged_files_reuse_the_previous_chunk_lists(tmpdir):
+    src = tmpdir.mkdir("src")
+    src.join("same.bin").write_binary(_random_bytes(30000, 5))
+    src.join("edited.bin").write_binary(_random_bytes(30000, 6))
+    repo = str(tmpdir.join("repo"))
+    files = [str(src.join("edited.bin")), str(src.join("same.bin"))]
+
+    with patch.multiple(chunk_store, MIN_CHUNK_SIZE=1024, AVG_CHUNK_SIZE=4096, MAX_CHUNK_SIZE=16384), \
+         patch("bakzip.services.chunk_store.tqdm", side_effect=lambda x, **kwargs: x):
+        backup_to_repository(files, repo, str(src), snapshot="one")
+        src.join("edited.bin").write_binary(_random_bytes(30000, 7))
+        # The same size; only the mtime tells the edit apart, even within one timer tick.
+        os.utime(str(src.join("edited.bin")), ns=(1, 1))
+        store_file = chunk_store._store_file
+        chunked = []
+
+        def recording_store_file(repo, file, stats):
+            chunked.append(os.path.basename(file))
+            return store_file(repo, file, stats)
+
+        with patch.object(chunk_store, "_store_file", side_effect=recording_store_file):
+            stats = backup_to_repository(files, repo, str(src), snapshot="two")
+        restore_snapshot(stats["snapshot"], str(tmpdir.join("restored")))
+
+    assert chunked == ["edited.bin"]
+    assert stats["unchanged"] == 1 and stats["files"] == 2
+    assert stats["bytes"] == 60000
+    for name in ("same.bin", "edited.bin"):
+        assert tmpdir.join("restored", name).read_binary() == src.join(name).read_binary()
+
+
+def test_snapshots_are_never_replaced(tmpdir):
+    src = tmpdir.mkdir("src")
+    src.join("a.txt").write("a")
+    repo = str(tmpdir.join("repo"))
+    files = [str(src.join("a.txt"))]
+
+    with patch("bakzip.services.chunk_store.tqdm", side_effect=lambda x, **kwargs: x), \
+            patch("bakzip.services.chunk_store.time.strftime", return_value="20260101T000000"):
+        paths = [backup_to_repository(files, repo, str(src))["snapshot"] for _ in range(3)]
+        backup_to_repository(files, repo, str(src), snapshot="named")
+        with pytest.raises(ValueError, match="already exists"):
+            backup_to_repository(files, repo, str(src), snapshot="named")
+
+    assert [os.path.basename(path) for path in paths] == [
+        "20260101T000000.json", "20260101T000000-1.json", "20260101T000000-2.json"]
+    assert sorted(os.listdir(os.path.join(repo, "snapshots"))) == sorted(
+        [os.path.basename(path) for path in paths] + ["named.json"])
+
+
+def test_concurrent_writes_of_one_path_use_their_own_temporary_files(tmpdir):
+    from concurrent.futures import ThreadPoolExecutor
+    path = str(tmpdir.join("chunk"))
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        list(pool.map(lambda n: chunk_store._write_atomic(path, bytes([n]) * 100000), range(32)))
+
+    data = tmpdir.join("chunk").read_binary()
+    assert len(data) == 100000 and data == data[:1] * 100000
+    assert tmpdir.listdir() == [tmpdir.join("chunk")]
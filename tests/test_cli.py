@@ -4,12 +4,18 @@ Test suite for the BakZip CLI.
 """
 import os
 import shutil
+import subprocess
+import sys
 from unittest.mock import MagicMock
 import pytest
 from bakzip.services.directory_processor import process_directory
 from bakzip.services.zip_service import create_zip
 from bakzip.services.tar_service import create_tar
 
+# The import time budget of `bakzip --help`, in microseconds, and modules it must not load.
+HELP_IMPORT_BUDGET_US = 200000
+HEAVY_MODULES = ('pyfiglet', 'pyzipper', 'tqdm', 'tarfile', 'zipfile', 'zstandard', 'lz4')
+
 @pytest.fixture
 def temp_directory(tmpdir):
     """
@@ -33,7 +39,7 @@ def test_process_directory(temp_directory):
     test_subfile = test_subdir.join("subfile.txt")
     test_subfile.write("Subfile content")
 
-    files_to_include, skipped_files, total_skipped_size = process_directory(str(temp_directory), "bakzip.log")
+    files_to_include, skipped_files, total_skipped_size = process_directory(str(temp_directory), str(temp_directory.join("bakzip.log")))
     assert len(files_to_include) == 2
     assert len(skipped_files) == 0
     assert total_skipped_size == 0
@@ -63,29 +69,126 @@ def test_create_tar(temp_directory):
     create_tar(files_to_include, output_file, 'gz', base_dir=str(temp_directory))
     assert os.path.exists(output_file)
 
-def test_no_traceback_on_error(capsys):
+def test_no_traceback_on_error(tmp_path, capsys):
     """
     Test that no traceback is printed to stdout when an error occurs,
     even in verbose mode.
     """
     from unittest.mock import patch
     from bakzip.main import main
+    from bakzip.utilities.command_line_options import parse_arguments
+
+    # The traceback is logged to bakzip.log next to the output.
+    args = parse_arguments(['-o', str(tmp_path / 'test_output'), '-v', '--checkpoint-interval', '0'])
 
-    # Mock arguments for verbose mode
-    class MockArgs:
-        directory = '.'
-        output = 'test_output'
-        format = 'zip'
-        compression = 'normal'
-        encryption = 'none'
-        verbose = True
-        password = None
-
-    with patch("bakzip.main.parse_arguments", return_value=MockArgs()), \
-         patch("bakzip.main.process_directory", side_effect=Exception("Test Error")):
+    with patch("bakzip.main.parse_arguments", return_value=args), \
+         patch("bakzip.main.iter_directory", side_effect=Exception("Test Error")):
         main()
 
     captured = capsys.readouterr()
     assert "An error occurred: Test Error" in captured.out
     assert "Traceback (most recent call last):" not in captured.out
     assert "Full traceback has been logged to:" in captured.out
+    assert "Test Error" in (tmp_path / "bakzip.log").read_text()
+
+def test_help_import_time_budget():
+    """
+    Test that `bakzip --help` stays within its import time budget and does not
+    load the archive backends or the banner.
+    """
+    repo_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    code = "import sys; sys.argv = ['bakzip', '--help']; from bakzip.main import main; main()"
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], cwd=repo_root,
+                            capture_output=True, text=True, check=False)
+    assert result.returncode == 0
+    assert "usage:" in result.stdout
+
+    imported, total = set(), 0
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        imported.add(name.strip())
+        if name.startswith(' ') and not name.startswith('  '):
+            total += int(cumulative)  # Top-level imports include their dependencies.
+    assert not imported & set(HEAVY_MODULES)
+    assert total < HELP_IMPORT_BUDGET_US
+
+def test_verbose_watch_takes_several_snapshots(tmpdir, capsys):
+    """
+    Test that `bakzip watch -v` keeps watching after its verbose snapshots.
+    """
+    from unittest.mock import patch
+    from bakzip.main import run_watch
+    from bakzip.services.watch_service import ChangeJournal
+    from bakzip.utilities.command_line_options import parse_arguments
+
+    src = tmpdir.mkdir("src")
+    src.join("a.txt").write("hello")
+
+    class FakeWatcher:
+        """Reports one change that needs a rescan, then Ctrl+C on the watcher created for the rescan."""
+        created = 0
+
+        def __init__(self, directory):
+            FakeWatcher.created += 1
+            self.journal = ChangeJournal()
+            self.first = FakeWatcher.created == 1
+
+        def poll(self, timeout=None):
+            if not self.first:
+                raise KeyboardInterrupt
+            src.join("a.txt").write("changed")
+            self.journal.change("a.txt", 7)
+            self.journal.request_rescan()
+
+        def close(self):
+            pass
+
+    args = parse_arguments(['watch', '-d', str(src), '-o', str(tmpdir.join("snap")), '-f', 'tar', '-v',
+                            '--interval', '0'])
+    with patch("bakzip.main.TreeWatcher", FakeWatcher), \
+            patch("bakzip.services.tar_service.tqdm", side_effect=lambda x, **kwargs: x):
+        run_watch(args, None)
+
+    out = capsys.readouterr().out
+    assert "An error occurred" not in out
+    assert out.count("Backup completed successfully.") == 2
+    assert "Watch stopped." in out
+    assert len(tmpdir.listdir(lambda p: p.basename.startswith("snap") and p.ext == ".tar")) == 2
+
+@pytest.mark.parametrize("extra, password, message", [
+    (['-p'], 'secret', "Password protection is not supported for the repo format"),
+    (['-o', '-'], None, "Only ZIP and TAR archives can be written to a stream"),
+])
+def test_repo_format_option_errors_are_reported(tmpdir, capsys, extra, password, message):
+    """
+    Test that options the repo format does not support print an error instead of raising.
+    """
+    import io
+    from bakzip.main import run_backup
+    from bakzip.utilities.command_line_options import parse_arguments
+
+    src = tmpdir.mkdir("src")
+    src.join("a.txt").write("hello")
+    args = parse_arguments(['-d', str(src), '-o', str(tmpdir.join("repo")), '-f', 'repo'] + extra)
+    stream = io.BytesIO() if '-' in extra else None
+    assert run_backup(args, password, stream=stream) is None
+    assert f"An error occurred: {message}" in capsys.readouterr().out
+    assert not tmpdir.join("repo").exists()
+
+def test_encrypted_zstd_zip_is_refused_before_scanning(tmpdir, capsys):
+    """
+    Test that `-f zip -c zstd -p` reports an error instead of writing an archive it cannot restore.
+    """
+    from unittest.mock import patch
+    from bakzip.main import run_backup
+    from bakzip.utilities.command_line_options import parse_arguments
+
+    src = tmpdir.mkdir("src")
+    src.join("a.txt").write("hello")
+    args = parse_arguments(['-d', str(src), '-o', str(tmpdir.join("b")), '-f', 'zip', '-c', 'zstd', '-p'])
+    with patch("bakzip.main.iter_directory", side_effect=AssertionError("scanned")):
+        assert run_backup(args, 'secret') is None
+    assert "An error occurred: Password-protected ZIP archives cannot use the zstd codec" in capsys.readouterr().out
+    assert tmpdir.listdir(lambda p: p.basename.startswith("b")) == []
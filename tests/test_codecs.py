@@ -0,0 +1,112 @@
+import io
+import tarfile
+import zipfile
+import pytest
+from unittest.mock import patch
+from bakzip.services import zip_writer
+from bakzip.services.codecs import CodecStats, get_codec, resolve_compression
+from bakzip.services.tar_service import create_tar
+from bakzip.services.zip_service import create_zip
+
+
+def test_presets_map_to_codecs_and_levels():
+    assert [(c.name, level) for c, level in [
+        resolve_compression('fast', 'zip'),
+        resolve_compression('normal', 'zip'),
+        resolve_compression('maximum', 'zip'),
+        resolve_compression(None, 'zip'),
+    ]] == [('deflate', 1), ('deflate', 6), ('bzip2', 9), ('deflate', 6)]
+    codec, level = resolve_compression('gz', 'tar')
+    assert (codec.name, level, codec.tar_suffix) == ('gz', 9, '.gz')
+    assert resolve_compression('normal', 'tar')[0].name == 'store'
+
+
+def test_explicit_level_overrides_preset_and_is_validated():
+    assert resolve_compression('fast', 'zip', 9)[1] == 9
+    assert resolve_compression('xz', 'tar')[1] == 6
+    with pytest.raises(ValueError, match="Invalid level"):
+        resolve_compression('bzip2', 'tar', 0)
+    with pytest.raises(ValueError, match="Unknown compression codec"):
+        get_codec('brotli')
+
+
+def test_codec_stats_throughput_and_ratio():
+    stats = CodecStats(get_codec('deflate'), 6)
+    stats.add(2000000, 500000, 0.5)
+    assert stats.ratio() == 0.25
+    assert stats.throughput() == pytest.approx(4.0)
+    assert "deflate level 6" in stats.summary()
+
+
+def test_create_tar_xz_roundtrip(tmpdir):
+    tmpdir.join("a.txt").write("hello xz\n" * 1000)
+    output = str(tmpdir.join("out.tar.xz"))
+
+    with patch("bakzip.services.tar_service.tqdm", side_effect=lambda x, **kwargs: x):
+        stats = create_tar([str(tmpdir.join("a.txt"))], output, 'xz', base_dir=str(tmpdir), level=1)
+
+    with tarfile.open(output, 'r:xz') as tar:
+        assert tar.extractfile("a.txt").read() == b"hello xz\n" * 1000
+    assert stats.bytes_out == tmpdir.join("out.tar.xz").size()
+    assert stats.bytes_in > stats.bytes_out
+
+
+def test_create_tar_zstd_multithreaded_roundtrip(tmpdir):
+    zstandard = pytest.importorskip("zstandard")
+    tmpdir.join("a.txt").write("hello zstd\n" * 1000)
+    output = str(tmpdir.join("out.tar.zst"))
+
+    with patch("bakzip.services.tar_service.tqdm", side_effect=lambda x, **kwargs: x):
+        create_tar([str(tmpdir.join("a.txt"))], output, 'zstd', base_dir=str(tmpdir), jobs=2)
+
+    with open(output, 'rb') as f:
+        data = zstandard.ZstdDecompressor().stream_reader(f).read()
+    with tarfile.open(fileobj=io.BytesIO(data)) as tar:
+        assert tar.extractfile("a.txt").read() == b"hello zstd\n" * 1000
+
+
+def test_create_tar_lz4_roundtrip(tmpdir):
+    lz4_frame = pytest.importorskip("lz4.frame")
+    tmpdir.join("a.txt").write("hello lz4\n" * 1000)
+    output = str(tmpdir.join("out.tar.lz4"))
+
+    with patch("bakzip.services.tar_service.tqdm", side_effect=lambda x, **kwargs: x):
+        create_tar([str(tmpdir.join("a.txt"))], output, 'lz4', base_dir=str(tmpdir))
+
+    with lz4_frame.open(output) as f, tarfile.open(fileobj=f, mode='r|') as tar:
+        member = tar.next()
+        assert tar.extractfile(member).read() == b"hello lz4\n" * 1000
+
+
+def test_create_zip_zstd_members(tmpdir):
+    zstandard = pytest.importorskip("zstandard")
+    tmpdir.join("a.txt").write("hello zip zstd\n" * 1000)
+    output = str(tmpdir.join("out.zip"))
+
+    with patch("bakzip.services.zip_service.tqdm", side_effect=lambda x, **kwargs: x):
+        stats = create_zip([str(tmpdir.join("a.txt"))], output, None, 'zstd', base_dir=str(tmpdir), level=19)
+
+    with zipfile.ZipFile(output) as zf:
+        info = zf.getinfo("a.txt")
+        assert info.compress_type == zip_writer.ZIP_ZSTD
+        with open(output, 'rb') as f:
+            f.seek(info.header_offset + 30 + len("a.txt"))
+            payload = f.read(info.compress_size)
+    data = zstandard.ZstdDecompressor().decompressobj().decompress(payload)
+    assert data == b"hello zip zstd\n" * 1000
+    assert (stats.bytes_in, stats.bytes_out) == (info.file_size, info.compress_size)
+
+
+def test_lz4_is_rejected_for_zip(tmpdir):
+    pytest.importorskip("lz4")
+    with pytest.raises(ValueError, match="not supported in ZIP"):
+        create_zip([], str(tmpdir.join("out.zip")), None, 'lz4', base_dir=str(tmpdir))
+
+
+def test_zstd_is_rejected_for_encrypted_zip(tmpdir):
+    pytest.importorskip("zstandard")
+    tmpdir.join("a.txt").write("secret")
+    # Restores decrypt ZIP members with pyzipper, which has no zstd decompressor.
+    with pytest.raises(ValueError, match="cannot use the zstd codec"):
+        create_zip([str(tmpdir.join("a.txt"))], str(tmpdir.join("out.zip")), "secret", 'zstd', base_dir=str(tmpdir))
+    assert not tmpdir.join("out.zip").exists()
@@ -13,6 +13,8 @@ class TestCommandLineOptions(unittest.TestCase):
             self.assertEqual(args.compression, 'normal')
             self.assertEqual(args.encryption, 'none')
             self.assertEqual(args.format, 'zip')
+            self.assertEqual(args.jobs, 1)
+            self.assertIsNone(args.level)
             self.assertFalse(args.verbose)
 
     def test_custom_long_arguments(self):
@@ -25,6 +27,8 @@ class TestCommandLineOptions(unittest.TestCase):
             '--compression', 'maximum',
             '--encryption', 'aes',
             '--format', 'tar',
+            '--jobs', '4',
+            '--level', '19',
             '--verbose'
         ]
         with patch('sys.argv', test_args):
@@ -35,6 +39,8 @@ class TestCommandLineOptions(unittest.TestCase):
             self.assertEqual(args.compression, 'maximum')
             self.assertEqual(args.encryption, 'aes')
             self.assertEqual(args.format, 'tar')
+            self.assertEqual(args.jobs, 4)
+            self.assertEqual(args.level, 19)
             self.assertTrue(args.verbose)
 
     def test_custom_short_arguments(self):
@@ -0,0 +1,51 @@
+import os
+import zipfile
+from unittest.mock import patch
+from bakzip.services.compressibility import has_incompressible_magic, is_compressible
+from bakzip.services.zip_service import create_zip
+
+
+def test_known_extensions_are_incompressible(tmpdir):
+    photo = tmpdir.join("photo.JPG")
+    photo.write("a" * 10000)
+    assert is_compressible(str(photo)) is False
+
+
+def test_magic_numbers_and_random_data_are_incompressible(tmpdir):
+    archive = tmpdir.join("data.bin")
+    archive.write_binary(b"\x1f\x8b\x08" + b"a" * 10000)
+    random_blob = tmpdir.join("blob.dat")
+    random_blob.write_binary(os.urandom(20000))
+    text = tmpdir.join("notes.txt")
+    text.write("hello world\n" * 2000)
+
+    assert is_compressible(str(archive)) is False
+    assert is_compressible(str(random_blob)) is False
+    assert is_compressible(str(text)) is True
+
+
+def test_small_files_are_always_compressed(tmpdir):
+    tiny = tmpdir.join("tiny.zip")
+    tiny.write_binary(os.urandom(100))
+    assert is_compressible(str(tiny)) is True
+
+
+def test_mp4_magic_after_size_field():
+    assert has_incompressible_magic(b"\x00\x00\x00\x18ftypmp42")
+    assert not has_incompressible_magic(b"plain text")
+
+
+def test_create_zip_adaptive_stores_incompressible_members(tmpdir):
+    blob = tmpdir.join("blob.dat")
+    blob.write_binary(os.urandom(20000))
+    text = tmpdir.join("notes.txt")
+    text.write("hello world\n" * 2000)
+    output = str(tmpdir.join("out.zip"))
+
+    with patch("bakzip.services.zip_service.tqdm", side_effect=lambda x, **kwargs: x):
+        create_zip([str(blob), str(text)], output, None, 'maximum', base_dir=str(tmpdir), jobs=2, adaptive=True)
+
+    with zipfile.ZipFile(output) as zf:
+        assert zf.getinfo("blob.dat").compress_type == zipfile.ZIP_STORED
+        assert zf.getinfo("notes.txt").compress_type == zipfile.ZIP_BZIP2
+        assert zf.read("blob.dat") == blob.read_binary()
@@ -0,0 +1,122 @@
+import os
+import tarfile
+import zipfile
+import pytest
+from unittest.mock import patch
+from bakzip.services import dedup as dedup_module, zip_writer
+from bakzip.services.dedup import COPY_PAX_KEY, Deduplicator, Duplicate
+from bakzip.services.restore_service import restore_archive
+from bakzip.services.tar_service import create_tar
+from bakzip.services.tree_walker import walk_tree
+from bakzip.services.zip_service import create_zip
+
+
+@pytest.fixture(autouse=True)
+def no_progress_bars():
+    with patch("bakzip.services.tar_service.tqdm", side_effect=lambda x, **kwargs: x), \
+            patch("bakzip.services.zip_service.tqdm", side_effect=lambda x, **kwargs: x):
+        yield
+
+
+def _make_tree(tmpdir):
+    src = tmpdir.mkdir("src")
+    content = os.urandom(8192)
+    src.join("a.bin").write_binary(content)
+    src.mkdir("vendor").join("copy.bin").write_binary(content)
+    src.join("other.bin").write_binary(os.urandom(8192))
+    os.link(str(src.join("other.bin")), str(src.join("z_link.bin")))
+    src.join("small.txt").write("tiny")
+    src.join("small2.txt").write("tiny")
+    return src, content
+
+
+def _match_all(dedup, src):
+    return {entry.rel_path.replace(os.sep, "/"): dedup.match(entry.path, entry.rel_path.replace(os.sep, "/"),
+                                                              entry.stat)
+            for entry in walk_tree(str(src))}
+
+
+def test_matches_hardlinks_and_identical_content_only(tmpdir):
+    src, _ = _make_tree(tmpdir)
+    dedup = Deduplicator()
+    with patch("bakzip.services.dedup._digest", wraps=dedup_module._digest) as digest:
+        found = _match_all(dedup, src)
+
+    assert found["vendor/copy.bin"] == Duplicate("a.bin", False)
+    assert found["z_link.bin"] == Duplicate("other.bin", True)
+    assert found["a.bin"] is found["other.bin"] is found["small2.txt"] is None
+    # Only files sharing a size are hashed: a.bin, other.bin and the copy; the hardlink is free.
+    assert digest.call_count == 3
+    assert (dedup.duplicates, dedup.duplicate_bytes, dedup.hashed_bytes) == (2, 16384, 3 * 8192)
+
+
+def test_unique_sizes_are_never_hashed(tmpdir):
+    tmpdir.join("a").write("a" * 5000)
+    tmpdir.join("b").write("b" * 6000)
+    dedup = Deduplicator()
+    assert not any(_match_all(dedup, tmpdir).values())
+    assert dedup.hashed_bytes == 0
+
+
+def test_discarded_files_are_not_matched(tmpdir):
+    tmpdir.join("a").write("x" * 5000)
+    tmpdir.join("b").write("x" * 5000)
+    tmpdir.join("c").write("x" * 5000)
+    dedup = Deduplicator()
+    entries = list(walk_tree(str(tmpdir)))
+    assert dedup.match(entries[0].path, "a", entries[0].stat) is None
+    dedup.discard("a")
+    assert dedup.match(entries[1].path, "b", entries[1].stat) is None
+    assert dedup.match(entries[2].path, "c", entries[2].stat) == Duplicate("b", False)
+
+
+def test_tar_stores_duplicates_as_links_and_restores_copies_separately(tmpdir):
+    src, content = _make_tree(tmpdir)
+    output = str(tmpdir.join("a.tar.gz"))
+    create_tar(walk_tree(str(src)), output, "gz", base_dir=str(src), read_ahead=0, dedup=Deduplicator())
+
+    with tarfile.open(output) as tar:
+        copy = tar.getmember("vendor/copy.bin")
+        link = tar.getmember("z_link.bin")
+    assert copy.islnk() and copy.linkname == "a.bin" and copy.pax_headers[COPY_PAX_KEY] == "1"
+    assert link.islnk() and link.linkname == "other.bin" and COPY_PAX_KEY not in link.pax_headers
+
+    restored = tmpdir.mkdir("restored")
+    restore_archive(output, str(restored))
+    assert restored.join("vendor", "copy.bin").read_binary() == content
+    assert not os.path.samefile(str(restored.join("vendor", "copy.bin")), str(restored.join("a.bin")))
+    assert os.path.samefile(str(restored.join("z_link.bin")), str(restored.join("other.bin")))
+
+
+@pytest.mark.parametrize("jobs", [1, 3])
+def test_zip_copies_the_payload_of_duplicates(tmpdir, jobs):
+    src, content = _make_tree(tmpdir)
+    output = str(tmpdir.join("a.zip"))
+    with patch("bakzip.services.zip_writer.compress_member", wraps=zip_writer.compress_member) as compress:
+        create_zip(walk_tree(str(src)), output, base_dir=str(src), compression="deflate", jobs=jobs,
+                   read_ahead=0, dedup=Deduplicator())
+
+    compressed = {call.args[1] for call in compress.call_args_list}
+    assert "vendor/copy.bin" not in compressed and "z_link.bin" not in compressed
+    with zipfile.ZipFile(output) as archive:
+        assert archive.testzip() is None
+        assert archive.read("vendor/copy.bin") == content
+        assert archive.read("z_link.bin") == src.join("other.bin").read_binary()
+        infos = {info.filename: info for info in archive.infolist()}
+    assert infos["vendor/copy.bin"].compress_size == infos["a.bin"].compress_size
+
+
+def test_tar_copies_keep_the_mode_of_normal_extraction(tmpdir):
+    src, _ = _make_tree(tmpdir)
+    # Normal extraction drops the execute bits the owner lacks, unlike masking with 0o755.
+    os.chmod(str(src.join("a.bin")), 0o454)
+    os.chmod(str(src.join("vendor", "copy.bin")), 0o454)
+    output = str(tmpdir.join("a.tar"))
+    create_tar(walk_tree(str(src)), output, None, base_dir=str(src), read_ahead=0, dedup=Deduplicator())
+
+    restored = tmpdir.mkdir("restored")
+    restore_archive(output, str(restored))
+    copy, original = str(restored.join("vendor", "copy.bin")), str(restored.join("a.bin"))
+    assert not os.path.samefile(copy, original)
+    assert os.stat(copy).st_mode == os.stat(original).st_mode
+    assert os.stat(copy).st_mtime == os.stat(original).st_mtime
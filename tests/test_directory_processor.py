@@ -1,4 +1,4 @@
-from bakzip.services.directory_processor import should_ignore, process_directory
+from bakzip.services.directory_processor import should_ignore, process_directory, iter_directory, ScanStats
 from unittest.mock import patch
 import os
 
@@ -77,3 +77,20 @@ def test_process_directory_no_size_when_not_verbose(tmpdir):
     assert total_skipped_size == 0
 
     assert not os.path.exists(str(log_file))
+
+def test_iter_directory_is_lazy_and_counts(tmpdir):
+    tmpdir.join("a.txt").write("a")
+    tmpdir.join("skip.txt").write("123")
+    tmpdir.mkdir("sub").join("b.txt").write("b")
+    stats = ScanStats()
+
+    with patch('bakzip.services.directory_processor.get_ignore_list', return_value=['skip.txt']):
+        scanner = iter_directory(str(tmpdir), str(tmpdir.join("bakzip.log")), stats=stats)
+        assert stats.included == 0
+        first = next(scanner)
+        assert stats.included == 1
+        rest = list(scanner)
+
+    assert sorted([first] + rest) == sorted([str(tmpdir.join("a.txt")), str(tmpdir.join("sub", "b.txt"))])
+    assert stats.included == 2
+    assert stats.skipped == 1
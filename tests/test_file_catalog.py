@@ -0,0 +1,89 @@
+import os
+import tarfile
+from unittest.mock import patch
+from bakzip.services.directory_processor import catalog_directory, process_directory
+from bakzip.services.file_catalog import FileCatalog
+from bakzip.services.tar_service import create_tar
+from bakzip.services.tree_walker import walk_tree
+
+STAT_FIELDS = ('st_mode', 'st_ino', 'st_dev', 'st_nlink', 'st_uid', 'st_gid', 'st_size', 'st_mtime_ns', 'st_mtime')
+
+
+def _tree(tmpdir):
+    src = tmpdir.mkdir("src")
+    src.join("a.txt").write("hello\n" * 100)
+    os.link(str(src.join("a.txt")), str(src.join("b.txt")))
+    os.symlink("a.txt", str(src.join("c.txt")))
+    sub = src.mkdir("sub")
+    sub.join("ü.txt").write("unicode")
+    # A name that is not valid UTF-8 round-trips through the catalog's bytes buffer.
+    with open(os.path.join(str(sub), os.fsdecode(b"raw\xff.bin")), "wb") as f:
+        f.write(b"\x00" * 10)
+    sub.mkdir("deep").join("d.txt").write("deep")
+    return src
+
+
+def test_catalog_matches_the_scanner_records(tmpdir):
+    src = _tree(tmpdir)
+    catalog, skipped, _ = catalog_directory(str(src), str(tmpdir.join("bakzip.log")))
+    entries = list(walk_tree(str(src)))
+
+    assert len(catalog) == len(entries) == 6 and len(skipped) == 0
+    assert catalog.dirs == ["", "sub", os.path.join("sub", "deep")]
+    for record, entry in zip(catalog, entries):
+        assert (record.path, record.rel_path, record.root) == (entry.path, entry.rel_path, entry.root)
+        assert [getattr(record.stat, f) for f in STAT_FIELDS] == [getattr(entry.stat, f) for f in STAT_FIELDS]
+    assert catalog[-1] == catalog[5]
+    assert str(src.join("sub", "ü.txt")) in catalog
+    assert str(src.join("sub", "a.txt")) not in catalog
+    assert catalog.total_size() == 600 + 600 + len("unicode") + 10 + 4
+
+
+def test_writers_take_arcnames_from_the_catalog(tmpdir):
+    src = _tree(tmpdir)
+    catalog = FileCatalog(str(src))
+    for entry in walk_tree(str(src)):
+        catalog.add(entry.rel_path, entry.stat)
+
+    with patch("bakzip.services.tar_service.tqdm", side_effect=lambda x, **kwargs: x):
+        create_tar(list(catalog.paths()), str(tmpdir.join("paths.tar")), None, base_dir=str(src), read_ahead=0)
+        with patch("os.path.relpath", side_effect=AssertionError("relpath computed again")), \
+                patch("os.lstat", side_effect=AssertionError("lstat'ed again")):
+            # The base directory defaults to the catalog's root.
+            create_tar(catalog, str(tmpdir.join("catalog.tar")), None, read_ahead=0)
+
+    assert tmpdir.join("catalog.tar").read_binary() == tmpdir.join("paths.tar").read_binary()
+    with tarfile.open(str(tmpdir.join("catalog.tar"))) as tar:
+        assert tar.getmember("b.txt").islnk()
+
+
+def test_catalog_is_compact(tmpdir):
+    src = tmpdir.mkdir("src")
+    for n in range(40):
+        sub = src.mkdir(f"dir{n:02d}")
+        for m in range(50):
+            sub.join(f"file{m:02d}.txt").write("x")
+    catalog, _, _ = catalog_directory(str(src), str(tmpdir.join("bakzip.log")))
+
+    assert len(catalog) == 2000 and len(catalog.dirs) == 40
+    # Columns and basenames only: no path strings or stat objects per file.
+    assert catalog.nbytes() < 100 * len(catalog)
+
+
+def test_process_directory_still_returns_paths(tmpdir):
+    src = _tree(tmpdir)
+    files, skipped, _ = process_directory(str(src), str(tmpdir.join("bakzip.log")))
+    catalog, _, _ = catalog_directory(str(src), str(tmpdir.join("bakzip.log")))
+
+    assert files == list(catalog.paths()) and skipped == []
+    assert all(isinstance(path, str) for path in files)
+
+
+def test_membership_sees_files_added_after_a_lookup(tmpdir):
+    catalog = FileCatalog(str(tmpdir))
+    catalog.add("a.txt", None)
+    assert str(tmpdir.join("a.txt")) in catalog
+    assert str(tmpdir.join("sub", "b.txt")) not in catalog
+    catalog.add(os.path.join("sub", "b.txt"), None)
+    assert str(tmpdir.join("sub", "b.txt")) in catalog
+    assert catalog[1] in catalog
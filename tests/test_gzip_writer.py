@@ -0,0 +1,61 @@
+import gzip
+import io
+import os
+import tarfile
+import zlib
+from unittest.mock import patch
+from bakzip.services.gzip_writer import ParallelGzipWriter
+from bakzip.services.tar_service import create_tar
+
+
+def _compress(data, **kwargs):
+    out = io.BytesIO()
+    with ParallelGzipWriter(out, **kwargs) as writer:
+        for i in range(0, len(data), 7000):
+            writer.write(data[i:i + 7000])
+    return out.getvalue()
+
+
+def test_parallel_gzip_roundtrip_is_single_member():
+    data = (b"abcdefgh" * 50000) + os.urandom(100000) + (b"xyz" * 30000)
+    compressed = _compress(data, jobs=4, block_size=64 * 1024)
+    assert gzip.decompress(compressed) == data
+    # A single gzip member: raw inflate consumes everything but the 8-byte trailer.
+    inflater = zlib.decompressobj(-zlib.MAX_WBITS)
+    assert inflater.decompress(compressed[10:]) == data
+    assert len(inflater.unused_data) == 8
+
+
+def test_parallel_gzip_empty_stream():
+    assert gzip.decompress(_compress(b"", jobs=2)) == b""
+
+
+def test_parallel_gzip_tell_counts_uncompressed_bytes():
+    writer = ParallelGzipWriter(io.BytesIO(), jobs=2, block_size=16)
+    writer.write(b"x" * 40)
+    assert writer.tell() == 40
+    writer.close()
+
+
+def test_create_tar_parallel_gzip(tmpdir):
+    files = []
+    for i in range(5):
+        f = tmpdir.join(f"file_{i}.txt")
+        f.write(f"content {i}\n" * 20000)
+        files.append(str(f))
+    output = str(tmpdir.join("out.tar.gz"))
+
+    with patch("bakzip.services.tar_service.tqdm", side_effect=lambda x, **kwargs: x):
+        create_tar(files, output, 'gz', base_dir=str(tmpdir), jobs=4)
+
+    with tarfile.open(output, "r:gz") as tar:
+        assert tar.getnames() == [f"file_{i}.txt" for i in range(5)]
+        assert tar.extractfile("file_3.txt").read() == b"content 3\n" * 20000
+
+
+def test_parallel_gzip_adaptive_stores_random_blocks():
+    data = os.urandom(200000) + b"text " * 40000
+    adaptive = _compress(data, jobs=2, block_size=50000, adaptive=True)
+    assert gzip.decompress(adaptive) == data
+    # Stored blocks add only a few bytes per block over the raw data.
+    assert len(adaptive) < 200000 + 30000
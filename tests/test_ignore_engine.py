@@ -0,0 +1,69 @@
+from bakzip.services.directory_processor import iter_directory
+from bakzip.services.ignore_engine import IgnoreMatcher, IgnoreRules, glob_to_regex
+
+
+def test_basename_literal_and_extension_match_at_any_depth():
+    matcher = IgnoreMatcher(["node_modules", "*.log", "*.tar.gz"])
+    assert matcher("node_modules", True)
+    assert matcher("web/node_modules", True)
+    assert matcher("deep/dir/app.log", False)
+    assert matcher("dist/release.tar.gz", False)
+    assert not matcher("app.logs", False)
+    assert not matcher("src/main.py", False)
+
+
+def test_directory_only_and_anchored_patterns():
+    matcher = IgnoreMatcher(["build/", "/config.ini", "docs/*.tmp"])
+    assert matcher("build", True)
+    assert matcher("pkg/build", True)
+    assert not matcher("build", False)
+    assert matcher("config.ini", False)
+    assert not matcher("sub/config.ini", False)
+    assert matcher("docs/a.tmp", False)
+    assert not matcher("other/docs/a.tmp", False)
+    assert not matcher("docs/sub/a.tmp", False)
+
+
+def test_double_star_patterns():
+    matcher = IgnoreMatcher(["**/cache", "logs/**", "a/**/z.txt"])
+    assert matcher("x/y/cache", True)
+    assert matcher("logs/2024/app.txt", False)
+    assert not matcher("logs", True)
+    assert matcher("a/z.txt", False)
+    assert matcher("a/b/c/z.txt", False)
+
+
+def test_negation_last_match_wins():
+    matcher = IgnoreMatcher(["*.log", "!keep.log", "temp_*"])
+    assert matcher("debug.log", False)
+    assert not matcher("keep.log", False)
+    assert matcher("data/temp_file.txt", False)
+    assert IgnoreMatcher(["!keep.log", "*.log"])("keep.log", False)
+
+
+def test_rules_report_deciding_pattern():
+    rules = IgnoreRules(["*.log", "secret[0-9].txt"])
+    assert rules.last_match("secret7.txt", False).pattern == "secret[0-9].txt"
+    assert rules.last_match("secretX.txt", False) is None
+
+
+def test_glob_to_regex_does_not_cross_directories():
+    assert glob_to_regex("*.py") == "[^/]*\\.py"
+    assert glob_to_regex("[!a]?") == "[^a][^/]"
+
+
+def test_nested_ignore_files_apply_to_their_subtree(tmpdir):
+    tmpdir.join(".bakzipignore").write("*.tmp\n")
+    tmpdir.join("a.tmp").write("x")
+    tmpdir.join("a.cache").write("x")
+    sub = tmpdir.mkdir("sub")
+    sub.join(".bakzipignore").write("*.cache\n!keep.tmp\n/only_here.txt\n")
+    sub.join("b.cache").write("x")
+    sub.join("keep.tmp").write("x")
+    sub.join("drop.tmp").write("x")
+    sub.join("only_here.txt").write("x")
+    sub.mkdir("deeper").join("only_here.txt").write("x")
+
+    included = sorted(p[len(str(tmpdir)) + 1:] for p in iter_directory(str(tmpdir), str(tmpdir.join("x.log"))))
+    assert included == sorted([".bakzipignore", "a.cache", "sub/.bakzipignore", "sub/keep.tmp",
+                               "sub/deeper/only_here.txt"])
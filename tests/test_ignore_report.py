@@ -0,0 +1,66 @@
+import os
+from bakzip.services.directory_processor import iter_directory
+from bakzip.services.ignore_report import IgnoreReport, disk_usage
+
+
+def _make_tree(tmpdir):
+    tmpdir.join(".bakzipignore").write("*.log\nnode_modules/\n!keep.log\n")
+    tmpdir.join("a.txt").write("a" * 10)
+    tmpdir.join("debug.log").write("d" * 100)
+    tmpdir.join("keep.log").write("k" * 7)
+    modules = tmpdir.mkdir("web").mkdir("node_modules")
+    modules.join("index.js").write("i" * 1000)
+    modules.mkdir("pkg").join("lib.js").write("l" * 500)
+    sub = tmpdir.mkdir("sub")
+    sub.join(".bakzipignore").write("*.tmp\n")
+    sub.join("x.tmp").write("x" * 20)
+
+
+def _scan(tmpdir, du):
+    report = IgnoreReport(du=du)
+    files = list(iter_directory(str(tmpdir), str(tmpdir.join("bakzip.log")), report=report))
+    report.close()
+    return files, {(stats.pattern, stats.ignore_file): stats for stats in report.rows()}
+
+
+def test_report_attributes_files_bytes_and_pruned_directories(tmpdir):
+    _make_tree(tmpdir)
+    files, rows = _scan(tmpdir, du=True)
+    assert str(tmpdir.join("keep.log")) in files
+
+    log = rows[("*.log", ".bakzipignore")]
+    assert (log.files, log.bytes, log.dirs, log.excludes) == (1, 100, 0, True)
+    modules = rows[("node_modules/", ".bakzipignore")]
+    assert (modules.files, modules.bytes, modules.dirs) == (2, 1500, 1)
+    kept = rows[("!keep.log", ".bakzipignore")]
+    assert (kept.files, kept.bytes, kept.excludes) == (1, 7, False)
+    nested = rows[("*.tmp", "sub/.bakzipignore")]
+    assert (nested.files, nested.bytes) == (1, 20)
+    # Every listed file is attributed exactly once; the rest decided no rule.
+    unmatched = rows[("(no rule)", "")]
+    assert unmatched.files == len(files) - 1
+    assert all(stats.paths and stats.seconds >= 0 for stats in rows.values())
+
+
+def test_report_without_du_counts_pruned_directories_only(tmpdir):
+    _make_tree(tmpdir)
+    report = IgnoreReport()
+    list(iter_directory(str(tmpdir), str(tmpdir.join("bakzip.log")), report=report))
+    report.close()
+    modules = next(stats for stats in report.rows() if stats.pattern == "node_modules/")
+    assert (modules.files, modules.bytes, modules.dirs) == (0, 0, 1)
+
+    lines = report.lines()
+    assert lines[0].split()[:3] == ["Pattern", "Ignore", "file"]
+    assert lines[-2].startswith("Excluded") and lines[-2].split()[1:4] == ["2", "120", "1"]
+    assert "--ignore-report du" in lines[-1]
+
+
+def test_disk_usage_counts_files_without_following_symlinks(tmpdir):
+    tree = tmpdir.mkdir("tree")
+    tree.join("a").write("a" * 3)
+    tree.mkdir("b").join("c").write("c" * 4)
+    os.symlink(str(tmpdir), str(tree.join("loop")))
+    files, size = disk_usage(str(tree))
+    assert files == 3
+    assert size == 7 + os.lstat(str(tree.join("loop"))).st_size
@@ -0,0 +1,126 @@
+import json
+import threading
+import time
+import pytest
+from bakzip.services.job_scheduler import Job, load_job_file, run_jobs
+from bakzip.utilities.command_line_options import parse_job_options
+
+
+def _job(tmpdir, name, size, jobs=1, devices=(1,)):
+    directory = tmpdir.mkdir(name)
+    directory.join("data").write("x" * size)
+    job = Job(name, parse_job_options({"directory": str(directory), "output": str(tmpdir.join(name)),
+                                       "jobs": jobs}))
+    job.devices = devices
+    return job
+
+
+class _Tracker:
+    """Records the order jobs start in and the peak CPU slots and jobs per device in use."""
+
+    def __init__(self, cpu_limit):
+        self.cpu_limit = cpu_limit
+        self.lock = threading.Lock()
+        self.started = []
+        self.cpu = 0
+        self.peak_cpu = 0
+        self.devices = {}
+        self.peak_device = 0
+
+    def __call__(self, job):
+        with self.lock:
+            self.started.append(job.name)
+            self.cpu += job.cpu_slots(self.cpu_limit)
+            self.peak_cpu = max(self.peak_cpu, self.cpu)
+            for device in job.devices:
+                self.devices[device] = self.devices.get(device, 0) + 1
+                self.peak_device = max(self.peak_device, self.devices[device])
+        time.sleep(0.05)
+        with self.lock:
+            self.cpu -= job.cpu_slots(self.cpu_limit)
+            for device in job.devices:
+                self.devices[device] -= 1
+        print(f"ran {job.name}")
+        return job.name
+
+
+def test_load_job_file_applies_defaults(tmpdir):
+    path = tmpdir.join("jobs.json")
+    path.write(json.dumps({
+        "cpu_limit": 4,
+        "defaults": {"format": "tar", "compression": "zstd"},
+        "jobs": [{"directory": "/srv/www"}, {"name": "db", "directory": "/srv/db", "format": "zip"}],
+    }))
+    jobs, cpu_limit, io_limit = load_job_file(str(path))
+    assert jobs == [("www", {"format": "tar", "compression": "zstd", "directory": "/srv/www"}),
+                    ("db", {"format": "zip", "compression": "zstd", "directory": "/srv/db"})]
+    assert (cpu_limit, io_limit) == (4, 1)
+
+
+def test_load_job_file_reads_toml(tmpdir):
+    pytest.importorskip("tomllib")
+    path = tmpdir.join("jobs.toml")
+    path.write('io_limit = 2\n\n[[jobs]]\nname = "etc"\ndirectory = "/etc"\nadaptive = true\n')
+    jobs, _, io_limit = load_job_file(str(path))
+    assert jobs == [("etc", {"directory": "/etc", "adaptive": True})]
+    assert io_limit == 2
+
+
+@pytest.mark.parametrize("config, message", [
+    ({"jobs": []}, "lists no jobs"),
+    ({"jobs": [{"output": "x"}]}, "has no directory"),
+    ({"jobs": [{"directory": "a"}, {"directory": "b/a"}]}, "Duplicate job name"),
+    ({"jobs": [{"directory": "a"}], "limit": 1}, "Unknown job file keys"),
+])
+def test_load_job_file_rejects_malformed_files(tmpdir, config, message):
+    path = tmpdir.join("jobs.json")
+    path.write(json.dumps(config))
+    with pytest.raises(ValueError, match=message):
+        load_job_file(str(path))
+
+
+def test_parse_job_options_validates_like_the_command_line():
+    args = parse_job_options({"directory": "/data", "read-ahead": 0, "adaptive": True, "level": None})
+    assert (args.directory, args.read_ahead, args.adaptive, args.level) == ("/data", 0, True, None)
+    with pytest.raises(ValueError, match="invalid choice"):
+        parse_job_options({"directory": "/data", "format": "rar"})
+    with pytest.raises(ValueError, match="Unknown job option"):
+        parse_job_options({"directory": "/data", "password": True})
+
+
+def test_run_jobs_starts_biggest_first_within_cpu_limit(tmpdir):
+    jobs = [_job(tmpdir, "small", 10, devices=(1,)), _job(tmpdir, "big", 1000, jobs=2, devices=(2,)),
+            _job(tmpdir, "medium", 100, devices=(3,))]
+    tracker = _Tracker(cpu_limit=2)
+    finished = run_jobs(jobs, tracker, cpu_limit=2)
+
+    # The big job takes both CPU slots, so the others wait for it.
+    assert tracker.started[0] == "big"
+    assert tracker.peak_cpu == 2
+    assert sorted(job.result for job in finished) == ["big", "medium", "small"]
+    assert all(job.log == f"ran {job.name}\n" for job in finished)
+
+
+def test_run_jobs_limits_jobs_per_device(tmpdir):
+    jobs = [_job(tmpdir, f"job{n}", n, devices=(1, 2) if n % 2 else (1,)) for n in range(1, 6)]
+    jobs.append(_job(tmpdir, "other", 0, devices=(3,)))
+    tracker = _Tracker(cpu_limit=8)
+    run_jobs(jobs, tracker, cpu_limit=8, io_limit=2)
+
+    assert tracker.peak_device == 2
+    # The smallest job starts with the two biggest, as its device is free.
+    assert set(tracker.started[:3]) == {"job5", "job4", "other"}
+
+
+def test_run_jobs_records_failures(tmpdir):
+    jobs = [_job(tmpdir, "good", 1), _job(tmpdir, "bad", 2)]
+
+    def run(job):
+        if job.name == "bad":
+            raise RuntimeError("disk full")
+        return job.name
+
+    finished = run_jobs(jobs, run, cpu_limit=2, on_finish=lambda job: print(f"finished {job.name}"))
+    errors = {job.name: job.error for job in finished}
+    assert errors["good"] is None
+    assert str(errors["bad"]) == "disk full"
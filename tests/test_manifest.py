@@ -0,0 +1,65 @@
+import os
+from bakzip.services.manifest import ManifestBuilder, archive_name, load_manifest, manifest_path
+
+
+def _backup(src, output, previous=None, use_hash=False):
+    files = sorted(str(p) for p in src.visit() if p.check(file=1))
+    builder = ManifestBuilder(str(src), output, previous, use_hash=use_hash)
+    selected = list(builder.filter(files))
+    builder.close()
+    return builder, selected
+
+
+def test_full_manifest_records_every_file(tmpdir):
+    src = tmpdir.mkdir("src")
+    src.join("a.txt").write("a")
+    src.mkdir("sub").join("b.txt").write("bb")
+    output = str(tmpdir.join("full.zip"))
+
+    builder, selected = _backup(src, output)
+
+    assert len(selected) == 2
+    header, files, deleted = load_manifest(output)
+    assert header["kind"] == "full"
+    assert files["sub/b.txt"][0] == 2
+    assert deleted == []
+    assert os.path.exists(manifest_path(output))
+
+
+def test_incremental_selects_changed_and_records_deleted(tmpdir):
+    src = tmpdir.mkdir("src")
+    src.join("same.txt").write("same")
+    src.join("edit.txt").write("old")
+    src.join("gone.txt").write("bye")
+    full = str(tmpdir.join("full.tar"))
+    _backup(src, full)
+
+    src.join("edit.txt").write("new content")
+    src.join("gone.txt").remove()
+    src.join("new.txt").write("hello")
+    builder, selected = _backup(src, str(tmpdir.join("inc.tar")), load_manifest(full)[1])
+
+    assert sorted(os.path.basename(p) for p in selected) == ["edit.txt", "new.txt"]
+    assert builder.deleted == ["gone.txt"]
+    header, files, deleted = load_manifest(str(tmpdir.join("inc.tar")))
+    assert header["kind"] == "incremental"
+    assert set(files) == {"same.txt", "edit.txt", "new.txt"}
+    assert deleted == ["gone.txt"]
+
+
+def test_hash_ignores_metadata_only_changes(tmpdir):
+    src = tmpdir.mkdir("src")
+    src.join("touched.txt").write("unchanged")
+    full = str(tmpdir.join("full.zip"))
+    _backup(src, full, use_hash=True)
+
+    st = os.stat(str(src.join("touched.txt")))
+    os.utime(str(src.join("touched.txt")), ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+    _, selected = _backup(src, str(tmpdir.join("inc.zip")), load_manifest(full)[1], use_hash=True)
+
+    assert selected == []
+
+
+def test_archive_name_strips_manifest_suffix():
+    assert archive_name("/backups/full.zip.manifest.json") == "full.zip"
+    assert archive_name("/backups/full.zip") == "full.zip"
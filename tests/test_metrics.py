@@ -0,0 +1,60 @@
+import json
+from unittest.mock import patch
+from bakzip.services.directory_processor import iter_directory
+from bakzip.services.zip_service import create_zip
+from bakzip.utilities.metrics import Metrics, run_profiled
+
+
+def test_report_keeps_the_slowest_files():
+    metrics = Metrics(slowest=2)
+    metrics.record_file("a", 0.5, 100, 50)
+    metrics.record_file("b", 2.0, 300, 100)
+    metrics.record_file("c", 1.0, 600, 150)
+    with metrics.phase("compress"):
+        pass
+    metrics.finish()
+
+    report = metrics.report()
+    assert [item["path"] for item in report["slowest_files"]] == ["b", "c"]
+    assert (report["files"], report["bytes_in"], report["bytes_out"]) == (3, 1000, 300)
+    assert report["compression_ratio"] == 0.3
+    assert report["phases"]["compress"]["count"] == 1
+
+
+def test_prometheus_and_json_output(tmpdir):
+    metrics = Metrics()
+    metrics.add_time("scan", 0.25)
+    metrics.record_file("a", 0.1, 10, 5)
+
+    metrics.write(str(tmpdir.join("m.prom")), "prometheus")
+    metrics.write(str(tmpdir.join("m.json")))
+
+    text = tmpdir.join("m.prom").read()
+    assert 'bakzip_phase_seconds{phase="scan"} 0.25' in text
+    assert "# TYPE bakzip_files gauge" in text
+    assert json.loads(tmpdir.join("m.json").read())["files"] == 1
+    assert not tmpdir.join("m.json.tmp").exists()
+
+
+def test_scan_and_zip_phases_are_recorded(tmpdir):
+    src = tmpdir.mkdir("src")
+    src.join("a.txt").write("hello " * 1000)
+    src.join("skip.log").write("ignored")
+    src.join(".bakzipignore").write("*.log\n")
+    metrics = Metrics()
+
+    files = list(iter_directory(str(src), str(tmpdir.join("log")), metrics=metrics))
+    with patch("bakzip.services.zip_service.tqdm", side_effect=lambda x, **kwargs: x):
+        create_zip(files, str(tmpdir.join("out.zip")), None, 'normal', base_dir=str(src), jobs=2, metrics=metrics)
+
+    phases = metrics.report()["phases"]
+    assert {"scan", "ignore", "read", "compress", "write"} <= set(phases)
+    assert phases["ignore"]["count"] == 3
+    assert metrics.files == 2
+    assert metrics.bytes_in == 6000 + len("*.log\n")
+
+
+def test_run_profiled_dumps_stats(tmpdir):
+    path = str(tmpdir.join("run.prof"))
+    assert run_profiled(sum, path, [1, 2, 3]) == 6
+    assert tmpdir.join("run.prof").size() > 0
@@ -0,0 +1,34 @@
+import threading
+import pytest
+from bakzip.services.pipeline import bounded_prefetch
+
+
+def test_bounded_prefetch_preserves_order():
+    assert list(bounded_prefetch(iter(range(1000)), maxsize=8)) == list(range(1000))
+
+
+def test_bounded_prefetch_propagates_errors():
+    def producer():
+        yield 1
+        raise OSError("scan failed")
+
+    items = bounded_prefetch(producer())
+    assert next(items) == 1
+    with pytest.raises(OSError, match="scan failed"):
+        next(items)
+
+
+def test_bounded_prefetch_limits_buffered_items():
+    produced = []
+
+    def producer():
+        for i in range(100):
+            produced.append(i)
+            yield i
+
+    with bounded_prefetch(producer(), maxsize=4) as items:
+        assert next(items) == 0
+        threading.Event().wait(0.2)
+        # The consumer took one item, the queue holds at most 4 and one more may be pending.
+        assert len(produced) <= 6
+    assert len(produced) < 100
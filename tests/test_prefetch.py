@@ -0,0 +1,81 @@
+import os
+import tarfile
+from unittest.mock import patch
+from bakzip.services import prefetch
+from bakzip.services.prefetch import read_ahead, read_file
+from bakzip.services.tar_service import create_tar
+
+
+def _make_files(tmpdir, sizes):
+    paths = []
+    for i, size in enumerate(sizes):
+        path = tmpdir.join(f"f{i}.bin")
+        path.write_binary(os.urandom(size))
+        paths.append(str(path))
+    return paths
+
+
+def test_items_keep_their_order_and_content(tmpdir):
+    paths = _make_files(tmpdir, [10, 0, 5000, 300, 70000])
+    items = [(path, i) for i, path in enumerate(paths)]
+
+    result = list(read_ahead(items, key=lambda item: item[0], max_bytes=1024 * 1024, threads=3))
+
+    assert [p.item for p in result] == items
+    for p in result:
+        with open(p.item[0], 'rb') as f:
+            assert bytes(p.data) == f.read()
+
+
+def test_large_and_missing_files_are_not_read(tmpdir):
+    paths = _make_files(tmpdir, [100, 5000])
+    paths.append(str(tmpdir.join("missing")))
+
+    result = list(read_ahead(paths, max_bytes=8000))
+
+    # 5000 bytes is over a quarter of the budget, so it is only hinted to the kernel.
+    assert [p.data is not None for p in result] == [True, False, False]
+
+
+def test_bytes_in_flight_stay_within_the_budget(tmpdir):
+    paths = _make_files(tmpdir, [1000] * 20)
+    in_flight = []
+    original = prefetch._load
+
+    def tracking_load(path, size, metrics):
+        in_flight.append(path)
+        return original(path, size, metrics)
+
+    with patch("bakzip.services.prefetch._load", side_effect=tracking_load):
+        for i, item in enumerate(read_ahead(paths, max_bytes=4000, threads=2)):
+            # Files read so far minus files consumed never exceeds the budget.
+            assert (len(in_flight) - i) * 1000 <= 4000
+
+    assert len(in_flight) == 20
+
+
+def test_zero_budget_passes_items_through(tmpdir):
+    paths = _make_files(tmpdir, [10, 20])
+    assert [tuple(p) for p in read_ahead(paths, max_bytes=0)] == [(paths[0], None), (paths[1], None)]
+
+
+def test_read_file_handles_a_changed_size(tmpdir):
+    path = tmpdir.join("f")
+    path.write_binary(b"abcdef")
+    assert bytes(read_file(str(path), 3)) == b"abcdef"
+    assert bytes(read_file(str(path), 10)) == b"abcdef"
+
+
+def test_create_tar_with_read_ahead_keeps_hardlinks(tmpdir):
+    src = tmpdir.mkdir("src")
+    src.join("a.txt").write("hello\n" * 100)
+    os.link(str(src.join("a.txt")), str(src.join("b.txt")))
+    output = str(tmpdir.join("out.tar"))
+
+    with patch("bakzip.services.tar_service.tqdm", side_effect=lambda x, **kwargs: x):
+        create_tar([str(src.join("a.txt")), str(src.join("b.txt"))], output, None, base_dir=str(src))
+
+    with tarfile.open(output) as tar:
+        a, b = tar.getmembers()
+        assert a.isreg() and tar.extractfile(a).read() == b"hello\n" * 100
+        assert b.islnk() and b.linkname == "a.txt"
@@ -0,0 +1,45 @@
+import os
+import pytest
+from unittest.mock import patch
+from bakzip.services import prefetch
+from bakzip.services.prefetch import read_ahead
+from bakzip.services.read_order import extent_key, get_order_key, inode_key, physical_offset
+
+
+def test_get_order_key():
+    assert get_order_key('none') is None
+    assert get_order_key('inode') is inode_key
+    assert get_order_key('extent') is extent_key
+    with pytest.raises(ValueError):
+        get_order_key('random')
+
+
+def test_physical_offset_is_an_offset_or_unknown(tmpdir):
+    path = tmpdir.join("data.bin")
+    path.write_binary(os.urandom(8192))
+    offset = physical_offset(str(path))
+    assert offset is None or offset >= 0
+    assert physical_offset(str(tmpdir.join("missing"))) is None
+
+
+def test_reads_follow_inode_order_but_items_keep_input_order(tmpdir):
+    paths = []
+    for i in range(6):
+        path = tmpdir.join(f"f{i}")
+        path.write(f"content {i}")
+        paths.append(str(path))
+    # Hand the files over in reverse inode order.
+    paths.sort(key=lambda p: os.stat(p).st_ino, reverse=True)
+    read_calls = []
+    original = prefetch._load
+
+    def tracking_load(path, size, metrics):
+        read_calls.append(path)
+        return original(path, size, metrics)
+
+    with patch("bakzip.services.prefetch._load", side_effect=tracking_load):
+        result = list(read_ahead(paths, threads=1, order='inode'))
+
+    assert read_calls == sorted(paths, key=lambda p: os.stat(p).st_ino)
+    assert [p.item for p in result] == paths
+    assert [bytes(p.data) for p in result] == [open(p, 'rb').read() for p in paths]
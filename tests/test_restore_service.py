@@ -0,0 +1,105 @@
+import os
+import tarfile
+import pytest
+from bakzip.services.manifest import ManifestBuilder, load_manifest
+from bakzip.services.restore_service import restore_chain
+
+
+def _tar_backup(src, output, previous=None, base=None):
+    files = sorted(str(p) for p in src.visit() if p.check(file=1))
+    builder = ManifestBuilder(str(src), output, previous, base)
+    with tarfile.open(output, "w") as tar:
+        for path in builder.filter(files):
+            tar.add(path, arcname=os.path.relpath(path, str(src)))
+    builder.close()
+
+
+def test_restore_chain_replays_incrementals(tmpdir):
+    src = tmpdir.mkdir("src")
+    src.join("keep.txt").write("keep")
+    src.join("edit.txt").write("v1")
+    src.join("gone.txt").write("bye")
+    full = str(tmpdir.join("full.tar"))
+    _tar_backup(src, full)
+
+    src.join("edit.txt").write("v2")
+    src.join("gone.txt").remove()
+    inc = str(tmpdir.join("inc.tar"))
+    _tar_backup(src, inc, load_manifest(full)[1], "full.tar")
+
+    dest = tmpdir.join("restored")
+    restore_chain([full, inc], str(dest))
+
+    assert dest.join("keep.txt").read() == "keep"
+    assert dest.join("edit.txt").read() == "v2"
+    assert not dest.join("gone.txt").exists()
+
+
+def test_restore_chain_requires_archives(tmpdir):
+    with pytest.raises(ValueError):
+        restore_chain([], str(tmpdir))
+
+
+def test_restore_encrypted_tar(tmpdir):
+    pytest.importorskip("Cryptodome")
+    from unittest.mock import patch
+    from bakzip.services.tar_service import create_tar
+    src = tmpdir.mkdir("src")
+    src.join("a.txt").write("secret data" * 1000)
+    src.mkdir("sub").join("b.txt").write("more")
+    output = str(tmpdir.join("backup.tar.gz.enc"))
+    with patch("bakzip.services.tar_service.tqdm", side_effect=lambda x, **kwargs: x):
+        create_tar(sorted(str(p) for p in src.visit() if p.check(file=1)), output, 'gz', base_dir=str(src),
+                   jobs=2, password="pw")
+
+    with pytest.raises(ValueError, match="is encrypted"):
+        restore_chain([output], str(tmpdir.join("nopass")))
+    dest = tmpdir.join("restored")
+    restore_chain([output], str(dest), password="pw")
+    assert dest.join("a.txt").read() == "secret data" * 1000
+    assert dest.join("sub", "b.txt").read() == "more"
+
+
+@pytest.mark.parametrize("codec, module", [("zstd", "zstandard"), ("lz4", "lz4")])
+@pytest.mark.parametrize("password", [None, "pw"])
+def test_restore_zstd_and_lz4_tar(tmpdir, codec, module, password):
+    pytest.importorskip(module)
+    if password:
+        pytest.importorskip("Cryptodome")
+    from unittest.mock import patch
+    from bakzip.services.tar_service import create_tar
+    src = tmpdir.mkdir("src")
+    src.join("a.txt").write("data " * 5000)
+    src.mkdir("sub").join("b.txt").write("more")
+    output = str(tmpdir.join("backup.tar"))
+    with patch("bakzip.services.tar_service.tqdm", side_effect=lambda x, **kwargs: x):
+        create_tar(sorted(str(p) for p in src.visit() if p.check(file=1)), output, codec, base_dir=str(src),
+                   jobs=2, password=password)
+
+    dest = tmpdir.join("restored")
+    restore_chain([output], str(dest), password=password)
+    assert dest.join("a.txt").read() == "data " * 5000
+    assert dest.join("sub", "b.txt").read() == "more"
+
+
+@pytest.mark.parametrize("data_filter", [True, False])
+def test_restore_keeps_in_tree_symlinks(tmpdir, monkeypatch, capsys, data_filter):
+    if not data_filter:
+        monkeypatch.delattr(tarfile, "data_filter", raising=False)
+    src = tmpdir.mkdir("src")
+    src.mkdir("a").join("new.txt").write("new")
+    os.symlink(os.path.join("a", "new.txt"), str(src.join("link")))
+    os.symlink(os.path.join("..", "..", "outside.txt"), str(src.join("a", "escape")))
+    output = str(tmpdir.join("links.tar"))
+    with tarfile.open(output, "w") as tar:
+        tar.add(str(src), arcname="")
+
+    dest = tmpdir.join("restored")
+    restore_chain([output], str(dest))
+
+    assert os.readlink(str(dest.join("link"))) == os.path.join("a", "new.txt")
+    assert dest.join("link").read() == "new"
+    assert not os.path.lexists(str(dest.join("a", "escape")))
+    out = capsys.readouterr().out
+    assert "Skipping link" not in out
+    assert "Security Warning: Skipping a/escape" in out
@@ -1,8 +1,9 @@
 import os
 import stat
 import pytest
-from unittest.mock import patch, MagicMock
+from unittest.mock import patch
 from bakzip.main import main
+from bakzip.utilities.command_line_options import parse_arguments
 
 def test_archive_permissions(tmp_path):
     """
@@ -15,21 +16,15 @@ def test_archive_permissions(tmp_path):
 
     output_tar = tmp_path / "backup.tar"
 
-    # Mock arguments for the main function
-    class MockArgs:
-        directory = str(test_dir)
-        output = str(output_tar).replace(".tar", "") # main adds .tar
-        format = 'tar'
-        compression = None
-        encryption = 'none'
-        verbose = False
-        password = None
+    # main adds .tar
+    args = parse_arguments(['-d', str(test_dir), '-o', str(output_tar).replace(".tar", ""), '-f', 'tar',
+                            '--checkpoint-interval', '0'])
 
     # We need to ensure output_tar includes the extension as main() would add it
     final_output = str(output_tar)
 
-    with patch("bakzip.main.parse_arguments", return_value=MockArgs()), \
-         patch("bakzip.main.pyfiglet.figlet_format", return_value="BakZIP"):
+    with patch("bakzip.main.parse_arguments", return_value=args), \
+         patch("pyfiglet.figlet_format", return_value="BakZIP"):
         main()
 
     assert os.path.exists(final_output)
@@ -47,17 +42,11 @@ def test_log_file_permissions(tmp_path):
     output_tar = tmp_path / "backup.tar"
     log_file = tmp_path / "bakzip.log"
 
-    class MockArgs:
-        directory = str(test_dir)
-        output = str(output_tar).replace(".tar", "")
-        format = 'tar'
-        compression = None
-        encryption = 'none'
-        verbose = True
-        password = None
+    args = parse_arguments(['-d', str(test_dir), '-o', str(output_tar).replace(".tar", ""), '-f', 'tar', '-v',
+                            '--checkpoint-interval', '0'])
 
-    with patch("bakzip.main.parse_arguments", return_value=MockArgs()), \
-         patch("bakzip.main.pyfiglet.figlet_format", return_value="BakZIP"):
+    with patch("bakzip.main.parse_arguments", return_value=args), \
+         patch("pyfiglet.figlet_format", return_value="BakZIP"):
         main()
 
     assert os.path.exists(log_file)
@@ -0,0 +1,97 @@
+import io
+import os
+import pytest
+from unittest.mock import patch
+from bakzip.services.stream_cipher import HEADER, MAX_CHUNK_SIZE, TAG_SIZE, DecryptingReader, EncryptingWriter
+
+pytest.importorskip("Cryptodome")
+
+CHUNK = 4096
+
+
+def _encrypt(data, password="secret", jobs=1):
+    buffer = io.BytesIO()
+    with EncryptingWriter(buffer, password, jobs=jobs, chunk_size=CHUNK) as writer:
+        for start in range(0, len(data), 1000):
+            writer.write(data[start:start + 1000])
+    return buffer.getvalue()
+
+
+class _Pipe(io.RawIOBase):
+    """A non-seekable stream returning short reads."""
+
+    def __init__(self, data):
+        self.data = io.BytesIO(data)
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        return self.data.read(min(size, 1000) if size and size > 0 else size)
+
+
+@pytest.mark.parametrize("size", [0, 1, CHUNK, 3 * CHUNK, 3 * CHUNK + 5])
+@pytest.mark.parametrize("jobs", [1, 3])
+def test_round_trip(size, jobs):
+    data = os.urandom(size)
+    encrypted = _encrypt(data, jobs=jobs)
+    assert len(encrypted) == HEADER.size + size + TAG_SIZE * max(1, -(-size // CHUNK))
+    assert DecryptingReader(io.BytesIO(encrypted), "secret").read() == data
+    assert DecryptingReader(_Pipe(encrypted), "secret").read() == data
+
+
+def test_seek_decrypts_only_the_target_chunk():
+    data = os.urandom(5 * CHUNK + 100)
+    reader = DecryptingReader(io.BytesIO(_encrypt(data)), "secret")
+    for offset, size in [(3 * CHUNK + 10, 50), (CHUNK - 5, 10), (5 * CHUNK + 90, 100), (0, 1)]:
+        assert reader.seek(offset) == offset
+        assert reader.read(size) == data[offset:offset + size]
+        assert reader.tell() == min(offset + size, len(data))
+    assert reader.seek(-10, os.SEEK_END) == len(data) - 10
+    assert reader.read() == data[-10:]
+
+
+def test_wrong_password_and_tampering_are_detected():
+    data = os.urandom(3 * CHUNK)
+    encrypted = _encrypt(data)
+    with pytest.raises(ValueError, match="password is wrong"):
+        DecryptingReader(io.BytesIO(encrypted), "wrong").read()
+
+    tampered = bytearray(encrypted)
+    tampered[HEADER.size + CHUNK + 20] ^= 1
+    with pytest.raises(ValueError, match="corrupt"):
+        DecryptingReader(io.BytesIO(bytes(tampered)), "secret").read()
+
+
+def test_truncation_at_a_chunk_boundary_is_detected():
+    encrypted = _encrypt(os.urandom(3 * CHUNK))
+    truncated = encrypted[:HEADER.size + 2 * (CHUNK + TAG_SIZE)]
+    with pytest.raises(ValueError, match="corrupt"):
+        DecryptingReader(io.BytesIO(truncated), "secret").read()
+
+
+def test_rejects_plain_streams():
+    with pytest.raises(ValueError, match="Not an encrypted"):
+        DecryptingReader(io.BytesIO(b"\x1f\x8b" + bytes(100)), "secret")
+
+
+@pytest.mark.parametrize("offset, value", [(9, 30), (10, 255), (11, 64), (10, 0)])
+def test_rejects_costly_scrypt_parameters_before_deriving_the_key(offset, value):
+    header = bytearray(_encrypt(b"data"))
+    # log2 N, r and p follow the magic and the algorithm byte.
+    header[offset] = value
+    with patch("bakzip.services.stream_cipher.derive_key", side_effect=AssertionError("key derived")), \
+            pytest.raises(ValueError, match="Unsupported encryption parameters"):
+        DecryptingReader(io.BytesIO(bytes(header)), "secret")
+
+
+@pytest.mark.parametrize("chunk_size", [0, MAX_CHUNK_SIZE + 1, 2 ** 32 - 1])
+def test_rejects_unbounded_chunk_sizes_from_the_header(chunk_size):
+    header = bytearray(_encrypt(b"data"))
+    # The chunk size follows the scrypt parameters.
+    header[12:16] = chunk_size.to_bytes(4, "big")
+    with patch("bakzip.services.stream_cipher.derive_key", side_effect=AssertionError("key derived")), \
+            pytest.raises(ValueError, match="Unsupported encryption parameters"):
+        DecryptingReader(io.BytesIO(bytes(header)), "secret")
+    with pytest.raises(ValueError, match="chunk size"):
+        EncryptingWriter(io.BytesIO(), "secret", chunk_size=chunk_size)
@@ -1,8 +1,10 @@
+import io
 import pytest
 import os
 import tarfile
 from unittest.mock import patch, MagicMock
 from bakzip.services.tar_service import create_tar
+from bakzip.services.tree_walker import walk_tree
 
 def test_create_tar_os_error(capsys):
     """
@@ -67,3 +69,63 @@ def test_create_tar_success(tmpdir):
     with tarfile.open(output, "r:gz") as tar:
         names = tar.getnames()
         assert "test.txt" in names
+
+def test_create_tar_from_file_entries_matches_paths(tmpdir):
+    """
+    Test that members built from scan-time stat data match those of tar.add.
+    """
+    src = tmpdir.mkdir("src")
+    src.join("a.txt").write("hello\n" * 100)
+    os.link(str(src.join("a.txt")), str(src.join("b.txt")))
+    os.symlink("a.txt", str(src.join("c.txt")))
+    entries = list(walk_tree(str(src)))
+
+    def members(path):
+        with tarfile.open(path) as tar:
+            return [(m.name, m.type, m.mode, m.size, m.mtime, m.linkname, m.uname) for m in tar.getmembers()]
+
+    with patch("bakzip.services.tar_service.tqdm", side_effect=lambda x, **kwargs: x):
+        create_tar([e.path for e in entries], str(tmpdir.join("paths.tar")), None, base_dir=str(src), read_ahead=0)
+        with patch("os.lstat", side_effect=AssertionError("lstat'ed again")):
+            create_tar(entries, str(tmpdir.join("entries.tar")), None, base_dir=str(src), read_ahead=0)
+
+    assert members(str(tmpdir.join("entries.tar"))) == members(str(tmpdir.join("paths.tar")))
+    assert tmpdir.join("entries.tar").read_binary() == tmpdir.join("paths.tar").read_binary()
+
+class _Pipe:
+    """A write-only stream that cannot seek or tell, like stdout redirected to a pipe."""
+
+    def __init__(self):
+        self.data = bytearray()
+
+    def write(self, data):
+        self.data += data
+        return len(data)
+
+    def flush(self):
+        pass
+
+@pytest.mark.parametrize("compression, mode, jobs", [(None, "r:", 1), ("gz", "r:gz", 1), ("gz", "r:gz", 2),
+                                                     ("xz", "r:xz", 1)])
+def test_create_tar_streams_to_a_pipe(tmpdir, compression, mode, jobs):
+    """
+    Test that TAR archives can be written to a stream that cannot seek.
+    """
+    src = tmpdir.mkdir("src")
+    for n in range(4):
+        src.join(f"f{n}.txt").write(f"content {n} " * 2000)
+    pipe = _Pipe()
+
+    with patch("bakzip.services.tar_service.tqdm", side_effect=lambda x, **kwargs: x):
+        create_tar(list(walk_tree(str(src))), pipe, compression, base_dir=str(src), jobs=jobs)
+
+    with tarfile.open(fileobj=io.BytesIO(bytes(pipe.data)), mode=mode) as tar:
+        assert tar.getnames() == ["f0.txt", "f1.txt", "f2.txt", "f3.txt"]
+        assert tar.extractfile("f3.txt").read() == src.join("f3.txt").read_binary()
+
+def test_create_tar_rejects_checkpoints_for_streams():
+    """
+    Test that a streamed TAR archive cannot be checkpointed.
+    """
+    with pytest.raises(ValueError, match="not a stream"):
+        create_tar([], _Pipe(), "gz", checkpoint=MagicMock())
@@ -0,0 +1,59 @@
+import os
+import stat
+from bakzip.services.tree_walker import scan_tree, split_entry, walk_tree
+
+
+def _make_tree(tmpdir):
+    for rel in ["b.txt", "a.txt", "z/1.txt", "z/deep/2.txt", "m/3.txt", "node_modules/pkg/index.js"]:
+        path = tmpdir.join(*rel.split("/"))
+        path.dirpath().ensure(dir=True)
+        path.write(rel)
+
+
+def test_walk_tree_is_sorted_depth_first(tmpdir):
+    _make_tree(tmpdir)
+    rel_paths = [e.rel_path for e in walk_tree(str(tmpdir), jobs=4)]
+    expected = ["a.txt", "b.txt", "m/3.txt", "node_modules/pkg/index.js", "z/1.txt", "z/deep/2.txt"]
+    assert rel_paths == [p.replace("/", os.sep) for p in expected]
+
+
+def test_walk_tree_prunes_ignored_directories_before_listing(tmpdir):
+    _make_tree(tmpdir)
+    seen = []
+
+    def ignore(rel_path, is_dir):
+        seen.append(rel_path)
+        return is_dir and os.path.basename(rel_path) == "node_modules"
+
+    rel_paths = [e.rel_path for e in walk_tree(str(tmpdir), ignore)]
+    assert not any(p.startswith("node_modules") for p in rel_paths)
+    assert not any(p.startswith("node_modules" + os.sep) for p in seen)
+
+    root = next(scan_tree(str(tmpdir), ignore))
+    assert [(e.rel_path, e.stat) for e in root.pruned] == [("node_modules", None)]
+
+
+def test_scan_tree_reports_skipped_files_with_stat(tmpdir):
+    _make_tree(tmpdir)
+    listings = list(scan_tree(str(tmpdir), lambda rel_path, is_dir: rel_path == "b.txt"))
+    root = listings[0]
+    assert root.path == str(tmpdir)
+    assert [e.rel_path for e in root.skipped] == ["b.txt"]
+    assert root.skipped[0].stat.st_size == len("b.txt")
+    assert all(e.stat is not None for listing in listings for e in listing.files)
+
+
+def test_walk_tree_does_not_follow_symlinked_directories(tmpdir):
+    _make_tree(tmpdir)
+    os.symlink(str(tmpdir.join("z")), str(tmpdir.join("link")))
+    rel_paths = [e.rel_path for e in walk_tree(str(tmpdir))]
+    assert not any(p.startswith("link") for p in rel_paths)
+
+
+def test_file_entries_carry_the_lstat_of_symlinks(tmpdir):
+    tmpdir.join("a.txt").write("a")
+    os.symlink("a.txt", str(tmpdir.join("link")))
+    entries = {e.rel_path: e for e in walk_tree(str(tmpdir))}
+    assert stat.S_ISLNK(entries["link"].stat.st_mode)
+    assert split_entry(entries["a.txt"]) == (str(tmpdir.join("a.txt")), entries["a.txt"].stat)
+    assert split_entry("plain/path") == ("plain/path", None)
@@ -0,0 +1,101 @@
+import os
+import struct
+import pytest
+from bakzip.services import inotify
+from bakzip.services.manifest import load_manifest, write_manifest
+from bakzip.services.watch_service import ChangeJournal, TreeWatcher, apply_journal
+
+
+def _watcher(directory):
+    try:
+        return TreeWatcher(directory)
+    except OSError:
+        pytest.skip("inotify is not available")
+
+
+def _drain(watcher):
+    while watcher.poll(timeout=0.2):
+        pass
+
+
+def test_parse_events():
+    buffer = struct.pack('iIII', 1, inotify.IN_CREATE, 0, 8) + b'a.txt\0\0\0'
+    buffer += struct.pack('iIII', 2, inotify.IN_Q_OVERFLOW, 0, 0)
+    assert inotify.parse_events(buffer) == [
+        inotify.InotifyEvent(1, inotify.IN_CREATE, 0, 'a.txt'),
+        inotify.InotifyEvent(2, inotify.IN_Q_OVERFLOW, 0, ''),
+    ]
+
+
+def test_journal_tracks_sizes_and_deleted_trees():
+    journal = ChangeJournal()
+    assert not journal
+    journal.change("a", 10)
+    journal.change("a", 30)
+    journal.change(os.path.join("d", "b"), 5)
+    journal.delete_tree("d")
+    assert journal.bytes == 30
+    assert journal.deleted == {os.path.join("d", "b")}
+    assert journal.deleted_dirs == {"d"}
+    journal.clear()
+    assert not journal and journal.bytes == 0
+
+
+def test_watcher_records_changes_outside_ignored_paths(tmpdir):
+    src = tmpdir.mkdir("src")
+    src.join(".bakzipignore").write("*.log\nbuild/\n")
+    src.join("old.txt").write("old")
+    src.mkdir("build")
+    with _watcher(str(src)) as watcher:
+        src.join("a.txt").write("hello")
+        src.join("skip.log").write("ignored")
+        src.join("build", "out.o").write("ignored")
+        src.mkdir("new").mkdir("deep").join("b.txt").write("nested")
+        src.join("old.txt").remove()
+        _drain(watcher)
+        journal = watcher.journal
+
+    assert set(journal.changed) == {"a.txt", os.path.join("new", "deep", "b.txt")}
+    assert journal.bytes == len("hello") + len("nested")
+    assert journal.deleted == {"old.txt"}
+    assert not journal.rescan
+
+
+def test_watcher_requests_rescan_when_ignore_rules_change(tmpdir):
+    src = tmpdir.mkdir("src")
+    with _watcher(str(src)) as watcher:
+        src.join(".bakzipignore").write("*.tmp\n")
+        _drain(watcher)
+        assert watcher.journal.rescan
+
+
+def test_moved_directory_is_deleted_and_recreated(tmpdir):
+    src = tmpdir.mkdir("src")
+    src.mkdir("a").join("f.txt").write("f")
+    files = {"a/f.txt": [1, 0, 0, None]}
+    with _watcher(str(src)) as watcher:
+        src.join("a").rename(src.join("b"))
+        _drain(watcher)
+        to_archive, deleted = apply_journal(str(src), watcher.journal, files)
+
+    assert to_archive == [str(src.join("b", "f.txt"))]
+    assert deleted == ["a/f.txt"]
+    assert list(files) == ["b/f.txt"]
+
+
+def test_apply_journal_skips_unchanged_files_and_writes_manifest(tmpdir):
+    src = tmpdir.mkdir("src")
+    src.join("same.txt").write("same")
+    st = os.stat(str(src.join("same.txt")))
+    files = {"same.txt": [st.st_size, st.st_mtime_ns, st.st_ino, None]}
+    journal = ChangeJournal()
+    journal.change("same.txt")
+    journal.delete("never-existed.txt")
+
+    assert apply_journal(str(src), journal, files) == ([], [])
+
+    output = str(tmpdir.join("delta.zip"))
+    write_manifest(output, files, ["gone.txt"], base="full.zip")
+    header, loaded, deleted = load_manifest(output)
+    assert (header["kind"], header["base"]) == ("incremental", "full.zip")
+    assert loaded == files and deleted == ["gone.txt"]
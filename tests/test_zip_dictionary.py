@@ -0,0 +1,91 @@
+import json
+import zipfile
+import pytest
+from unittest.mock import patch
+from bakzip.services.checkpoint import Checkpoint
+from bakzip.services.directory_processor import catalog_directory
+from bakzip.services.restore_service import restore_chain
+from bakzip.services.zip_dictionary import DICTIONARY_NAME, DictionaryZipReader, sample_files, train_dictionary
+from bakzip.services.zip_service import create_zip
+
+zstandard = pytest.importorskip("zstandard")
+
+
+def _tree(tmpdir, count=300):
+    # Small JSON records sharing their keys and values, like configs or API dumps.
+    src = tmpdir.mkdir("src")
+    for n in range(count):
+        record = {"id": n, "name": f"user{n}", "email": f"user{n}@example.com", "active": n % 2 == 0,
+                  "roles": ["reader", "writer"][:n % 2 + 1], "settings": {"theme": "dark", "language": "en"}}
+        src.ensure(f"d{n % 10}", dir=True).join(f"user{n}.json").write(json.dumps(record, indent=2))
+    return src
+
+
+def _zip(src, output, **kwargs):
+    with patch("bakzip.services.zip_service.tqdm", side_effect=lambda x, **kw: x):
+        create_zip(catalog_directory(str(src), None)[0], output, compression='zstd', read_ahead=0, **kwargs)
+
+
+def test_train_dictionary_needs_enough_samples(tmpdir):
+    catalog = catalog_directory(str(_tree(tmpdir)), None)[0]
+    samples = sample_files(catalog)
+    assert len(samples) == 300
+    assert len(sample_files(catalog, max_bytes=2000)) < 30
+    assert train_dictionary(samples) is not None
+    assert train_dictionary(samples[:3]) is None
+
+
+def test_dictionary_members_are_smaller_and_read_one_by_one(tmpdir):
+    src = _tree(tmpdir)
+    catalog = catalog_directory(str(src), None)[0]
+    dictionary = train_dictionary(sample_files(catalog))
+    plain, trained = str(tmpdir.join("plain.zip")), str(tmpdir.join("dict.zip"))
+    _zip(src, plain)
+    _zip(src, trained, jobs=2, dictionary=dictionary)
+
+    def members_size(archive):
+        with zipfile.ZipFile(archive) as zf:
+            return sum(info.compress_size for info in zf.infolist() if info.filename != DICTIONARY_NAME)
+
+    assert members_size(trained) < members_size(plain) / 2
+    with zipfile.ZipFile(trained) as zf:
+        assert zf.namelist()[0] == DICTIONARY_NAME
+        assert zf.read(DICTIONARY_NAME) == dictionary.as_bytes()
+    with DictionaryZipReader(trained) as reader:
+        assert len(reader.namelist()) == 300
+        assert reader.read("d7/user157.json") == src.join("d7", "user157.json").read_binary()
+
+    dest = tmpdir.join("restored")
+    restore_chain([trained], str(dest))
+    assert not dest.join(DICTIONARY_NAME).exists()
+    assert dest.join("d3", "user3.json").read() == src.join("d3", "user3.json").read()
+
+
+def _failing(files, after):
+    for n, file in enumerate(files):
+        if n == after:
+            raise OSError("disk unplugged")
+        yield file
+
+
+def test_resume_keeps_the_dictionary_of_the_archive(tmpdir):
+    src = _tree(tmpdir, count=100)
+    catalog = catalog_directory(str(src), None)[0]
+    output = str(tmpdir.join("a.zip"))
+    first = train_dictionary(sample_files(catalog), size=2048)
+    assert first is not None
+    checkpoint = Checkpoint.start(output, {}, interval=0)
+    with pytest.raises(OSError), patch("bakzip.services.zip_service.tqdm", side_effect=lambda x, **kw: x):
+        create_zip(_failing(catalog, 20), output, compression='zstd', base_dir=str(src), read_ahead=0,
+                   checkpoint=checkpoint, dictionary=first)
+    checkpoint.close()
+
+    # The resumed run trains another dictionary, but the committed members need the first one.
+    resumed = Checkpoint.resume(output, {}, interval=0)
+    _zip(src, output, checkpoint=resumed, dictionary=train_dictionary(sample_files(catalog), size=1024))
+    resumed.finish()
+    with DictionaryZipReader(output) as reader:
+        assert reader.dictionary.as_bytes() == first.as_bytes()
+        assert len(reader.namelist()) == 100
+        for name in reader.namelist():
+            assert reader.read(name) == src.join(*name.split("/")).read_binary()
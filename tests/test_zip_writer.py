@@ -0,0 +1,136 @@
+import io
+import os
+import struct
+import zipfile
+import pytest
+from unittest.mock import patch
+from bakzip.services import zip_writer
+from bakzip.services.tree_walker import walk_tree
+from bakzip.services.zip_service import create_zip
+
+
+def _make_tree(tmpdir):
+    tmpdir.join("a.txt").write("hello " * 1000)
+    sub = tmpdir.mkdir("sub")
+    sub.join("b.bin").write_binary(os.urandom(4096))
+    sub.join("ü.txt").write("unicode name")
+    return [str(tmpdir.join("a.txt")), str(sub.join("b.bin")), str(sub.join("ü.txt"))]
+
+
+def test_zip_stream_writer_produces_valid_archive(tmpdir):
+    files = _make_tree(tmpdir)
+    output = str(tmpdir.join("out.zip"))
+    with open(output, "wb") as out, zip_writer.ZipStreamWriter(out) as writer:
+        for method, file in zip((zip_writer.ZIP_DEFLATED, zip_writer.ZIP_BZIP2, zip_writer.ZIP_LZMA), files):
+            arcname = os.path.relpath(file, str(tmpdir)).replace(os.sep, "/")
+            writer.add_member(zip_writer.compress_member(file, arcname, method))
+
+    with zipfile.ZipFile(output) as zf:
+        assert zf.testzip() is None
+        assert zf.namelist() == ["a.txt", "sub/b.bin", "sub/ü.txt"]
+        assert zf.read("a.txt") == b"hello " * 1000
+        assert zf.getinfo("sub/b.bin").compress_type == zipfile.ZIP_BZIP2
+
+
+def test_zip_stream_writer_stored_member(tmpdir):
+    files = _make_tree(tmpdir)
+    output = str(tmpdir.join("out.zip"))
+    with open(output, "wb") as out, zip_writer.ZipStreamWriter(out) as writer:
+        writer.add_member(zip_writer.compress_member(files[0], "a.txt", zip_writer.ZIP_STORED))
+
+    with zipfile.ZipFile(output) as zf:
+        info = zf.getinfo("a.txt")
+        assert info.compress_type == zipfile.ZIP_STORED
+        assert info.compress_size == info.file_size
+
+
+def test_create_zip_parallel_matches_input_order(tmpdir):
+    files = _make_tree(tmpdir)
+    output = str(tmpdir.join("parallel.zip"))
+    with patch("bakzip.services.zip_service.tqdm", side_effect=lambda x, **kwargs: x):
+        create_zip(files, output, None, 'normal', base_dir=str(tmpdir), jobs=4)
+
+    with zipfile.ZipFile(output) as zf:
+        assert zf.testzip() is None
+        assert zf.namelist() == ["a.txt", "sub/b.bin", "sub/ü.txt"]
+        assert zf.read("sub/ü.txt") == b"unicode name"
+
+
+def test_create_zip_parallel_skips_unreadable_file(tmpdir, capsys):
+    files = _make_tree(tmpdir) + [str(tmpdir.join("missing.txt"))]
+    output = str(tmpdir.join("parallel.zip"))
+    with patch("bakzip.services.zip_service.tqdm", side_effect=lambda x, **kwargs: x):
+        create_zip(files, output, None, 'normal', base_dir=str(tmpdir), jobs=2)
+
+    assert "Error adding" in capsys.readouterr().out
+    with zipfile.ZipFile(output) as zf:
+        assert len(zf.namelist()) == 3
+
+
+def test_create_zip_uses_the_stat_data_of_file_entries(tmpdir):
+    _make_tree(tmpdir)
+    entries = list(walk_tree(str(tmpdir)))
+    output = str(tmpdir.join("entries.zip"))
+    with patch("bakzip.services.zip_service.tqdm", side_effect=lambda x, **kwargs: x), \
+            patch("os.stat", side_effect=AssertionError("stat'ed again")):
+        create_zip(entries, output, None, 'normal', base_dir=str(tmpdir), jobs=2)
+
+    with zipfile.ZipFile(output) as zf:
+        assert zf.namelist() == ["a.txt", "sub/b.bin", "sub/ü.txt"]
+        assert zf.read("a.txt") == b"hello " * 1000
+
+
+class _Pipe:
+    """A write-only stream that cannot seek or tell, like stdout redirected to a pipe."""
+
+    def __init__(self):
+        self.data = bytearray()
+
+    def write(self, data):
+        self.data += data
+        return len(data)
+
+    def flush(self):
+        pass
+
+
+def test_create_zip_streams_large_members_with_data_descriptors(tmpdir):
+    _make_tree(tmpdir)
+    pipe = _Pipe()
+    with patch("bakzip.services.zip_service.tqdm", side_effect=lambda x, **kwargs: x), \
+            patch("bakzip.services.zip_writer.STREAM_MIN_SIZE", 4000), \
+            patch("bakzip.services.zip_writer.compress_member", wraps=zip_writer.compress_member) as compress:
+        create_zip(walk_tree(str(tmpdir)), pipe, None, 'normal', base_dir=str(tmpdir), jobs=2)
+
+    # Only the small member went through a spooled payload.
+    assert [call.args[1] for call in compress.call_args_list] == ["sub/ü.txt"]
+    with zipfile.ZipFile(io.BytesIO(bytes(pipe.data))) as zf:
+        assert zf.testzip() is None
+        assert zf.namelist() == ["a.txt", "sub/b.bin", "sub/ü.txt"]
+        assert zf.getinfo("a.txt").flag_bits & 0x08
+        assert not zf.getinfo("sub/ü.txt").flag_bits & 0x08
+        assert zf.read("sub/b.bin") == tmpdir.join("sub", "b.bin").read_binary()
+
+
+def test_add_streamed_uses_zip64_descriptors_for_huge_files(tmpdir):
+    files = _make_tree(tmpdir)
+    st = os.stat(files[0])
+    huge = os.stat_result((st.st_mode, 0, 0, 1, 0, 0, 5 << 30, 0, int(st.st_mtime), 0))
+    pipe = _Pipe()
+    with zip_writer.ZipStreamWriter(pipe) as writer:
+        entry, member = writer.add_streamed(files[0], "a.txt", st=huge)
+
+    data = bytes(pipe.data)
+    descriptor = data.index(b"PK\x07\x08")
+    assert data[descriptor:descriptor + 24] == struct.pack("<4sIQQ", b"PK\x07\x08", member.crc,
+                                                           member.compress_size, member.file_size)
+    assert descriptor == 30 + len("a.txt") + 20 + member.compress_size
+    with zipfile.ZipFile(io.BytesIO(data)) as zf:
+        assert zf.read("a.txt") == b"hello " * 1000
+
+
+def test_create_zip_rejects_checkpoints_and_dedup_for_streams():
+    with pytest.raises(ValueError, match="not a stream"):
+        create_zip([], _Pipe(), None, 'normal', checkpoint=object())
+    with pytest.raises(ValueError, match="not a stream"):
+        create_zip([], _Pipe(), None, 'normal', dedup=object())